@@ -0,0 +1,81 @@
+"""Hot/cold tiering of reports
+
+Old reports (and, where configured, resolved ones after a short grace period)
+are moved out of the live `items` collection into `items_archive` in batches, so the indexes and
+documents that regular queries touch stay small enough to remain in cache.
+Their images can optionally move to the `fs_archive` GridFS bucket as well.
+
+Configuration (environment variables):
+    ARCHIVE_AFTER_DAYS           archive any report older than this (0 disables, default 180)
+    ARCHIVE_RESOLVED_STATUSES    comma separated statuses that count as resolved (default none: the app
+                                 only writes Lost and Found, so this rule is off unless a deployment
+                                 adds resolution statuses of its own)
+    ARCHIVE_RESOLVED_AFTER_DAYS  archive resolved reports older than this (default 7)
+    ARCHIVE_IMAGES               also move images to the archive bucket (default false)
+    ARCHIVE_INTERVAL_MINUTES     run the background job every N minutes (0 disables, default 0)
+    ARCHIVE_BATCH_SIZE           documents moved per batch (default 500)
+    ARCHIVE_PAUSE_SECONDS        pause between batches (default 0.5)
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+import leases
+import mongodb as db
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_RESOLVED_STATUSES = [
+    status.strip() for status in os.getenv("ARCHIVE_RESOLVED_STATUSES", "").split(",") if status.strip()
+]
+ARCHIVE_RESOLVED_AFTER_DAYS = int(os.getenv("ARCHIVE_RESOLVED_AFTER_DAYS", "7"))
+ARCHIVE_IMAGES = os.getenv("ARCHIVE_IMAGES", "false").lower() in ("1", "true", "yes")
+ARCHIVE_INTERVAL_MINUTES = int(os.getenv("ARCHIVE_INTERVAL_MINUTES", "0"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_PAUSE_SECONDS = float(os.getenv("ARCHIVE_PAUSE_SECONDS", "0.5"))
+
+def archive_filter(now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Build the query selecting live items the policy wants archived (None if the policy is disabled)"""
+    now = now or datetime.utcnow()
+    clauses = []
+    if ARCHIVE_AFTER_DAYS > 0:
+        clauses.append({"timestamp": {"$lt": now - timedelta(days=ARCHIVE_AFTER_DAYS)}})
+    if ARCHIVE_RESOLVED_STATUSES:
+        clauses.append({
+            "status": {"$in": ARCHIVE_RESOLVED_STATUSES},
+            "timestamp": {"$lt": now - timedelta(days=ARCHIVE_RESOLVED_AFTER_DAYS)}
+        })
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+def run_archive(dry_run: bool = False, max_batches: Optional[int] = None,
+                batch_size: int = ARCHIVE_BATCH_SIZE, move_images: bool = ARCHIVE_IMAGES) -> Dict[str, Any]:
+    """Archive qualifying items batch by batch until none are left (or max_batches is reached)"""
+    mongo_db = db.get_mongodb()
+    query = archive_filter()
+    report = {"dry_run": dry_run, "items": 0, "images": 0, "batches": 0}
+    if query is None or mongo_db.client is None:
+        return report
+
+    if dry_run:
+        report["items"] = mongo_db.count_archivable_items(query)
+        return report
+
+    while max_batches is None or report["batches"] < max_batches:
+        moved = mongo_db.archive_items(query, batch_size, move_images)
+        if not moved["items"]:
+            break
+        report["items"] += moved["items"]
+        report["images"] += moved["images"]
+        report["batches"] += 1
+        # Keep the archive job from crowding out regular traffic
+        time.sleep(ARCHIVE_PAUSE_SECONDS)
+
+    if report["items"]:
+        print(f"🗄️ Archived {report['items']} items and {report['images']} images")
+    return report
+
+def archive_loop():
+    """Background job: apply the archive policy every ARCHIVE_INTERVAL_MINUTES (in one worker at a time)"""
+    leases.run_periodically("archiver", ARCHIVE_INTERVAL_MINUTES * 60, run_archive)
@@ -0,0 +1,269 @@
+"""Bulk import of legacy reports
+
+Rows are read as a stream from NDJSON or CSV, images come from an optional zip
+archive and are written to the image store in parallel, and documents are saved
+with batched insert_many. Classification goes through the background queue.
+
+Progress is checkpointed per batch in the `imports` collection, and every row
+carries an `import_ref` under a unique index, so re-running an interrupted
+import with the same import ID resumes where it stopped without duplicates.
+A batch whose images can't be written to the image store stops the import
+before its checkpoint, so resuming retries those rows.
+
+Usage:
+    python bulk_import.py reports.ndjson --images photos.zip --import-id north-campus
+"""
+import argparse
+import csv
+import json
+import os
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+import classify_queue
+import image_pool
+import image_utils
+import mongodb as db
+from model import ReportItem
+
+BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMAGE_WORKERS = int(os.getenv("IMPORT_IMAGE_WORKERS", "8"))
+# Errors returned in the API response (the import record keeps its own capped list)
+MAX_REPORTED_ERRORS = 200
+
+ITEM_FIELDS = ("title", "description", "category", "location", "status", "name", "contact")
+
+def detect_format(filename: str) -> str:
+    """Guess the row format from a file name"""
+    return "csv" if (filename or "").lower().endswith(".csv") else "ndjson"
+
+def _decode_lines(stream: IO[bytes], bad_lines: set) -> Iterator[str]:
+    """Decode the stream line by line, noting lines that aren't valid UTF-8 instead of failing"""
+    for line_number, raw in enumerate(stream, start=1):
+        try:
+            yield raw.decode("utf-8-sig" if line_number == 1 else "utf-8")
+        except UnicodeDecodeError:
+            bad_lines.add(line_number)
+            yield raw.decode("utf-8", errors="replace")
+
+def iter_rows(stream: IO[bytes], fmt: str) -> Iterator[tuple]:
+    """Yield (row_number, row, error) for each data row without reading the whole stream"""
+    bad_lines = set()
+    lines = _decode_lines(stream, bad_lines)
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        if reader.fieldnames and bad_lines:
+            # Every row is read through the header, so there's nothing to salvage
+            raise ValueError("CSV header is not valid UTF-8")
+        last_line = reader.line_num
+        for row_number, row in enumerate(reader, start=1):
+            # A quoted field can span several physical lines
+            first_line, last_line = last_line + 1, reader.line_num
+            if bad_lines.intersection(range(first_line, last_line + 1)):
+                yield row_number, None, "Invalid UTF-8 in row"
+            else:
+                yield row_number, row, None
+    else:
+        row_number = 0
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            row_number += 1
+            if line_number in bad_lines:
+                yield row_number, None, "Invalid UTF-8 in row"
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("row must be a JSON object")
+                yield row_number, row, None
+            except ValueError as e:
+                yield row_number, None, f"Invalid JSON: {e}"
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+def _prepare_row(row: Dict[str, Any], row_number: int, import_id: str, images: Optional[zipfile.ZipFile]) -> Dict[str, Any]:
+    """Validate a row and work out its import reference and image entry"""
+    fields = {key: row[key] for key in ITEM_FIELDS if row.get(key) not in (None, "")}
+    item = ReportItem(**fields)
+
+    image_name = row.get("image") or None
+    if image_name:
+        if images is None:
+            raise ValueError(f"Row references image '{image_name}' but no image archive was provided")
+        images.getinfo(image_name)  # KeyError if missing from the archive
+
+    external_id = row.get("external_id")
+    return {
+        "row": row_number,
+        "item": item,
+        "image_name": image_name,
+        "timestamp": _parse_timestamp(row.get("timestamp")),
+        # Rows with their own ID dedupe across imports, others within this import
+        "import_ref": f"ext:{external_id}" if external_id else f"{import_id}:{row_number}",
+    }
+
+def _store_images(batch: List[Dict], images: zipfile.ZipFile, pool: ThreadPoolExecutor, mongo_db, errors: List[Dict]):
+    """Store the batch's images in the image store, a few at a time so memory stays bounded
+    
+    Feature vectors for visual search are computed in the image process pool
+    while the writes are in flight.
+    """
+    pending = [prepared for prepared in batch if prepared["image_name"]]
+    window = IMAGE_WORKERS * 2
+    for start in range(0, len(pending), window):
+        futures = []
+        for prepared in pending[start:start + window]:
+            try:
+                data = images.read(prepared["image_name"])
+                filename = os.path.basename(prepared["image_name"])
+                store_future = pool.submit(mongo_db.store_image, data, filename)
+            except Exception as e:
+                prepared["failed"] = True
+                errors.append({"row": prepared["row"], "error": f"Could not read image: {e}"})
+                continue
+            try:
+                features_future = image_pool.submit(image_utils.extract_features_from_bytes, data)
+            except image_pool.PoolFull:
+                # The pool is busy with interactive requests; imports can afford to wait
+                features_future = pool.submit(image_utils.extract_features_from_bytes, data)
+            futures.append((prepared, store_future, features_future))
+        stored = True
+        for prepared, store_future, features_future in futures:
+            try:
+                prepared["image_file_id"] = store_future.result()
+            except Exception as e:
+                # Not the row's fault: the batch is retried when the import resumes
+                prepared["store_error"] = e
+                stored = False
+            try:
+                prepared["features"] = features_future.result()
+            except Exception as e:
+                print(f"Error extracting features for row {prepared['row']}: {e}")
+        if not stored:
+            return
+
+def _commit_batch(batch: List[Dict], images, pool, mongo_db, counters: Dict[str, int], errors: List[Dict]) -> List[str]:
+    """Write one batch, returning the IDs of inserted items that need classification"""
+    existing = mongo_db.find_existing_import_refs([prepared["import_ref"] for prepared in batch])
+    todo = [prepared for prepared in batch if prepared["import_ref"] not in existing]
+    counters["skipped"] += len(batch) - len(todo)
+
+    if images is not None:
+        _store_images(todo, images, pool, mongo_db, errors)
+        stuck = next((prepared for prepared in todo if prepared.get("store_error")), None)
+        if stuck is not None:
+            # Leave the checkpoint before this batch, without the images it did store
+            for prepared in todo:
+                if prepared.get("image_file_id"):
+                    mongo_db.delete_image(prepared["image_file_id"])
+            raise RuntimeError(f"Could not store the image of row {stuck['row']}: {stuck['store_error']}")
+    failed = [prepared for prepared in todo if prepared.get("failed")]
+    counters["failed"] += len(failed)
+    todo = [prepared for prepared in todo if not prepared.get("failed")]
+
+    documents = []
+    for prepared in todo:
+        image_file_id = prepared.get("image_file_id")
+        document = mongo_db.build_item_document(
+            prepared["item"], image_file_id, None, prepared["timestamp"], features=prepared.get("features")
+        )
+        document["import_ref"] = prepared["import_ref"]
+        if image_file_id:
+            document["classification_pending"] = True
+        documents.append(document)
+
+    inserted, duplicates = mongo_db.insert_items_bulk(documents)
+    for index in duplicates:
+        # Another run got there first - drop the image we just stored for it
+        if todo[index].get("image_file_id"):
+            mongo_db.delete_image(todo[index]["image_file_id"])
+    counters["inserted"] += len(inserted)
+    counters["skipped"] += len(duplicates)
+
+    return [item_id for index, item_id in inserted.items() if documents[index].get("classification_pending")]
+
+def run_import(stream: IO[bytes], fmt: str = "ndjson", images: Optional[zipfile.ZipFile] = None,
+               import_id: Optional[str] = None, batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+    """Import rows from a stream, resuming from the last checkpoint of import_id"""
+    mongo_db = db.get_mongodb()
+    if mongo_db.client is None:
+        raise RuntimeError("Database not available")
+
+    import_id = import_id or uuid.uuid4().hex
+    state = mongo_db.get_import_state(import_id) or {}
+    resume_after = state.get("rows_committed", 0)
+    counters = {key: state.get(key, 0) for key in ("inserted", "skipped", "failed")}
+    mongo_db.save_import_state(import_id, {"status": "running", "format": fmt, "rows_committed": resume_after, **counters})
+    if resume_after:
+        print(f"🔄 Resuming import {import_id} after row {resume_after}")
+
+    reported_errors = []
+    batch = []
+    batch_errors = []
+    last_row = resume_after
+
+    def flush():
+        to_classify = _commit_batch(batch, images, pool, mongo_db, counters, batch_errors) if batch else []
+        mongo_db.save_import_state(import_id, {"rows_committed": last_row, **counters}, batch_errors)
+        classify_queue.enqueue(to_classify)
+        reported_errors.extend(batch_errors[:MAX_REPORTED_ERRORS - len(reported_errors)])
+        batch.clear()
+        batch_errors.clear()
+
+    try:
+        with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as pool:
+            for row_number, row, error in iter_rows(stream, fmt):
+                if row_number <= resume_after:
+                    continue
+                last_row = row_number
+                if error is None:
+                    try:
+                        batch.append(_prepare_row(row, row_number, import_id, images))
+                    except Exception as e:
+                        error = str(e)
+                if error is not None:
+                    counters["failed"] += 1
+                    batch_errors.append({"row": row_number, "error": error})
+                if len(batch) >= batch_size:
+                    flush()
+            flush()
+    except Exception as e:
+        # The last checkpoint stays, so re-running with the same import ID resumes from it
+        mongo_db.save_import_state(import_id, {"status": "failed", "error": str(e)})
+        print(f"❌ Import {import_id} failed: {e}")
+        raise RuntimeError(f"Import {import_id} failed: {e}") from e
+
+    mongo_db.save_import_state(import_id, {"status": "completed", "error": None, "rows_committed": last_row, **counters})
+    print(f"✅ Import {import_id} finished: {counters}")
+    return {"import_id": import_id, "rows_processed": last_row, **counters, "errors": reported_errors}
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import lost and found reports")
+    parser.add_argument("data", help="NDJSON or CSV file with one report per row")
+    parser.add_argument("--images", help="Zip archive with the images referenced by the 'image' column")
+    parser.add_argument("--import-id", help="ID of the import; reuse it to resume an interrupted run")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="Row format (default: from file extension)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    images = zipfile.ZipFile(args.images) if args.images else None
+    try:
+        with open(args.data, "rb") as stream:
+            result = run_import(stream, args.format or detect_format(args.data), images, args.import_id, args.batch_size)
+    finally:
+        if images is not None:
+            images.close()
+
+    # Let queued classifications finish before the process exits
+    classify_queue.join()
+    print(json.dumps(result, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
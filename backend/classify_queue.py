@@ -0,0 +1,105 @@
+"""Background AI classification queue
+
+Items saved through bulk paths are stored with `classification_pending` set and
+their IDs are queued here. A few worker threads classify them with Gemini and
+write `ai_category` back, so imports never wait on the AI service. Every
+gunicorn worker re-queues pending items on startup; each item is claimed
+atomically before it is classified, so only one of them calls Gemini for it.
+"""
+import os
+import queue
+import threading
+from typing import Iterable
+
+import local_classifier
+import metrics
+import mongodb as db
+
+QUEUE_SIZE = int(os.getenv("CLASSIFY_QUEUE_SIZE", "10000"))
+WORKER_COUNT = int(os.getenv("CLASSIFY_WORKERS", "2"))
+# How long a worker owns an item it started classifying (Gemini waits for a slot without a timeout)
+CLAIM_SECONDS = float(os.getenv("CLASSIFY_CLAIM_SECONDS", "600"))
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_workers = []
+_workers_lock = threading.Lock()
+
+def reset_after_fork():
+    """Start a forked worker with an empty queue (the parent keeps the queued items)"""
+    global _queue, _workers_lock
+    _queue = queue.Queue(maxsize=QUEUE_SIZE)
+    _workers_lock = threading.Lock()
+    _workers.clear()
+
+def depth() -> int:
+    """Number of items waiting in the queue"""
+    return _queue.qsize()
+
+metrics.Gauge("classify_queue_depth", "Items waiting for background classification", callback=depth)
+
+def start():
+    """Start the worker threads (safe to call more than once)"""
+    with _workers_lock:
+        _workers[:] = [worker for worker in _workers if worker.is_alive()]
+        for index in range(len(_workers), WORKER_COUNT):
+            worker = threading.Thread(target=_worker_loop, name=f"classify-worker-{index}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+def enqueue(item_ids: Iterable[str]) -> int:
+    """Queue items for classification, returning how many were accepted
+
+    When the queue is full the remaining items simply stay pending in the
+    database and are picked up later by requeue_pending().
+    """
+    start()
+    accepted = 0
+    for item_id in item_ids:
+        try:
+            _queue.put_nowait(item_id)
+            accepted += 1
+        except queue.Full:
+            break
+    return accepted
+
+def join():
+    """Block until every queued item has been processed"""
+    _queue.join()
+
+def requeue_pending(limit: int = QUEUE_SIZE) -> int:
+    """Queue items left pending by a restart or a full queue"""
+    try:
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            return 0
+        queued = enqueue(mongo_db.find_pending_classification(limit))
+        if queued:
+            print(f"🔄 Re-queued {queued} items for classification")
+        return queued
+    except Exception as e:
+        print(f"Error re-queuing pending classifications: {e}")
+        return 0
+
+def classify_item(item_id: str):
+    """Classify one pending item and store the result (skipped if another worker claimed it)"""
+    mongo_db = db.get_mongodb()
+    item = mongo_db.claim_pending_classification(item_id, CLAIM_SECONDS)
+    if item is None:
+        return
+
+    image_data = mongo_db.get_image(item["image_file_id"]) if item.get("image_file_id") else None
+    category, source = "Uncategorized", None
+    if image_data:
+        # Background work waits for a Gemini slot rather than being turned away
+        category, source = local_classifier.classify(image_data, item.get("features"), wait=None)
+    mongo_db.set_ai_category(item_id, category, classified_by="local" if source == "local" else None)
+
+def _worker_loop():
+    while True:
+        item_id = _queue.get()
+        try:
+            classify_item(item_id)
+        except Exception as e:
+            print(f"Error classifying item {item_id}: {e}")
+        finally:
+            _queue.task_done()
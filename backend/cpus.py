@@ -0,0 +1,50 @@
+"""CPUs this process may actually use
+
+os.cpu_count() reports the host's CPUs, even inside a container limited to a
+fraction of them. The defaults for gunicorn workers (WEB_CONCURRENCY) and
+image pool processes are derived from the container's limits instead: the
+CPU affinity mask and the cgroup CPU quota (v2 cpu.max or v1 cfs_quota_us).
+"""
+import math
+import os
+from typing import Optional
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as handle:
+            return handle.read().strip()
+    except OSError:
+        return None
+
+def _cgroup_quota() -> Optional[float]:
+    """CPUs allowed by the cgroup CPU quota, or None when unlimited or unknown"""
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    quota = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+def available_cpus() -> int:
+    """CPUs usable by this process (at least 1)"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS
+        count = os.cpu_count() or 1
+    try:
+        quota = _cgroup_quota()
+    except ValueError:
+        quota = None
+    if quota:
+        count = min(count, math.ceil(quota))
+    return max(1, count)
+
+def web_concurrency() -> int:
+    """Gunicorn worker processes: WEB_CONCURRENCY, else one per available CPU"""
+    value = os.getenv("WEB_CONCURRENCY")
+    return max(1, int(value)) if value else available_cpus()
@@ -0,0 +1,84 @@
+"""Streaming export of the item catalogue as NDJSON or CSV
+
+Rows are serialized straight from a MongoDB cursor and emitted in ~64KB
+chunks (optionally gzip-compressed on the fly), so memory use stays flat no
+matter how many items are exported.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator
+
+import mongodb as db
+
+EXPORT_FIELDS = [
+    "id", "title", "description", "category", "ai_category", "location",
+    "status", "name", "contact", "image_file_id", "image_url", "timestamp"
+]
+CHUNK_SIZE = 64 * 1024
+
+def export_row(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert an item document to an export row"""
+    mongo_db = db.get_mongodb()
+    timestamp = doc.get("timestamp")
+    if isinstance(timestamp, datetime) and timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)  # PyMongo returns naive UTC
+    return {
+        "id": str(doc["_id"]),
+        "title": doc.get("title", ""),
+        "description": doc.get("description", ""),
+        "category": doc.get("category", ""),
+        "ai_category": doc.get("ai_category") or "",
+        "location": doc.get("location", ""),
+        "status": doc.get("status", ""),
+        "name": doc.get("name", ""),
+        "contact": doc.get("contact", ""),
+        "image_file_id": doc.get("image_file_id") or "",
+        "image_url": mongo_db.generate_image_url(doc.get("image_file_id")) or "",
+        "timestamp": timestamp.isoformat() if isinstance(timestamp, datetime) else str(timestamp or "")
+    }
+
+def _ndjson_chunks(docs: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    buffer = []
+    size = 0
+    for doc in docs:
+        line = json.dumps(export_row(doc), ensure_ascii=False) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+def _csv_chunks(docs: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for doc in docs:
+        writer.writerow(export_row(doc))
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def _gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def stream_export(fmt: str = "ndjson", compress: bool = False, status: str = None,
+                  date_from: datetime = None, date_to: datetime = None, batch_size: int = 1000) -> Iterator[bytes]:
+    """Yield the encoded export body chunk by chunk"""
+    docs = db.iter_items(status, date_from, date_to, batch_size)
+    text_chunks = _csv_chunks(docs) if fmt == "csv" else _ndjson_chunks(docs)
+    chunks = (chunk.encode("utf-8") for chunk in text_chunks)
+    return _gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,120 @@
+"""Facet counts for the live items
+
+GET /facets returns how many items there are per status, canonical category,
+normalised location (location_key) and month. The counts come from one $facet
+aggregation over a covered index scan (see MongoDB.compute_facets) and are
+cached in process.
+
+Writes keep the cache current instead of throwing it away: inserting or
+deleting an item adjusts four counters (record_insert / record_delete), so a
+refresh after a report costs nothing. Changes that can't be applied that way
+(bulk backfills) call invalidate(), and the next read recomputes. Other
+workers' writes aren't seen by this process, so the cache also expires after
+FACETS_TTL_SECONDS.
+"""
+import collections
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+import pytz
+
+import metrics
+
+FACETS_TTL_SECONDS = float(os.getenv("FACETS_TTL_SECONDS", "60"))
+FACET_FIELDS = ("status", "category", "location", "month")
+UNKNOWN = "unknown"
+
+IST = pytz.timezone("Asia/Kolkata")
+
+metrics.register_cache("facets")
+
+def month_value(timestamp) -> str:
+    """IST month bucket ("2024-05") of a stored or freshly built timestamp"""
+    if not isinstance(timestamp, datetime):
+        return UNKNOWN
+    if timestamp.tzinfo is None:
+        # Read back from MongoDB: naive UTC
+        timestamp = pytz.utc.localize(timestamp)
+    return timestamp.astimezone(IST).strftime("%Y-%m")
+
+def facet_values(doc: Dict[str, Any]) -> Dict[str, str]:
+    """The bucket an item document falls into for each facet"""
+    return {
+        "status": doc.get("status") or UNKNOWN,
+        "category": doc.get("category_key") or UNKNOWN,
+        "location": doc.get("location_key") or UNKNOWN,
+        "month": month_value(doc.get("timestamp")),
+    }
+
+class FacetCache:
+    """Facet counters that are recomputed rarely and adjusted on every write"""
+
+    def __init__(self, ttl: float = FACETS_TTL_SECONDS):
+        self.ttl = ttl
+        self._counts: Optional[Dict[str, collections.Counter]] = None
+        self._total = 0
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, compute: Callable[[], Dict[str, Dict[str, int]]]) -> Dict[str, Any]:
+        """Cached facets, calling compute() for fresh counts when the cache is empty or expired"""
+        with self._lock:
+            hit = self._counts is not None and time.monotonic() < self._expires_at
+            if hit:
+                result = self._snapshot()
+        metrics.cache_result("facets", hit)
+        if hit:
+            return result
+
+        counts = compute()
+        with self._lock:
+            self._counts = {field: collections.Counter(counts.get(field, {})) for field in FACET_FIELDS}
+            self._total = sum(self._counts["status"].values())
+            self._expires_at = time.monotonic() + self.ttl
+            return self._snapshot()
+
+    def _snapshot(self) -> Dict[str, Any]:
+        result = {field: dict(self._counts[field].most_common()) for field in FACET_FIELDS}
+        result["total"] = self._total
+        return result
+
+    def _apply(self, doc: Dict[str, Any], delta: int):
+        with self._lock:
+            if self._counts is None:
+                return
+            for field, value in facet_values(doc).items():
+                counter = self._counts[field]
+                counter[value] += delta
+                if counter[value] <= 0:
+                    del counter[value]
+            self._total += delta
+
+    def record_insert(self, doc: Dict[str, Any]):
+        self._apply(doc, 1)
+
+    def record_delete(self, doc: Dict[str, Any]):
+        self._apply(doc, -1)
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+
+_cache = FacetCache()
+
+def get_facets(compute: Callable[[], Dict[str, Dict[str, int]]]) -> Dict[str, Any]:
+    return _cache.get(compute)
+
+def record_insert(doc: Dict[str, Any]):
+    """Count a document just added to the live collection"""
+    _cache.record_insert(doc)
+
+def record_delete(doc: Dict[str, Any]):
+    """Uncount a document just removed from the live collection (needs the facet fields)"""
+    _cache.record_delete(doc)
+
+def invalidate():
+    """Drop the cached counts; the next get_facets recomputes them"""
+    _cache.invalidate()
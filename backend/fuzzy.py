@@ -0,0 +1,216 @@
+"""Typo-tolerant search over item text
+
+An in-process inverted index maps every word of the live items' title,
+category and description to the items containing it, and every character
+trigram to the words containing it. A query word ("walet") is expanded to the
+closest indexed words: candidates sharing trigrams are ranked by trigram
+overlap (Dice coefficient), the best few are checked with a bounded edit
+distance, and prefixes of longer words ("calc" -> "calculator") also count.
+Items score the best match of each query word, weighted by the field it
+appears in; only the top results are loaded from MongoDB.
+
+The index is built in the background once MongoDB is connected and kept
+current by live_index (FUZZY_SYNC_SECONDS, FUZZY_REBUILD_MINUTES).
+"""
+import collections
+import heapq
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import live_index
+import metrics
+
+FUZZY_SYNC_SECONDS = float(os.getenv("FUZZY_SYNC_SECONDS", "30"))
+FUZZY_REBUILD_MINUTES = float(os.getenv("FUZZY_REBUILD_MINUTES", "60"))
+MAX_EXPANSIONS = 8  # Indexed words a query word may match
+MAX_CANDIDATES = 32  # Words checked with edit distance per query word
+MIN_DICE = 0.2
+MAX_DESCRIPTION_WORDS = 50
+
+# Field weights: a match in the title counts most
+FIELD_WEIGHTS = (("title", 3), ("category", 2), ("ai_category", 2), ("description", 1))
+MAX_WEIGHT = 3
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"a", "an", "the", "and", "or", "of", "with", "in", "on", "at", "to", "for", "my", "is", "it"}
+
+SEARCH_SECONDS = metrics.Histogram("fuzzy_search_duration_seconds", "Time to rank fuzzy search candidates in memory")
+metrics.Gauge("fuzzy_index_items", "Items in the fuzzy search index", callback=lambda: len(_live.index.slots))
+metrics.Gauge("fuzzy_index_words", "Distinct words in the fuzzy search index", callback=lambda: len(_live.index.postings))
+
+def words(text: Optional[str]) -> List[str]:
+    return [word for word in _WORD.findall((text or "").lower()) if word not in _STOPWORDS]
+
+def trigrams(word: str) -> set:
+    padded = f"  {word} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+def max_edits(word: str) -> int:
+    return 1 if len(word) <= 4 else 2 if len(word) <= 8 else 3
+
+def edit_distance(first: str, second: str, limit: int) -> int:
+    """Levenshtein distance, or limit + 1 as soon as it must exceed limit"""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for row, char in enumerate(first, 1):
+        current = [row]
+        for column, other in enumerate(second, 1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1, previous[column - 1] + (char != other)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class FuzzyIndex:
+    """Word postings plus a trigram index over the vocabulary
+
+    Items are numbered by slot in the order they are added (so a higher slot
+    is a newer item after a rebuild), which lets a query score every item in
+    one NumPy array instead of a dictionary walk.
+    """
+
+    def __init__(self):
+        self.slots: Dict[str, int] = {}  # item ID -> slot
+        self.ids: List[Optional[str]] = []  # slot -> item ID (None once removed)
+        # slot -> (status, category_keys, its words)
+        self.meta: List[Optional[Tuple[Optional[str], Tuple[str, ...], Tuple[str, ...]]]] = []
+        self.postings: Dict[str, Dict[int, int]] = {}  # word -> {slot: field weight}
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}  # word -> (slots, weights), built on demand
+        self.word_trigrams: Dict[str, set] = collections.defaultdict(set)  # trigram -> words
+        self.lock = threading.Lock()
+
+    def add(self, doc: Dict[str, Any]):
+        item_id = str(doc["_id"])
+        weights: Dict[str, int] = {}
+        for field, weight in FIELD_WEIGHTS:
+            field_words = words(doc.get(field))
+            if field == "description":
+                field_words = field_words[:MAX_DESCRIPTION_WORDS]
+            for word in field_words:
+                if weights.get(word, 0) < weight:
+                    weights[word] = weight
+        with self.lock:
+            self._remove(item_id)
+            slot = len(self.ids)
+            self.slots[item_id] = slot
+            self.ids.append(item_id)
+            self.meta.append((doc.get("status"), tuple(doc.get("category_keys") or [doc.get("category_key")]),
+                              tuple(weights)))
+            for word, weight in weights.items():
+                posting = self.postings.get(word)
+                if posting is None:
+                    posting = self.postings[word] = {}
+                    for gram in trigrams(word):
+                        self.word_trigrams[gram].add(word)
+                posting[slot] = weight
+                self._arrays.pop(word, None)
+
+    def remove(self, item_id: str):
+        with self.lock:
+            self._remove(item_id)
+
+    def describe(self) -> str:
+        return f"{len(self.slots)} items, {len(self.postings)} words"
+
+    def _remove(self, item_id: str):
+        slot = self.slots.pop(item_id, None)
+        if slot is None:
+            return
+        _, _, item_words = self.meta[slot]
+        self.ids[slot] = None
+        self.meta[slot] = None
+        for word in item_words:
+            posting = self.postings.get(word)
+            if posting is None:
+                continue
+            posting.pop(slot, None)
+            self._arrays.pop(word, None)
+            if not posting:
+                del self.postings[word]
+                for gram in trigrams(word):
+                    self.word_trigrams[gram].discard(word)
+                    if not self.word_trigrams[gram]:
+                        del self.word_trigrams[gram]
+
+    def _posting_arrays(self, word: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(word)
+        if arrays is None:
+            posting = self.postings[word]
+            arrays = self._arrays[word] = (
+                np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                np.fromiter(posting.values(), dtype=np.float32, count=len(posting))
+            )
+        return arrays
+
+    def expand(self, word: str) -> List[Tuple[str, float]]:
+        """Indexed words close to word, with a similarity in (0, 1] (1 = exact)"""
+        grams = trigrams(word)
+        overlap = collections.Counter()
+        for gram in grams:
+            overlap.update(self.word_trigrams.get(gram, ()))
+        scored = []
+        for candidate, shared in overlap.items():
+            dice = 2 * shared / (len(grams) + len(candidate) + 1)  # a padded word has len + 1 trigrams
+            if dice >= MIN_DICE:
+                scored.append((dice, candidate))
+        matches = []
+        for dice, candidate in heapq.nlargest(MAX_CANDIDATES, scored):
+            if candidate == word:
+                matches.append((candidate, 1.0))
+                continue
+            similarity = 0.0
+            limit = max_edits(word)
+            distance = edit_distance(word, candidate, limit)
+            if distance <= limit:
+                similarity = 0.5 * dice + 0.5 * (1 - distance / max(len(word), len(candidate)))
+            if len(word) >= 3 and candidate.startswith(word):
+                similarity = max(similarity, 0.5 + 0.4 * len(word) / len(candidate))
+            if similarity:
+                matches.append((candidate, similarity))
+        return heapq.nlargest(MAX_EXPANSIONS, matches, key=lambda match: match[1])
+
+    def search(self, query: str, limit: int, status: Optional[str] = None,
+               category_keys: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Top (item ID, score) pairs for a query, best first"""
+        category_keys = set(category_keys) if category_keys else None
+        with self.lock:
+            totals = np.zeros(len(self.ids), dtype=np.float32)
+            for word in dict.fromkeys(words(query)):
+                # Each query word counts once per item: its best match there
+                best = np.zeros(len(self.ids), dtype=np.float32)
+                for candidate, similarity in self.expand(word):
+                    slots, weights = self._posting_arrays(candidate)
+                    best[slots] = np.maximum(best[slots], weights * (similarity / MAX_WEIGHT))
+                totals += best
+            matched = np.flatnonzero(totals)
+            # Best score first, ties to the newer item
+            order = matched[np.lexsort((-matched, -totals[matched]))]
+            results = []
+            for slot in order:
+                item_status, item_categories, _ = self.meta[slot]
+                if (status and item_status != status) or (category_keys and category_keys.isdisjoint(item_categories)):
+                    continue
+                results.append((self.ids[slot], float(totals[slot])))
+                if len(results) >= limit:
+                    break
+        return results
+
+_live = live_index.LiveIndex("Fuzzy", FuzzyIndex, FUZZY_SYNC_SECONDS, FUZZY_REBUILD_MINUTES)
+
+is_ready = _live.is_ready
+record_insert = _live.record_insert
+record_delete = _live.record_delete
+rebuild = _live.rebuild
+sync = _live.sync
+start = _live.start
+
+def search(query: str, limit: int = 50, status: Optional[str] = None,
+           category_keys: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+    """Ranked (item ID, score) pairs; empty until the index has been built"""
+    with SEARCH_SECONDS.time():
+        return _live.index.search(query, limit, status, category_keys)
@@ -1,22 +1,116 @@
-
-
-import google.generativeai as genai
 from PIL import Image
 import os
 import requests
+import threading
+import time
 from io import BytesIO
+from typing import Optional
+import image_fetch
+import metrics
+import tracing
+
+MODEL_NAME = 'gemini-1.5-flash'
+
+# Global cap on concurrent Gemini calls in this process, so bursts queue briefly
+# (or are turned away) instead of all hitting the API at once
+CLASSIFY_MAX_CONCURRENT = int(os.getenv("CLASSIFY_MAX_CONCURRENT", "8"))
+# How long an interactive request waits for a free slot before ClassificationBusy
+CLASSIFY_WAIT_SECONDS = float(os.getenv("CLASSIFY_WAIT_SECONDS", "2"))
+_classify_slots = threading.BoundedSemaphore(CLASSIFY_MAX_CONCURRENT)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+class ClassificationBusy(Exception):
+    """Raised when no classification slot frees up within the caller's wait"""
+
+# google.generativeai pulls in grpc and protobuf, which takes seconds to import,
+# so it is loaded and configured on first use (or by warm_up) instead of at import time
+_genai = None
+_model = None
+_genai_lock = threading.Lock()
+
+def _get_model():
+    """Import and configure the Gemini client once, returning the shared model"""
+    global _genai, _model
+    if _model is None:
+        with _genai_lock:
+            if _model is None:
+                import google.generativeai as genai
+                
+                # Configure with your actual API key from environment variable
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    print("Warning: Please set your GEMINI_API_KEY environment variable")
+                    print("You can create a .env file with: GEMINI_API_KEY=your_actual_key")
+                    print("Get your API key from: https://makersuite.google.com/app/apikey")
+                    # Use a placeholder key for testing (will cause API calls to fail but won't crash the app)
+                    api_key = "placeholder_key"
+                
+                genai.configure(api_key=api_key)
+                _genai = genai
+                _model = genai.GenerativeModel(MODEL_NAME)
+    return _model
+
+def has_api_key() -> bool:
+    """Whether a real API key is configured (without one every call fails)"""
+    return bool(os.getenv("GEMINI_API_KEY"))
+
+def reset_after_fork():
+    """Forget the client inherited from a parent process so each worker builds its own"""
+    global _genai, _model, _genai_lock, _classify_slots, _in_flight, _in_flight_lock
+    _genai = None
+    _model = None
+    _genai_lock = threading.Lock()
+    _in_flight = 0
+    _in_flight_lock = threading.Lock()
+    _classify_slots = threading.BoundedSemaphore(CLASSIFY_MAX_CONCURRENT)
+
+def warm_up():
+    """Load the Gemini client ahead of the first classification"""
+    try:
+        _get_model()
+    except Exception as e:
+        print(f"Gemini client warm-up failed: {e}")
+
+def _is_timeout(error: Exception) -> bool:
+    """Whether a Gemini client error was a timeout (DeadlineExceeded, socket/requests timeouts)"""
+    name = type(error).__name__
+    return "Timeout" in name or "DeadlineExceeded" in name or isinstance(error, TimeoutError)
 
-# Configure with your actual API key from environment variable
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    print("Warning: Please set your GEMINI_API_KEY environment variable")
-    print("You can create a .env file with: GEMINI_API_KEY=your_actual_key")
-    print("Get your API key from: https://makersuite.google.com/app/apikey")
-    # Use a placeholder key for testing (will cause API calls to fail but won't crash the app)
-    api_key = "placeholder_key"
+def classifications_in_flight() -> int:
+    return _in_flight
 
-genai.configure(api_key=api_key)
+metrics.Gauge("gemini_in_flight", "Gemini calls currently running", callback=classifications_in_flight)
+CLASSIFY_REJECTED = metrics.Counter("gemini_busy_total", "Classifications turned away by the concurrency cap", ["source"])
+
+def _generate(model, parts: list, source: str, wait: Optional[float] = CLASSIFY_WAIT_SECONDS):
+    """Call model.generate_content, recording latency, errors and timeouts per source
+    
+    Waits up to `wait` seconds for a slot under CLASSIFY_MAX_CONCURRENT (None waits
+    indefinitely, for background work) and raises ClassificationBusy otherwise.
+    """
+    global _in_flight
+    if not _classify_slots.acquire(timeout=wait):
+        CLASSIFY_REJECTED.inc(source=source)
+        raise ClassificationBusy(f"{CLASSIFY_MAX_CONCURRENT} classifications already running")
+    with _in_flight_lock:
+        _in_flight += 1
+    start = time.perf_counter()
+    try:
+        return model.generate_content(parts)
+    except Exception as e:
+        metrics.GEMINI_ERRORS.inc(source=source)
+        if _is_timeout(e):
+            metrics.GEMINI_TIMEOUTS.inc(source=source)
+        raise
+    finally:
+        metrics.GEMINI_SECONDS.observe(time.perf_counter() - start, source=source)
+        with _in_flight_lock:
+            _in_flight -= 1
+        _classify_slots.release()
 
+@metrics.not_mongo
+@tracing.traced("gemini_api.classify_image")
 def classify_image(path: str) -> str:
     try:
         # Check if file exists
@@ -24,18 +118,20 @@ def classify_image(path: str) -> str:
             raise FileNotFoundError(f"Image file not found: {path}")
         
         # Use gemini-1.5-flash model (updated model name)
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        model = _get_model()
         
         # Open and process the image with proper context management
         with Image.open(path) as image:
             # Generate content with the image and prompt
-            response = model.generate_content([
+            response = _generate(model, [
                 image, 
                 "What object is in this image? Respond with a one-word category."
-            ])
+            ], "file")
         
         return response.text.strip()
         
+    except ClassificationBusy:
+        raise
     except FileNotFoundError as e:
         print(f"Gemini API: File not found - {str(e)}")
         return "Uncategorized"
@@ -43,8 +139,13 @@ def classify_image(path: str) -> str:
         print(f"Gemini API error: {str(e)}")
         return "Uncategorized"
 
-def classify_image_from_url(image_url: str) -> str:
-    """Classify image from URL using Gemini API - for shareable URLs"""
+@metrics.not_mongo
+@tracing.traced("gemini_api.classify_image_from_url")
+def classify_image_from_url(image_url: str, wait: Optional[float] = CLASSIFY_WAIT_SECONDS) -> str:
+    """Classify image from URL using Gemini API - for shareable URLs
+    
+    Raises ClassificationBusy when the concurrency cap is reached; other errors give "Uncategorized".
+    """
     try:
         # Check if URL is provided
         if not image_url:
@@ -52,24 +153,22 @@ def classify_image_from_url(image_url: str) -> str:
         
         print(f"Downloading image from URL: {image_url}")
         
-        # Download image from URL
-        response = requests.get(image_url, timeout=10)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        
-        # Convert to PIL Image
-        image = Image.open(BytesIO(response.content))
+        # Download image from URL (pooled, size-capped and cached)
+        image = Image.open(BytesIO(image_fetch.fetch_image(image_url)))
         
         # Use gemini-1.5-flash model
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        model = _get_model()
         
         # Generate content with the image and prompt
-        ai_response = model.generate_content([
+        ai_response = _generate(model, [
             image, 
             "What object is in this image? Respond with a one-word category like: phone, wallet, keys, bag, book, electronics, clothing, jewelry, documents, etc."
-        ])
+        ], "url", wait)
         
         return ai_response.text.strip()
         
+    except ClassificationBusy:
+        raise
     except requests.exceptions.RequestException as e:
         print(f"Gemini API: Error downloading image from URL - {str(e)}")
         return "Uncategorized"
@@ -77,8 +176,13 @@ def classify_image_from_url(image_url: str) -> str:
         print(f"Gemini API error: {str(e)}")
         return "Uncategorized"
 
-def classify_image_from_bytes(image_data: bytes) -> str:
-    """Classify image from bytes data using Gemini API"""
+@metrics.not_mongo
+@tracing.traced("gemini_api.classify_image_from_bytes")
+def classify_image_from_bytes(image_data: bytes, wait: Optional[float] = CLASSIFY_WAIT_SECONDS) -> str:
+    """Classify image from bytes data using Gemini API
+    
+    Raises ClassificationBusy when the concurrency cap is reached; other errors give "Uncategorized".
+    """
     try:
         # Check if image data is provided
         if not image_data:
@@ -88,16 +192,18 @@ def classify_image_from_bytes(image_data: bytes) -> str:
         image = Image.open(BytesIO(image_data))
         
         # Use gemini-1.5-flash model
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        model = _get_model()
         
         # Generate content with the image and prompt
-        response = model.generate_content([
+        response = _generate(model, [
             image, 
             "What object is in this image? Respond with a one-word category like: phone, wallet, keys, bag, book, electronics, clothing, jewelry, documents, etc."
-        ])
+        ], "bytes", wait)
         
         return response.text.strip()
         
+    except ClassificationBusy:
+        raise
     except Exception as e:
         print(f"Gemini API error: {str(e)}")
         return "Uncategorized"
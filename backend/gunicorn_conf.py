@@ -0,0 +1,65 @@
+"""Gunicorn settings for running the API with several uvicorn worker processes
+
+    gunicorn -c gunicorn_conf.py main:app
+
+Each worker is a separate process with its own event loop, MongoDB client,
+Gemini client and background threads, so CPU-bound image work (decoding,
+thumbnails, feature extraction) spreads across cores instead of contending
+for one GIL.
+
+The app is imported after the fork by default, which keeps every client
+per-process. With PRELOAD_APP=true the app is imported once in the master
+(faster worker start, shared memory pages) and post_fork drops anything the
+worker inherited so it reconnects on its own.
+
+Environment:
+    PORT                 Port to bind (default 8000)
+    WEB_CONCURRENCY      Worker processes (default: CPUs available to the container, see cpus.py)
+    WORKER_CONCURRENCY   Max concurrent connections per worker before 503 (default: unlimited)
+    THREADPOOL_SIZE      Threads per worker for sync endpoints (read in main.py, default 40)
+    MONGO_MAX_POOL_SIZE  MongoDB connections per worker (read in mongodb.py, default 100)
+    WORKER_TIMEOUT       Seconds before a silent worker is restarted (default 120)
+    MAX_REQUESTS         Recycle a worker after this many requests (default 0 = never)
+    PRELOAD_APP          Import the app in the master before forking (default false)
+"""
+import os
+
+from uvicorn.workers import UvicornWorker
+
+import cpus
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+class LostFoundWorker(UvicornWorker):
+    """Uvicorn worker with per-worker limits taken from the environment"""
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "limit_concurrency": _int_env("WORKER_CONCURRENCY", 0) or None,
+    }
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = cpus.web_concurrency()
+worker_class = "gunicorn_conf.LostFoundWorker"
+timeout = _int_env("WORKER_TIMEOUT", 120)
+graceful_timeout = 30
+keepalive = 5
+max_requests = _int_env("MAX_REQUESTS", 0)
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv("PRELOAD_APP", "false").lower() == "true"
+accesslog = "-"
+errorlog = "-"
+
+def post_fork(server, worker):
+    """Give each worker its own clients when the app was imported before the fork"""
+    if not preload_app:
+        return
+    import classify_queue
+    import gemini_api
+    import mongodb
+
+    mongodb.reset_after_fork()
+    gemini_api.reset_after_fork()
+    classify_queue.reset_after_fork()
+    server.log.info(f"Worker {worker.pid}: reset MongoDB, Gemini and classification queue after fork")
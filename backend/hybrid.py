@@ -0,0 +1,86 @@
+"""Hybrid search: text, category and visual rankings fused into one list
+
+A query is text, an image, or both. Each source ranks its own candidates,
+capped at HYBRID_CANDIDATES so the cost stays bounded however many items
+match:
+
+- text: the fuzzy index (a regex query, newest first, until it is built),
+- category: the newest items in the query's canonical category, from the
+  local classifier's vote on the image or, for a text-only query (or no
+  confident vote), the taxonomy. Searches never pay for a Gemini call
+  unless HYBRID_GEMINI_CATEGORY=true,
+- visual: the visual index (cosine similarity of the colour features).
+
+The rankings are fused with weighted reciprocal rank fusion: an item scores
+sum(weight / (HYBRID_RRF_K + rank)) over the sources that returned it, so no
+source's raw scores have to be comparable with another's, and an item found
+by several sources beats one found by a single source at a similar rank.
+The fused list is paginated and only the page's items are loaded.
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+import taxonomy
+
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "200"))
+HYBRID_RRF_K = float(os.getenv("HYBRID_RRF_K", "60"))
+# Ask Gemini for a query image's category when the local classifier has no confident vote
+HYBRID_GEMINI_CATEGORY = os.getenv("HYBRID_GEMINI_CATEGORY", "false").lower() == "true"
+DEFAULT_WEIGHTS = "text=1,category=0.5,visual=1"
+SOURCES = ("text", "category", "visual")
+
+HYBRID_CANDIDATES_TOTAL = metrics.Counter("hybrid_candidates_total", "Candidates gathered for hybrid search", ["source"])
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse "text=1,category=0.5,visual=1" (sources left out weigh 0)"""
+    weights = {source: 0.0 for source in SOURCES}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        source, _, weight = entry.partition("=")
+        if source.strip() not in weights:
+            raise ValueError(f"Unknown hybrid search source: {source.strip()}")
+        weights[source.strip()] = float(weight)
+    return weights
+
+HYBRID_WEIGHTS = parse_weights(os.getenv("HYBRID_WEIGHTS", DEFAULT_WEIGHTS))
+
+def query_category_key(query: Optional[str], ai_category: Optional[str] = None) -> Optional[str]:
+    """Category to gather candidates from: the image's classification if recognised, else the text's"""
+    for text in (ai_category, query):
+        key = taxonomy.category_key(text)
+        if key and key != taxonomy.OTHER:
+            return key
+    return None
+
+def fuse(rankings: Dict[str, List[str]], weights: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion of each source's ranked item IDs, best first
+
+    Each entry is {"id", "score", "ranks": {source: 1-based rank}}; ties keep
+    the order in which the items were first seen.
+    """
+    weights = HYBRID_WEIGHTS if weights is None else weights
+    fused: Dict[str, Dict[str, Any]] = {}
+    for source, item_ids in rankings.items():
+        weight = weights.get(source, 0.0)
+        if not weight:
+            continue
+        for rank, item_id in enumerate(item_ids, 1):
+            entry = fused.get(item_id)
+            if entry is None:
+                entry = fused[item_id] = {"id": item_id, "score": 0.0, "ranks": {}}
+            if source in entry["ranks"]:
+                continue
+            entry["ranks"][source] = rank
+            entry["score"] += weight / (HYBRID_RRF_K + rank)
+    return sorted(fused.values(), key=lambda entry: -entry["score"])
+
+def paginate(entries: List[Any], page: int, page_size: int) -> Tuple[List[Any], int]:
+    """The entries of a 1-based page, and the total"""
+    start = (page - 1) * page_size
+    return entries[start:start + page_size], len(entries)
+
+def record_candidates(rankings: Dict[str, List[str]]):
+    for source, item_ids in rankings.items():
+        HYBRID_CANDIDATES_TOTAL.inc(len(item_ids), source=source)
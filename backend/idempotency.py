@@ -0,0 +1,110 @@
+"""Idempotency keys for report submission
+
+A client may send an Idempotency-Key header (any unique string, e.g. a UUID
+generated once per form) with POST /report/. The first request with a key
+claims it in the idempotency_keys collection and runs normally; when it
+succeeds its response is stored with the key, and later requests with the
+same key get that response back without storing another image, calling
+Gemini or inserting another item.
+
+- While the first request is still running, repeats get 409 with Retry-After.
+  A claim older than IDEMPOTENCY_LOCK_SECONDS is treated as abandoned (its
+  worker died) and the next repeat runs the request again.
+- A key reused with different form fields gets 422.
+- Failed requests release their key, so a retry runs again.
+- An uploaded file is identified by the SHA-256 of its bytes, not its name.
+- Once the request has succeeded its response is returned even if storing
+  it with the key fails: the write is retried a few times and then in the
+  background until the claim would count as abandoned, so a repeat gets 409
+  meanwhile instead of running the request a second time.
+
+Records expire after IDEMPOTENCY_TTL_HOURS through a TTL index.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+import metrics
+import mongodb as db
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))
+MAX_KEY_LENGTH = 255
+# Quick attempts at storing a response before handing the write to a background thread
+COMPLETE_ATTEMPTS = 3
+COMPLETE_RETRY_SECONDS = 5.0
+
+IDEMPOTENT_REQUESTS = metrics.Counter(
+    "idempotent_requests_total", "Requests carrying an Idempotency-Key, by outcome", ["route", "outcome"]
+)
+
+def check_key(key: str) -> str:
+    """The key, or HTTPException 400 when it is empty, too long or not printable ASCII"""
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH or not all(" " <= char <= "~" for char in key):
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} printable ASCII characters")
+    return key
+
+def fingerprint(*fields: Any) -> str:
+    """Hash of a request's fields, to detect a key reused for a different request"""
+    return hashlib.sha256(json.dumps(fields, default=str).encode("utf-8")).hexdigest()
+
+def claim(route: str, key: str, request_fingerprint: str) -> Optional[Dict[str, Any]]:
+    """Claim a key for a new request: None to go ahead, or the stored response to replay
+
+    Raises HTTPException 409 while another request with the key is running and
+    422 when the key was used for a request with different fields.
+    """
+    record = db.get_mongodb().claim_idempotency_key(
+        f"{route}|{key}", request_fingerprint, IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_TTL_HOURS * 3600
+    )
+    if record is None:
+        IDEMPOTENT_REQUESTS.inc(route=route, outcome="new")
+        return None
+    if record["fingerprint"] != request_fingerprint:
+        IDEMPOTENT_REQUESTS.inc(route=route, outcome="mismatch")
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if record.get("response") is None:
+        IDEMPOTENT_REQUESTS.inc(route=route, outcome="in_progress")
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed",
+                            headers={"Retry-After": "5"})
+    IDEMPOTENT_REQUESTS.inc(route=route, outcome="replayed")
+    return record["response"]
+
+def _store_response(route: str, key: str, response: Dict[str, Any], attempts: Optional[int], delay: float) -> bool:
+    """Try to store a response up to attempts times (None: until the claim would be abandoned)"""
+    deadline = time.monotonic() + IDEMPOTENCY_LOCK_SECONDS
+    attempt = 0
+    while True:
+        try:
+            db.get_mongodb().complete_idempotency_key(f"{route}|{key}", response)
+            return True
+        except Exception as e:
+            attempt += 1
+            print(f"Error storing idempotent response (attempt {attempt}): {e}")
+            if (attempts is not None and attempt >= attempts) or time.monotonic() + delay > deadline:
+                if attempts is None:
+                    IDEMPOTENT_REQUESTS.inc(route=route, outcome="unrecorded")
+                return False
+            time.sleep(delay)
+
+def complete(route: str, key: str, response: Dict[str, Any]):
+    """Store the response of a claimed key for replays (never raises: the request already succeeded)"""
+    if _store_response(route, key, response, COMPLETE_ATTEMPTS, 0.2):
+        return
+    threading.Thread(
+        target=_store_response, args=(route, key, response, None, COMPLETE_RETRY_SECONDS),
+        name="idempotency-complete", daemon=True
+    ).start()
+
+def release(route: str, key: str):
+    """Give up a claimed key after a failure, so a retry runs again"""
+    try:
+        db.get_mongodb().release_idempotency_key(f"{route}|{key}")
+    except Exception as e:
+        print(f"Error releasing idempotency key: {e}")
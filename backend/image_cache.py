@@ -0,0 +1,271 @@
+"""Tiered cache in front of image store reads
+
+GET /images/{file_id} looks an image up in:
+
+1. memory: an LRU of file ID -> bytes, bounded by IMAGE_CACHE_MEMORY_BYTES,
+2. local disk: content-addressed files under IMAGE_CACHE_DIR
+   (objects/ab/<sha256>.<ext>), found through a symlink per file ID
+   (ids/<file_id>). They are streamed with FileResponse, which reads the file
+   in chunks without loading it whole (uvicorn offers no sendfile, so the
+   bytes still pass through Python). With IMAGE_CACHE_ACCEL_REDIRECT set to a
+   URL prefix that nginx maps to IMAGE_CACHE_DIR (an `internal` location),
+   the response is an empty X-Accel-Redirect instead and nginx sends the file
+   with sendfile.
+3. the image store, after which the image goes into both tiers.
+
+Stored images never change once written, so nothing expires: entries leave
+when evicted or when the image is deleted. The worker that deletes an image
+drops it at once (invalidate) and records the deletion in MongoDB; every
+worker polls those records each IMAGE_CACHE_INVALIDATION_SECONDS and drops
+the images from its own tiers, so other workers and hosts stop serving a
+deleted image within that interval.
+
+Worker processes on one host share the disk tier. Each keeps its own
+accounting of it, seeded by a scan of the directory on first use, within an
+equal share of IMAGE_CACHE_DISK_BYTES (divided by WEB_CONCURRENCY), so the
+bound holds for the directory as a whole. The memory tier is per worker.
+"""
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple, Optional
+
+import cpus
+import metrics
+import uploads
+
+IMAGE_CACHE_MEMORY_BYTES = int(os.getenv("IMAGE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+IMAGE_CACHE_DISK_BYTES = int(os.getenv("IMAGE_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "lost-found-image-cache"))
+# URL prefix for X-Accel-Redirect responses on disk hits (empty: stream the file ourselves)
+IMAGE_CACHE_ACCEL_REDIRECT = os.getenv("IMAGE_CACHE_ACCEL_REDIRECT", "")
+IMAGE_CACHE_INVALIDATION_SECONDS = float(os.getenv("IMAGE_CACHE_INVALIDATION_SECONDS", "5"))
+# Each poll re-reads this much older deletions too, for clock skew between hosts
+INVALIDATION_MARGIN_SECONDS = 60
+# Larger images skip the memory tier so one of them can't flush many small ones
+MAX_MEMORY_ENTRY_BYTES = IMAGE_CACHE_MEMORY_BYTES // 8
+
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+CONTENT_TYPES = {extension: content_type for content_type, extension in EXTENSIONS.items()}
+
+metrics.register_cache("image_memory")
+metrics.register_cache("image_disk")
+EVICTIONS = metrics.Counter("image_cache_evictions_total", "Images evicted from the image cache", ["tier"])
+metrics.Gauge("image_cache_memory_bytes", "Bytes held by the in-memory image cache", callback=lambda: _memory.bytes)
+metrics.Gauge("image_cache_memory_entries", "Images held by the in-memory image cache", callback=lambda: len(_memory.entries))
+metrics.Gauge("image_cache_disk_bytes", "Bytes held by the on-disk image cache", callback=lambda: _disk.bytes)
+metrics.Gauge("image_cache_disk_entries", "Images held by the on-disk image cache", callback=lambda: len(_disk.objects))
+
+class CachedImage(NamedTuple):
+    """An image to serve: its bytes (memory or the image store) or the path of its disk copy"""
+    content_type: str
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+
+def content_type_of(data: bytes) -> str:
+    return uploads.sniff_image_type(data[:12]) or "image/jpeg"
+
+class MemoryTier:
+    """LRU of file ID -> (content type, bytes) with a total size bound"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, file_id: str) -> Optional[CachedImage]:
+        with self._lock:
+            entry = self.entries.get(file_id)
+            if entry is None:
+                return None
+            self.entries.move_to_end(file_id)
+        return CachedImage(entry[0], data=entry[1])
+
+    def put(self, file_id: str, content_type: str, data: bytes):
+        if len(data) > min(MAX_MEMORY_ENTRY_BYTES, self.max_bytes):
+            return
+        with self._lock:
+            self._remove(file_id)
+            self.entries[file_id] = (content_type, data)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                EVICTIONS.inc(tier="memory")
+
+    def remove(self, file_id: str):
+        with self._lock:
+            self._remove(file_id)
+
+    def _remove(self, file_id: str):
+        entry = self.entries.pop(file_id, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+class DiskTier:
+    """Content-addressed image files plus a symlink per image file ID"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects = collections.OrderedDict()  # object path -> size, least recently used first
+        self.bytes = 0
+        self._scanned = False
+        self._lock = threading.Lock()
+
+    def _link(self, file_id: str) -> str:
+        return os.path.join(self.root, "ids", file_id)
+
+    def _scan(self):
+        """Account for files already on disk (from earlier runs or other workers), oldest first"""
+        found = []
+        for directory, _, names in os.walk(os.path.join(self.root, "objects")):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self.objects[path] = size
+            self.bytes += size
+        self._scanned = True
+        self._evict()
+
+    def get(self, file_id: str) -> Optional[CachedImage]:
+        link = self._link(file_id)
+        try:
+            target = os.readlink(link)
+        except OSError:
+            return None
+        path = os.path.normpath(os.path.join(os.path.dirname(link), target))
+        if not os.path.exists(path):
+            # Evicted, possibly by another worker
+            self.remove(file_id)
+            return None
+        with self._lock:
+            if path in self.objects:
+                self.objects.move_to_end(path)
+        extension = os.path.splitext(path)[1].lstrip(".")
+        return CachedImage(CONTENT_TYPES.get(extension, "image/jpeg"), path=path)
+
+    def put(self, file_id: str, content_type: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        relative = os.path.join("objects", digest[:2], f"{digest}.{EXTENSIONS.get(content_type, 'jpg')}")
+        path = os.path.join(self.root, relative)
+        with self._lock:
+            if not self._scanned:
+                self._scan()
+            if path not in self.objects:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write then rename, so readers never see a partial file
+                fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                with os.fdopen(fd, "wb") as handle:
+                    handle.write(data)
+                os.replace(temporary, path)
+                self.objects[path] = len(data)
+                self.bytes += len(data)
+            else:
+                self.objects.move_to_end(path)
+            link = self._link(file_id)
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            temporary = f"{link}.{os.getpid()}.tmp"
+            os.symlink(os.path.join("..", relative), temporary)
+            os.replace(temporary, link)
+            self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self.objects:
+            path, size = self.objects.popitem(last=False)
+            self.bytes -= size
+            EVICTIONS.inc(tier="disk")
+            try:
+                os.remove(path)  # Links to it are dropped when next looked up
+            except OSError:
+                pass
+
+    def remove(self, file_id: str):
+        """Drop a file ID's link (its content stays while other IDs may share it, until evicted)"""
+        try:
+            os.remove(self._link(file_id))
+        except OSError:
+            pass
+
+_memory = MemoryTier(IMAGE_CACHE_MEMORY_BYTES)
+_disk = DiskTier(IMAGE_CACHE_DIR, IMAGE_CACHE_DISK_BYTES // cpus.web_concurrency())
+
+def get_memory(file_id: str) -> Optional[CachedImage]:
+    """The image from the memory tier, or None (cheap enough for the event loop)"""
+    if not IMAGE_CACHE_MEMORY_BYTES:
+        return None
+    cached = _memory.get(file_id)
+    metrics.cache_result("image_memory", cached is not None)
+    return cached
+
+def fetch(file_id: str, load: Callable[[str], Optional[bytes]]) -> Optional[CachedImage]:
+    """The image from the disk tier, or loaded with load(file_id) and cached; None if it doesn't exist
+
+    Blocking: call from a worker thread after get_memory missed.
+    """
+    if IMAGE_CACHE_DISK_BYTES:
+        cached = _disk.get(file_id)
+        metrics.cache_result("image_disk", cached is not None)
+        if cached is not None:
+            return cached
+    data = load(file_id)
+    if not data:
+        return None
+    content_type = content_type_of(data)
+    if IMAGE_CACHE_MEMORY_BYTES:
+        _memory.put(file_id, content_type, data)
+    if IMAGE_CACHE_DISK_BYTES:
+        try:
+            _disk.put(file_id, content_type, data)
+        except OSError as e:
+            print(f"Error writing image cache: {e}")
+    return CachedImage(content_type, data=data)
+
+def accel_redirect_path(path: str) -> str:
+    """The X-Accel-Redirect URI of a disk tier file"""
+    relative = os.path.relpath(path, IMAGE_CACHE_DIR).replace(os.sep, "/")
+    return IMAGE_CACHE_ACCEL_REDIRECT.rstrip("/") + "/" + relative
+
+def invalidate(file_id: str):
+    """Forget an image that was deleted from the image store (in this worker)"""
+    _memory.remove(file_id)
+    _disk.remove(file_id)
+
+def follow_deletions(mongo_db):
+    """Drop images other workers deleted, polling MongoDB's deletion records (runs forever)"""
+    since = datetime.utcnow()
+    while True:
+        time.sleep(IMAGE_CACHE_INVALIDATION_SECONDS)
+        started = datetime.utcnow()
+        try:
+            for file_id in mongo_db.deleted_images_since(since - timedelta(seconds=INVALIDATION_MARGIN_SECONDS)):
+                invalidate(file_id)
+            since = started
+        except Exception as e:
+            print(f"Error following image deletions: {e}")
+
+_follower = None
+_follower_lock = threading.Lock()
+
+def start(mongo_db):
+    """Start the follow_deletions thread (once per process, only when a tier is enabled)"""
+    global _follower
+    if not (IMAGE_CACHE_MEMORY_BYTES or IMAGE_CACHE_DISK_BYTES):
+        return
+    with _follower_lock:
+        if _follower is None:
+            _follower = threading.Thread(
+                target=follow_deletions, args=(mongo_db,), name="image-cache-invalidation", daemon=True
+            )
+            _follower.start()
@@ -0,0 +1,133 @@
+"""Fetching images by URL
+
+URLs that point back at this API's own /images/{file_id} route are resolved
+locally (see local_file_id) so callers read GridFS directly instead of making
+an HTTP request to ourselves.
+
+Everything else goes through fetch_image: one pooled requests session with
+keep-alive connections, a hard cap on the response size (checked against
+Content-Length and again while streaming), and a small in-memory cache of
+recent responses bounded by entry count, total bytes and age.
+"""
+import collections
+import os
+import re
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+MAX_FETCH_BYTES = int(os.getenv("IMAGE_FETCH_MAX_BYTES", str(10 * 1024 * 1024)))
+FETCH_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+FETCH_POOL_SIZE = int(os.getenv("IMAGE_FETCH_POOL_SIZE", "10"))
+CACHE_TTL_SECONDS = float(os.getenv("IMAGE_FETCH_CACHE_TTL_SECONDS", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_FETCH_CACHE_ENTRIES", "128"))
+CACHE_MAX_BYTES = int(os.getenv("IMAGE_FETCH_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Extra host names (comma separated) that serve this API, besides BASE_URL's
+LOCAL_HOSTS = {host.strip().lower() for host in os.getenv("IMAGE_URL_LOCAL_HOSTS", "").split(",") if host.strip()}
+
+_IMAGE_PATH = re.compile(r"^/images/([0-9a-fA-F]{24})/?$")
+
+metrics.register_cache("image_fetch")
+LOCAL_URL_LOOKUPS = metrics.Counter("image_url_local_total", "Image URLs resolved to GridFS without a network request")
+
+class ImageTooLarge(ValueError):
+    """The remote image is bigger than MAX_FETCH_BYTES"""
+
+def local_file_id(image_url: str, base_url: str) -> Optional[str]:
+    """GridFS file ID if image_url is one of our own /images/{file_id} URLs, else None"""
+    try:
+        parsed = urlparse(image_url)
+    except ValueError:
+        return None
+    match = _IMAGE_PATH.match(parsed.path)
+    if not match:
+        return None
+    host = (parsed.netloc or "").lower()
+    if host != urlparse(base_url).netloc.lower() and host not in LOCAL_HOSTS:
+        return None
+    LOCAL_URL_LOOKUPS.inc()
+    return match.group(1).lower()
+
+class _ResponseCache:
+    """LRU of URL -> bytes with a TTL and a total size bound"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()  # url -> (expires_at, data)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(url)
+                return None
+            self._entries.move_to_end(url)
+            return entry[1]
+
+    def put(self, url: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if url in self._entries:
+                self._remove(url)
+            self._entries[url] = (time.monotonic() + self.ttl, data)
+            self._bytes += len(data)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, url: str):
+        _, data = self._entries.pop(url)
+        self._bytes -= len(data)
+
+_cache = _ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+_session = None
+_session_lock = threading.Lock()
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=FETCH_POOL_SIZE, pool_maxsize=FETCH_POOL_SIZE, max_retries=1)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+def fetch_image(image_url: str) -> bytes:
+    """Download an external image, serving repeats from the response cache
+
+    Raises requests exceptions for network/HTTP errors and ImageTooLarge when
+    the body exceeds MAX_FETCH_BYTES (without downloading the rest of it).
+    """
+    data = _cache.get(image_url)
+    metrics.cache_result("image_fetch", data is not None)
+    if data is not None:
+        return data
+
+    with _get_session().get(image_url, timeout=FETCH_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        declared = response.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > MAX_FETCH_BYTES:
+            raise ImageTooLarge(f"Image is {declared} bytes (limit {MAX_FETCH_BYTES})")
+        body = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            body += chunk
+            if len(body) > MAX_FETCH_BYTES:
+                raise ImageTooLarge(f"Image exceeds {MAX_FETCH_BYTES} bytes")
+    data = bytes(body)
+    _cache.put(image_url, data)
+    return data
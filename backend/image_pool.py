@@ -0,0 +1,186 @@
+"""Process pool for CPU-bound image work
+
+Pillow decoding and resizing hold the GIL, so running them inline in request
+handlers stalls the event loop and caps a worker at one core. Image tasks
+(thumbnails, feature extraction) are submitted here instead and run in a
+managed ProcessPoolExecutor.
+
+The number of tasks queued or running is bounded by IMAGE_POOL_MAX_PENDING.
+When the pool is saturated submissions fail fast with PoolFull, which the API
+turns into a 503 with Retry-After instead of letting requests pile up.
+
+Buffers of SHM_THRESHOLD_BYTES or more are copied into a shared memory block
+instead of being pickled through the pool's pipe (a copy on each side plus
+the pipe transfer). This is not zero-copy: the worker gets a memoryview of the
+block, and Pillow's io.BytesIO makes its own copy of it when decoding.
+
+Every gunicorn worker has its own pool, so IMAGE_POOL_WORKERS defaults to the
+available CPUs divided by WEB_CONCURRENCY (at least 1) rather than to all of
+them, keeping a host at roughly one decoder process per CPU.
+
+Set IMAGE_POOL_WORKERS=0 to run tasks inline (handy for debugging and the
+microbenchmarks).
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Iterable, List, Tuple
+
+import cpus
+import metrics
+
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", str(max(1, cpus.available_cpus() // cpus.web_concurrency()))))
+IMAGE_POOL_MAX_PENDING = int(os.getenv("IMAGE_POOL_MAX_PENDING", str(max(IMAGE_POOL_WORKERS, 1) * 4)))
+SHM_THRESHOLD_BYTES = int(os.getenv("IMAGE_POOL_SHM_THRESHOLD_BYTES", str(256 * 1024)))
+RETRY_AFTER_SECONDS = 1
+
+class PoolFull(Exception):
+    """Raised when the image pool already has IMAGE_POOL_MAX_PENDING tasks"""
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(IMAGE_POOL_MAX_PENDING)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+def in_flight() -> int:
+    """Tasks queued or running in the pool"""
+    return _in_flight
+
+metrics.Gauge("image_pool_in_flight", "Image tasks queued or running in the process pool", callback=in_flight)
+POOL_REJECTED = metrics.Counter("image_pool_rejected_total", "Image tasks rejected because the pool was full")
+POOL_TASK_SECONDS = metrics.Histogram("image_pool_task_seconds", "Image task latency including queueing", ["task"])
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn: the API process runs Mongo and Gemini threads, which fork does not copy safely
+                _executor = ProcessPoolExecutor(
+                    max_workers=IMAGE_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _executor
+
+def start():
+    """Create the pool and start its worker processes ahead of the first request"""
+    if IMAGE_POOL_WORKERS > 0:
+        executor = _get_executor()
+        # Each worker imports Pillow and numpy on start-up; do it now rather than on an upload
+        for future in [executor.submit(os.getpid) for _ in range(IMAGE_POOL_WORKERS)]:
+            future.result()
+
+def shutdown():
+    """Stop the worker processes (queued tasks are cancelled)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def _run_task(func: Callable, payload: Any, args: Tuple) -> Any:
+    """Worker side: resolve the shared memory handle, if any, and call func"""
+    if not isinstance(payload, tuple):
+        return func(payload, *args)
+    name, size = payload
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        view = block.buf[:size]
+        try:
+            return func(view, *args)
+        finally:
+            view.release()
+    finally:
+        block.close()
+
+def _acquire_slot():
+    global _in_flight
+    if not _slots.acquire(blocking=False):
+        POOL_REJECTED.inc()
+        raise PoolFull(f"Image processing queue is full ({IMAGE_POOL_MAX_PENDING} tasks)")
+    with _in_flight_lock:
+        _in_flight += 1
+
+def _release_slot():
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+    _slots.release()
+
+def submit(func: Callable, data: bytes, *args) -> Future:
+    """Run func(data, *args) in the pool; raises PoolFull when the pool is saturated
+
+    func must be a module-level function (it is pickled by name) and must accept
+    any bytes-like object as data, since large buffers arrive as a memoryview.
+    """
+    _acquire_slot()
+    task = getattr(func, "__name__", "task")
+    start = time.perf_counter()
+    block = None
+    try:
+        if IMAGE_POOL_WORKERS <= 0:
+            future = Future()
+            try:
+                future.set_result(func(data, *args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            payload = data
+            if len(data) >= SHM_THRESHOLD_BYTES:
+                block = shared_memory.SharedMemory(create=True, size=len(data))
+                block.buf[:len(data)] = data
+                payload = (block.name, len(data))
+            future = _get_executor().submit(_run_task, func, payload, args)
+    except BaseException:
+        _finish(block, task, start)
+        raise
+
+    future.add_done_callback(lambda _: _finish(block, task, start))
+    return future
+
+def _finish(block, task: str, start: float):
+    POOL_TASK_SECONDS.observe(time.perf_counter() - start, task=task)
+    if block is not None:
+        block.close()
+        block.unlink()
+    _release_slot()
+
+async def run(func: Callable, data: bytes, *args) -> Any:
+    """Await func(data, *args) from async code without blocking the event loop"""
+    return await asyncio.wrap_future(submit(func, data, *args))
+
+@metrics.not_mongo
+def map_sync(func: Callable, items: Iterable[Tuple[bytes, tuple]]) -> List[Any]:
+    """Run func(data, *args) for each (data, args) from a worker thread, preserving order
+
+    Submits as many tasks as there are free slots and tops up as they finish,
+    so one large batch cannot monopolise the pool. Raises PoolFull only when no
+    slot can be obtained while none of this batch's own tasks are pending.
+    Failed tasks yield their exception object in place of a result.
+    """
+    items = list(items)
+    results: List[Any] = [None] * len(items)
+    pending = {}
+    next_index = 0
+    while next_index < len(items) or pending:
+        while next_index < len(items):
+            data, args = items[next_index]
+            try:
+                pending[submit(func, data, *args)] = next_index
+            except PoolFull:
+                if not pending:
+                    raise
+                break
+            next_index += 1
+        if pending:
+            future = next(iter(pending))
+            index = pending.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = e
+    return results
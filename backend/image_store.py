@@ -0,0 +1,733 @@
+"""Pluggable image storage
+
+MongoDB reads and writes images through the ImageStore chosen by IMAGE_STORE:
+
+- gridfs (default): the fs bucket of the items database (images of archived
+  items may have moved to the fs_archive bucket, see archiver.py),
+- filesystem: files under IMAGE_STORE_PATH, sharded by the first two byte
+  pairs of the ID (ab/cd/<id>) and written to a temporary file then renamed,
+- s3: an S3-compatible bucket (IMAGE_STORE_S3_BUCKET; IMAGE_STORE_S3_ENDPOINT_URL
+  points it at MinIO or another local stand-in) through boto3, which is only
+  needed when this store is used.
+
+Every store names images by ObjectId hex strings, so an item's image_file_id
+stays the same whichever store holds the bytes and moving an image is a copy.
+Derived images (thumbnails) are kept per (source ID, variant) and deleted
+with their source. The s3 store only accepts the variants in DERIVED_VARIANTS,
+so a delete can name every key an image may have instead of listing them.
+
+validate_env() checks the IMAGE_STORE* settings when the API starts and
+raises if they can't work, so a misconfigured store stops startup instead of
+surfacing as failed MongoDB connections.
+
+Moving to another store without downtime: set IMAGE_STORE to the new store
+and IMAGE_STORE_MIGRATE_FROM to the old one. New images go to the new store,
+reads fall back to the old one and copy what they find, and deletes apply to
+both. migrate_images.py copies the rest in the background; when it is done,
+drop IMAGE_STORE_MIGRATE_FROM.
+"""
+import abc
+import io
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import quote, unquote
+
+import gridfs
+from bson import ObjectId
+from gridfs.errors import FileExists, NoFile
+
+import image_utils
+import metrics
+import uploads
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # Optional: only the s3 store needs it
+    boto3 = None
+    ClientError = Exception
+
+IMAGE_STORE = os.getenv("IMAGE_STORE", "gridfs")
+IMAGE_STORE_MIGRATE_FROM = os.getenv("IMAGE_STORE_MIGRATE_FROM", "")
+IMAGE_STORE_PATH = os.getenv("IMAGE_STORE_PATH", "image_store")
+IMAGE_STORE_S3_BUCKET = os.getenv("IMAGE_STORE_S3_BUCKET", "")
+IMAGE_STORE_S3_ENDPOINT_URL = os.getenv("IMAGE_STORE_S3_ENDPOINT_URL") or None
+IMAGE_STORE_S3_PREFIX = os.getenv("IMAGE_STORE_S3_PREFIX", "images/")
+
+_VARIANT = re.compile(r"^[a-z0-9_]+$")
+STORE_NAMES = ("gridfs", "filesystem", "s3")
+# Every derived image the API writes (MongoDB.get_thumbnails)
+DERIVED_VARIANTS = tuple(f"thumb_{size}" for size in image_utils.THUMBNAIL_SIZES)
+# delete_objects takes at most 1000 keys
+S3_DELETE_BATCH = 1000
+
+STORE_BYTES = metrics.Counter("image_store_bytes_total", "Bytes read from and written to the image store",
+                              ["store", "direction"])
+
+def new_file_id() -> str:
+    return str(ObjectId())
+
+def _check_id(file_id: str) -> str:
+    """An image ID, validated before it becomes part of a path or key"""
+    if not ObjectId.is_valid(file_id):
+        raise ValueError(f"Invalid image ID: {file_id}")
+    return str(file_id).lower()
+
+def _check_variant(variant: str) -> str:
+    if not _VARIANT.match(variant):
+        raise ValueError(f"Invalid image variant: {variant}")
+    return variant
+
+def summary(file_id: str, filename: Optional[str] = None, upload_date=None, length: int = 0,
+            content_type: Optional[str] = None, derived_from: Optional[str] = None) -> Dict[str, Any]:
+    """How every store describes a stored file (see MongoDB.list_all_images)"""
+    return {
+        "file_id": file_id,
+        "filename": filename,
+        "upload_date": upload_date,
+        "length": length,
+        "content_type": content_type or "image/jpeg",
+        "derived_from": derived_from
+    }
+
+def gridfs_summary(file_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Summarize an fs.files document"""
+    metadata = file_doc.get("metadata") or {}
+    return summary(str(file_doc["_id"]), file_doc.get("filename"), file_doc.get("uploadDate"),
+                   file_doc.get("length", 0), file_doc.get("contentType"), metadata.get("derived_from"))
+
+def delete_gridfs_files(database, object_ids: List[Any], bucket: str = "fs") -> int:
+    """Remove GridFS files and their chunks with one delete_many each"""
+    if not object_ids:
+        return 0
+    result = database[bucket].files.delete_many({"_id": {"$in": object_ids}})
+    database[bucket].chunks.delete_many({"files_id": {"$in": object_ids}})
+    return result.deleted_count
+
+class ImageUpload(abc.ABC):
+    """An image being written chunk by chunk (see uploads.stream_image_to_store)"""
+    file_id: str
+
+    @abc.abstractmethod
+    def write(self, data: bytes):
+        pass
+
+    @abc.abstractmethod
+    def close(self, metadata: Optional[Dict[str, Any]] = None):
+        """Make the image readable; metadata is kept where the store supports it"""
+
+    @abc.abstractmethod
+    def abort(self):
+        """Discard what has been written"""
+
+class BufferedUpload(ImageUpload):
+    """Collects the chunks and stores them with put() on close"""
+
+    def __init__(self, store: "ImageStore", filename: Optional[str], content_type: Optional[str]):
+        self.store = store
+        self.filename = filename
+        self.content_type = content_type
+        self.file_id = new_file_id()
+        self._buffer = io.BytesIO()
+
+    def write(self, data: bytes):
+        self._buffer.write(data)
+
+    def close(self, metadata: Optional[Dict[str, Any]] = None):
+        self.store.put(self._buffer.getvalue(), self.filename, self.content_type, self.file_id, metadata)
+
+    def abort(self):
+        self._buffer = io.BytesIO()
+
+class ImageStore(abc.ABC):
+    """Where image bytes live; all IDs are ObjectId hex strings"""
+    name = "base"
+
+    def describe(self) -> str:
+        return self.name
+
+    def check(self):
+        """Raise if the store can't be used as configured (called by validate_env)"""
+
+    @abc.abstractmethod
+    def put(self, data: bytes, filename: Optional[str] = None, content_type: Optional[str] = None,
+            file_id: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Store an image (under file_id, if given) and return its ID"""
+
+    def open_upload(self, filename: Optional[str], content_type: Optional[str]) -> ImageUpload:
+        return BufferedUpload(self, filename, content_type)
+
+    @abc.abstractmethod
+    def get(self, file_id: str) -> Optional[bytes]:
+        """An image's bytes, or None if there is no such image"""
+
+    def get_many(self, file_ids: Iterable[str]) -> Dict[str, bytes]:
+        """Bytes of every image found among file_ids"""
+        found = {}
+        for file_id in file_ids:
+            data = self.get(file_id)
+            if data is not None:
+                found[file_id] = data
+        return found
+
+    @abc.abstractmethod
+    def exists(self, file_id: str) -> bool:
+        pass
+
+    def info(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """filename, content_type and metadata of an image, or None where the store keeps none"""
+        return None
+
+    @abc.abstractmethod
+    def put_derived(self, file_id: str, variant: str, data: bytes):
+        """Store an image derived from file_id (e.g. variant "thumb_120")"""
+
+    @abc.abstractmethod
+    def get_derived_many(self, file_ids: Iterable[str], variant: str) -> Dict[str, bytes]:
+        """Source ID -> bytes of the variant, for the sources that have one"""
+
+    @abc.abstractmethod
+    def delete(self, file_ids: Iterable[str]) -> int:
+        """Delete images and everything derived from them; returns the number of files removed"""
+
+    @abc.abstractmethod
+    def iter_files(self) -> Iterator[Dict[str, Any]]:
+        """Summaries of every stored file, derived ones included"""
+
+class GridFSUpload(ImageUpload):
+    def __init__(self, grid_in):
+        self.grid_in = grid_in
+        self.file_id = str(grid_in._id)
+        self._length = 0
+
+    def write(self, data: bytes):
+        self.grid_in.write(data)
+        self._length += len(data)
+
+    def close(self, metadata: Optional[Dict[str, Any]] = None):
+        if metadata:
+            self.grid_in.metadata = metadata
+        self.grid_in.close()
+        metrics.GRIDFS_BYTES_WRITTEN.inc(self._length)
+
+    def abort(self):
+        self.grid_in.abort()
+
+class GridFSStore(ImageStore):
+    """The items database's GridFS bucket, falling back to the archive bucket for reads"""
+    name = "gridfs"
+
+    def __init__(self, database, archive_bucket: str = "fs_archive"):
+        self.db = database
+        self.archive_bucket = archive_bucket
+        self.fs = gridfs.GridFS(database)
+        self.archive_fs = gridfs.GridFS(database, collection=archive_bucket)
+
+    def put(self, data, filename=None, content_type=None, file_id=None, metadata=None) -> str:
+        extra = {"_id": ObjectId(_check_id(file_id))} if file_id else {}
+        if metadata:
+            extra["metadata"] = metadata
+        stored = self.fs.put(data, filename=filename, contentType=content_type, **extra)
+        metrics.GRIDFS_BYTES_WRITTEN.inc(len(data))
+        return str(stored)
+
+    def open_upload(self, filename, content_type) -> ImageUpload:
+        return GridFSUpload(self.fs.new_file(filename=filename, contentType=content_type))
+
+    def get(self, file_id: str) -> Optional[bytes]:
+        if not ObjectId.is_valid(file_id):
+            return None
+        object_id = ObjectId(file_id)
+        try:
+            grid_out = self.fs.get(object_id)
+        except NoFile:
+            try:
+                # Images of archived items may have moved to the cold bucket
+                grid_out = self.archive_fs.get(object_id)
+            except NoFile:
+                return None
+        data = grid_out.read()
+        metrics.GRIDFS_BYTES_READ.inc(len(data))
+        return data
+
+    def read_files_bulk(self, file_filter: Dict[str, Any], bucket: str = "fs") -> Dict[Any, tuple]:
+        """Read every GridFS file matching a filter using one query on fs.files and one on fs.chunks
+
+        Returns a dict of file _id -> (file document, file bytes).
+        """
+        file_docs = {doc["_id"]: doc for doc in self.db[bucket].files.find(file_filter)}
+        if not file_docs:
+            return {}
+
+        parts = {file_id: [] for file_id in file_docs}
+        chunks = self.db[bucket].chunks.find(
+            {"files_id": {"$in": list(file_docs)}},
+            {"files_id": 1, "n": 1, "data": 1}
+        ).sort([("files_id", 1), ("n", 1)])
+        for chunk in chunks:
+            parts[chunk["files_id"]].append(chunk["data"])
+
+        files = {file_id: (doc, b"".join(parts[file_id])) for file_id, doc in file_docs.items()}
+        metrics.GRIDFS_BYTES_READ.inc(sum(len(data) for _, data in files.values()))
+        return files
+
+    def get_many(self, file_ids: Iterable[str]) -> Dict[str, bytes]:
+        object_ids = [ObjectId(file_id) for file_id in file_ids if ObjectId.is_valid(file_id)]
+        if not object_ids:
+            return {}
+        files = self.read_files_bulk({"_id": {"$in": object_ids}})
+        archived = [object_id for object_id in object_ids if object_id not in files]
+        if archived:
+            files.update(self.read_files_bulk({"_id": {"$in": archived}}, self.archive_bucket))
+        return {str(object_id): data for object_id, (_, data) in files.items()}
+
+    def exists(self, file_id: str) -> bool:
+        if not ObjectId.is_valid(file_id):
+            return False
+        return self.fs.exists(ObjectId(file_id)) or self.archive_fs.exists(ObjectId(file_id))
+
+    def info(self, file_id: str) -> Optional[Dict[str, Any]]:
+        if not ObjectId.is_valid(file_id):
+            return None
+        projection = {"filename": 1, "contentType": 1, "metadata": 1}
+        file_doc = (self.db.fs.files.find_one({"_id": ObjectId(file_id)}, projection)
+                    or self.db[self.archive_bucket].files.find_one({"_id": ObjectId(file_id)}, projection))
+        if file_doc is None:
+            return None
+        return {"filename": file_doc.get("filename"), "content_type": file_doc.get("contentType"),
+                "metadata": file_doc.get("metadata") or {}}
+
+    def put_derived(self, file_id: str, variant: str, data: bytes):
+        source_id, variant = _check_id(file_id), _check_variant(variant)
+        if self.db.fs.files.find_one({"metadata.derived_from": source_id, "metadata.variant": variant}, {"_id": 1}):
+            return
+        derived_id = ObjectId()
+        try:
+            self.fs.put(
+                data,
+                _id=derived_id,
+                filename=f"{variant}_{file_id}",
+                contentType="image/jpeg",
+                metadata={"derived_from": source_id, "variant": variant}
+            )
+        except FileExists:
+            # A concurrent request stored this variant first (the index on source and variant is unique)
+            self.db.fs.chunks.delete_many({"files_id": derived_id})
+            return
+        metrics.GRIDFS_BYTES_WRITTEN.inc(len(data))
+
+    def get_derived_many(self, file_ids: Iterable[str], variant: str) -> Dict[str, bytes]:
+        files = self.read_files_bulk({"metadata.derived_from": {"$in": list(file_ids)}, "metadata.variant": variant})
+        return {doc["metadata"]["derived_from"]: data for doc, data in files.values()}
+
+    def delete(self, file_ids: Iterable[str]) -> int:
+        source_ids = [str(file_id) for file_id in file_ids if ObjectId.is_valid(file_id)]
+        if not source_ids:
+            return 0
+        deleted = 0
+        for bucket in ("fs", self.archive_bucket):
+            related = self.db[bucket].files.find(
+                {"$or": [
+                    {"_id": {"$in": [ObjectId(file_id) for file_id in source_ids]}},
+                    {"metadata.derived_from": {"$in": source_ids}}
+                ]},
+                {"_id": 1}
+            )
+            deleted += delete_gridfs_files(self.db, [doc["_id"] for doc in related], bucket)
+        return deleted
+
+    def iter_files(self) -> Iterator[Dict[str, Any]]:
+        # Archived images are still readable through get(), so they are listed too
+        for bucket in ("fs", self.archive_bucket):
+            cursor = self.db[bucket].files.find()
+            try:
+                for file_doc in cursor:
+                    yield gridfs_summary(file_doc)
+            finally:
+                cursor.close()
+
+class FilesystemUpload(ImageUpload):
+    def __init__(self, store: "FilesystemStore"):
+        self.store = store
+        self.file_id = new_file_id()
+        self.path = store.path(self.file_id)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, self.temporary = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        self.handle = os.fdopen(fd, "wb")
+        self._length = 0
+
+    def write(self, data: bytes):
+        self.handle.write(data)
+        self._length += len(data)
+
+    def close(self, metadata: Optional[Dict[str, Any]] = None):
+        self.handle.close()
+        os.replace(self.temporary, self.path)
+        STORE_BYTES.inc(self._length, store=self.store.name, direction="write")
+
+    def abort(self):
+        self.handle.close()
+        try:
+            os.remove(self.temporary)
+        except OSError:
+            pass
+
+class FilesystemStore(ImageStore):
+    """Image files in a sharded directory tree (ab/cd/<id>, derived images alongside as <id>.<variant>)"""
+    name = "filesystem"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def describe(self) -> str:
+        return f"{self.name} ({self.root})"
+
+    def check(self):
+        os.makedirs(self.root, exist_ok=True)
+        if not os.access(self.root, os.W_OK):
+            raise RuntimeError(f"IMAGE_STORE_PATH {self.root} is not writable")
+
+    def path(self, file_id: str, variant: Optional[str] = None) -> str:
+        file_id = _check_id(file_id)
+        name = f"{file_id}.{_check_variant(variant)}" if variant else file_id
+        return os.path.join(self.root, file_id[:2], file_id[2:4], name)
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers never see a partial file
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+        STORE_BYTES.inc(len(data), store=self.name, direction="write")
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return None
+        STORE_BYTES.inc(len(data), store=self.name, direction="read")
+        return data
+
+    def put(self, data, filename=None, content_type=None, file_id=None, metadata=None) -> str:
+        file_id = _check_id(file_id) if file_id else new_file_id()
+        self._write(self.path(file_id), data)
+        return file_id
+
+    def open_upload(self, filename, content_type) -> ImageUpload:
+        return FilesystemUpload(self)
+
+    def get(self, file_id: str) -> Optional[bytes]:
+        if not ObjectId.is_valid(file_id):
+            return None
+        return self._read(self.path(file_id))
+
+    def exists(self, file_id: str) -> bool:
+        return ObjectId.is_valid(file_id) and os.path.exists(self.path(file_id))
+
+    def put_derived(self, file_id: str, variant: str, data: bytes):
+        self._write(self.path(file_id, variant), data)
+
+    def get_derived_many(self, file_ids: Iterable[str], variant: str) -> Dict[str, bytes]:
+        found = {}
+        for file_id in file_ids:
+            if ObjectId.is_valid(file_id):
+                data = self._read(self.path(file_id, variant))
+                if data is not None:
+                    found[file_id] = data
+        return found
+
+    def delete(self, file_ids: Iterable[str]) -> int:
+        deleted = 0
+        for file_id in file_ids:
+            if not ObjectId.is_valid(file_id):
+                continue
+            path = self.path(file_id)
+            directory = os.path.dirname(path)
+            try:
+                names = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+            prefix = os.path.basename(path)
+            for name in names:
+                if name == prefix or name.startswith(prefix + "."):
+                    try:
+                        os.remove(os.path.join(directory, name))
+                        deleted += 1
+                    except FileNotFoundError:
+                        pass
+        return deleted
+
+    def iter_files(self) -> Iterator[Dict[str, Any]]:
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                file_id, _, variant = name.partition(".")
+                if not ObjectId.is_valid(file_id):
+                    continue  # Including temporary files of writes in progress
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except FileNotFoundError:
+                    continue
+                yield summary(file_id if not variant else name, name,
+                              datetime.fromtimestamp(stat.st_mtime, timezone.utc).replace(tzinfo=None),
+                              stat.st_size, None, file_id if variant else None)
+
+class S3Store(ImageStore):
+    """Objects in an S3-compatible bucket (<prefix><id>, derived images as <prefix><id>.<variant>)"""
+    name = "s3"
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, prefix: str = "images/", client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("IMAGE_STORE=s3 needs boto3 (pip install boto3)")
+            if not bucket:
+                raise RuntimeError("IMAGE_STORE=s3 needs IMAGE_STORE_S3_BUCKET")
+            # Credentials and region come from the usual AWS_* environment variables
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.prefix = prefix
+
+    def describe(self) -> str:
+        return f"{self.name} ({self.endpoint_url or 'AWS'} bucket {self.bucket})"
+
+    def check(self):
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except Exception as e:
+            raise RuntimeError(f"Cannot use S3 bucket {self.bucket} at {self.endpoint_url or 'AWS'}: {e}") from e
+
+    def key(self, file_id: str, variant: Optional[str] = None) -> str:
+        file_id = _check_id(file_id)
+        return f"{self.prefix}{file_id}.{_check_variant(variant)}" if variant else f"{self.prefix}{file_id}"
+
+    @staticmethod
+    def _missing(error: Exception) -> bool:
+        code = str(getattr(error, "response", {}).get("Error", {}).get("Code", ""))
+        return code in ("NoSuchKey", "404", "NotFound")
+
+    def _put(self, key: str, data: bytes, content_type: Optional[str], extra: Optional[Dict[str, str]] = None):
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=data,
+            ContentType=content_type or uploads.sniff_image_type(data[:12]) or "application/octet-stream",
+            Metadata=extra or {}
+        )
+        STORE_BYTES.inc(len(data), store=self.name, direction="write")
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+        data = response["Body"].read()
+        STORE_BYTES.inc(len(data), store=self.name, direction="read")
+        return data
+
+    def put(self, data, filename=None, content_type=None, file_id=None, metadata=None) -> str:
+        file_id = _check_id(file_id) if file_id else new_file_id()
+        extra = {"filename": quote(filename)} if filename else {}
+        if metadata and metadata.get("sha256"):
+            extra["sha256"] = str(metadata["sha256"])
+        self._put(self.key(file_id), data, content_type, extra)
+        return file_id
+
+    def get(self, file_id: str) -> Optional[bytes]:
+        if not ObjectId.is_valid(file_id):
+            return None
+        return self._get(self.key(file_id))
+
+    def exists(self, file_id: str) -> bool:
+        if not ObjectId.is_valid(file_id):
+            return False
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(file_id))
+            return True
+        except ClientError as e:
+            if self._missing(e):
+                return False
+            raise
+
+    def info(self, file_id: str) -> Optional[Dict[str, Any]]:
+        if not ObjectId.is_valid(file_id):
+            return None
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(file_id))
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+        extra = head.get("Metadata") or {}
+        return {"filename": unquote(extra["filename"]) if extra.get("filename") else None,
+                "content_type": head.get("ContentType"),
+                "metadata": {"sha256": extra["sha256"]} if extra.get("sha256") else {}}
+
+    def put_derived(self, file_id: str, variant: str, data: bytes):
+        if variant not in DERIVED_VARIANTS:
+            # delete() only removes the variants it knows of
+            raise ValueError(f"Unknown image variant: {variant}")
+        self._put(self.key(file_id, variant), data, "image/jpeg")
+
+    def get_derived_many(self, file_ids: Iterable[str], variant: str) -> Dict[str, bytes]:
+        found = {}
+        for file_id in file_ids:
+            if ObjectId.is_valid(file_id):
+                data = self._get(self.key(file_id, variant))
+                if data is not None:
+                    found[file_id] = data
+        return found
+
+    def _list(self, prefix: str) -> Iterator[Dict[str, Any]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            yield from page.get("Contents", [])
+
+    def delete(self, file_ids: Iterable[str]) -> int:
+        """Delete each image's key and the keys of all DERIVED_VARIANTS, in batches
+
+        S3 reports missing keys as deleted too, so this counts the images
+        asked for rather than the objects that existed.
+        """
+        source_ids = [file_id for file_id in dict.fromkeys(file_ids) if ObjectId.is_valid(file_id)]
+        keys = [key for file_id in source_ids
+                for key in [self.key(file_id)] + [self.key(file_id, variant) for variant in DERIVED_VARIANTS]]
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            batch = keys[start:start + S3_DELETE_BATCH]
+            response = self.client.delete_objects(
+                Bucket=self.bucket, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+            )
+            errors = response.get("Errors") or []
+            if errors:
+                raise RuntimeError(f"S3 delete failed for {len(errors)} keys, e.g. {errors[0].get('Key')}: "
+                                   f"{errors[0].get('Message')}")
+        return len(source_ids)
+
+    def iter_files(self) -> Iterator[Dict[str, Any]]:
+        for obj in self._list(self.prefix):
+            name = obj["Key"][len(self.prefix):]
+            file_id, _, variant = name.partition(".")
+            if not ObjectId.is_valid(file_id):
+                continue
+            modified = obj.get("LastModified")
+            if modified is not None and modified.tzinfo is not None:
+                modified = modified.astimezone(timezone.utc).replace(tzinfo=None)
+            yield summary(name, None, modified, obj.get("Size", 0), None, file_id if variant else None)
+
+class MigratingStore(ImageStore):
+    """Writes to target; reads fall back to source, copying what they find; deletes go to both"""
+    name = "migrating"
+
+    def __init__(self, target: ImageStore, source: ImageStore):
+        self.target = target
+        self.source = source
+
+    def describe(self) -> str:
+        return f"{self.target.describe()}, migrating from {self.source.describe()}"
+
+    def put(self, data, filename=None, content_type=None, file_id=None, metadata=None) -> str:
+        return self.target.put(data, filename, content_type, file_id, metadata)
+
+    def open_upload(self, filename, content_type) -> ImageUpload:
+        return self.target.open_upload(filename, content_type)
+
+    def _copy(self, file_id: str, data: bytes):
+        try:
+            # Derived files are found through their metadata, so it has to come along
+            info = self.source.info(file_id) or {}
+            self.target.put(data, info.get("filename"), info.get("content_type"), file_id, info.get("metadata"))
+        except Exception as e:
+            print(f"Error copying image {file_id} during migration: {e}")
+
+    def get(self, file_id: str) -> Optional[bytes]:
+        data = self.target.get(file_id)
+        if data is None:
+            data = self.source.get(file_id)
+            if data is not None:
+                self._copy(file_id, data)
+        return data
+
+    def get_many(self, file_ids: Iterable[str]) -> Dict[str, bytes]:
+        file_ids = list(file_ids)
+        found = self.target.get_many(file_ids)
+        missing = [file_id for file_id in file_ids if file_id not in found]
+        if missing:
+            for file_id, data in self.source.get_many(missing).items():
+                self._copy(file_id, data)
+                found[file_id] = data
+        return found
+
+    def exists(self, file_id: str) -> bool:
+        return self.target.exists(file_id) or self.source.exists(file_id)
+
+    def info(self, file_id: str) -> Optional[Dict[str, Any]]:
+        return self.target.info(file_id) or self.source.info(file_id)
+
+    def put_derived(self, file_id: str, variant: str, data: bytes):
+        self.target.put_derived(file_id, variant, data)
+
+    def get_derived_many(self, file_ids: Iterable[str], variant: str) -> Dict[str, bytes]:
+        file_ids = list(file_ids)
+        found = self.target.get_derived_many(file_ids, variant)
+        missing = [file_id for file_id in file_ids if file_id not in found]
+        if missing:
+            found.update(self.source.get_derived_many(missing, variant))
+        return found
+
+    def delete(self, file_ids: Iterable[str]) -> int:
+        file_ids = list(file_ids)
+        return self.target.delete(file_ids) + self.source.delete(file_ids)
+
+    def iter_files(self) -> Iterator[Dict[str, Any]]:
+        seen = set()
+        for stored in self.target.iter_files():
+            seen.add(stored["file_id"])
+            yield stored
+        for stored in self.source.iter_files():
+            if stored["file_id"] not in seen:
+                yield stored
+
+def validate_env():
+    """Check IMAGE_STORE and IMAGE_STORE_MIGRATE_FROM, raising if either store can't be used
+
+    The gridfs store only needs the MongoDB connection; the others are
+    created and checked (the S3 bucket must be reachable).
+    """
+    for setting, name in (("IMAGE_STORE", IMAGE_STORE), ("IMAGE_STORE_MIGRATE_FROM", IMAGE_STORE_MIGRATE_FROM)):
+        if not name:
+            continue
+        if name not in STORE_NAMES:
+            raise ValueError(f"{setting}={name} is not an image store (expected gridfs, filesystem or s3)")
+        if name != "gridfs":
+            create(name).check()
+
+def create(name: str, database=None, archive_bucket: str = "fs_archive") -> ImageStore:
+    """The store called name, configured from the IMAGE_STORE_* environment variables"""
+    if name == "gridfs":
+        if database is None:
+            raise RuntimeError("The gridfs image store needs a MongoDB connection")
+        return GridFSStore(database, archive_bucket)
+    if name == "filesystem":
+        return FilesystemStore(IMAGE_STORE_PATH)
+    if name == "s3":
+        return S3Store(IMAGE_STORE_S3_BUCKET, IMAGE_STORE_S3_ENDPOINT_URL, IMAGE_STORE_S3_PREFIX)
+    raise ValueError(f"Unknown image store: {name} (expected gridfs, filesystem or s3)")
+
+def from_env(database=None, archive_bucket: str = "fs_archive") -> ImageStore:
+    """IMAGE_STORE, wrapped in a MigratingStore while IMAGE_STORE_MIGRATE_FROM is set"""
+    store = create(IMAGE_STORE, database, archive_bucket)
+    if IMAGE_STORE_MIGRATE_FROM and IMAGE_STORE_MIGRATE_FROM != IMAGE_STORE:
+        store = MigratingStore(store, create(IMAGE_STORE_MIGRATE_FROM, database, archive_bucket))
+    return store
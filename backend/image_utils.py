@@ -4,6 +4,12 @@ import os
 import numpy as np
 from typing import List, Tuple
 import hashlib
+import io
+import tracing
+
+# Thumbnail edge lengths we generate; requests are snapped up to the nearest one
+# so the number of stored derivatives per image stays bounded
+THUMBNAIL_SIZES = (64, 120, 240, 480)
 
 def save_image(file) -> str:
     # Create images directory if it doesn't exist
@@ -16,50 +22,87 @@ def save_image(file) -> str:
         f.write(contents)
     return filepath
 
+def snap_thumbnail_size(size: int) -> int:
+    """Snap a requested thumbnail size to the nearest supported size"""
+    for candidate in THUMBNAIL_SIZES:
+        if size <= candidate:
+            return candidate
+    return THUMBNAIL_SIZES[-1]
+
+@tracing.traced("image_utils.make_thumbnail")
+def make_thumbnail(image_data: bytes, size: int) -> bytes:
+    """Downscale image bytes to a JPEG thumbnail fitting in a size x size box"""
+    with Image.open(io.BytesIO(image_data)) as img:
+        # draft() lets the JPEG decoder skip work when shrinking by large factors
+        img.draft('RGB', (size, size))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((size, size))
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=80, optimize=True)
+        return output.getvalue()
+
+@tracing.traced("image_utils.extract_features")
 def extract_features(image_path: str) -> np.ndarray:
     """Extract simple color and texture features from an image for similarity matching"""
     try:
         # Open image with PIL
-        img = Image.open(image_path)
-        
-        # Convert to RGB if not already
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize for consistent feature extraction
-        img = img.resize((64, 64))
-        
-        # Extract color histogram features
-        # Get RGB histograms
-        r_hist = np.array(img.split()[0].histogram())
-        g_hist = np.array(img.split()[1].histogram())
-        b_hist = np.array(img.split()[2].histogram())
-        
-        # Normalize histograms
-        r_hist = r_hist / np.sum(r_hist)
-        g_hist = g_hist / np.sum(g_hist)
-        b_hist = b_hist / np.sum(b_hist)
-        
-        # Get basic statistics
-        stats = ImageStat.Stat(img)
-        mean_rgb = np.array(stats.mean)
-        std_rgb = np.array(stats.stddev)
-        
-        # Combine features
-        features = np.concatenate([
-            r_hist[:64],  # Reduced histogram bins
-            g_hist[:64],
-            b_hist[:64],
-            mean_rgb,
-            std_rgb
-        ])
-        
-        return features.astype(np.float32)
-        
+        with Image.open(image_path) as img:
+            return _features_from_image(img)
     except Exception as e:
         print(f"Error extracting features from {image_path}: {e}")
         return np.array([])
 
+@tracing.traced("image_utils.extract_features_from_bytes")
+def extract_features_from_bytes(image_data: bytes) -> np.ndarray:
+    """Same features as extract_features, for an image held in memory (bytes or memoryview)"""
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            return _features_from_image(img)
+    except Exception as e:
+        print(f"Error extracting features from image bytes: {e}")
+        return np.array([])
+
+def _features_from_image(img: Image.Image) -> np.ndarray:
+    """Color histogram and channel statistics of a freshly opened image"""
+    # Features are computed at 64x64, so let the JPEG decoder downscale while decoding
+    img.draft('RGB', (128, 128))
+    
+    # Convert to RGB if not already
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    # Resize for consistent feature extraction
+    img = img.resize((64, 64))
+    
+    # Extract color histogram features
+    # Get RGB histograms
+    r_hist = np.array(img.split()[0].histogram())
+    g_hist = np.array(img.split()[1].histogram())
+    b_hist = np.array(img.split()[2].histogram())
+    
+    # Normalize histograms
+    r_hist = r_hist / np.sum(r_hist)
+    g_hist = g_hist / np.sum(g_hist)
+    b_hist = b_hist / np.sum(b_hist)
+    
+    # Get basic statistics
+    stats = ImageStat.Stat(img)
+    mean_rgb = np.array(stats.mean)
+    std_rgb = np.array(stats.stddev)
+    
+    # Combine features
+    features = np.concatenate([
+        r_hist[:64],  # Reduced histogram bins
+        g_hist[:64],
+        b_hist[:64],
+        mean_rgb,
+        std_rgb
+    ])
+    
+    return features.astype(np.float32)
+
+@tracing.traced("image_utils.compare_images")
 def compare_images(img1_path: str, img2_path: str) -> float:
     """Compare two images and return similarity score (0-1, higher is more similar)"""
     try:
@@ -89,6 +132,7 @@ def compare_images(img1_path: str, img2_path: str) -> float:
         print(f"Error comparing images {img1_path} and {img2_path}: {e}")
         return 0.0
 
+@tracing.traced("image_utils.find_similar_images")
 def find_similar_images(query_image_path: str, all_image_paths: List[str], threshold: float = 0.1) -> List[Tuple[str, float]]:
     """Find images similar to the query image"""
     similar_images = []
@@ -0,0 +1,85 @@
+"""Structured item queries
+
+GET /items/query takes typed filters (category, status, location, date range,
+has_image) instead of a free-text pattern. Each combination of the status,
+category and location filters has a planned compound index in QUERY_INDEXES
+with timestamp last, so every filter becomes index bounds, and without a
+location filter the newest-first sort reads the index in order (a location
+prefix spans several keys, so those matches are sorted after the scan).
+build_query returns the filter together with the index to hint, so the plan
+never depends on the optimizer picking between similar indexes.
+
+Categories are matched on category_keys, the array of an item's AI and
+reported category keys (see taxonomy.py), so either one matching is enough.
+Only one field of each compound index is an array, as MongoDB requires.
+
+Locations are matched on location_key, a normalised form stored with each
+item: "Near the Library, 2nd floor" is stored as "library 2nd floor", and a
+location filter is a prefix range on that key.
+"""
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import taxonomy
+
+# Index keys for each set of filtered fields (timestamp is always last)
+QUERY_INDEXES: Dict[frozenset, List[Tuple[str, int]]] = {
+    frozenset(): [("timestamp", -1)],
+    frozenset({"status"}): [("status", 1), ("timestamp", -1)],
+    frozenset({"category_keys"}): [("category_keys", 1), ("timestamp", -1)],
+    frozenset({"location_key"}): [("location_key", 1), ("timestamp", -1)],
+    frozenset({"status", "category_keys"}): [("status", 1), ("category_keys", 1), ("timestamp", -1)],
+    frozenset({"status", "location_key"}): [("status", 1), ("location_key", 1), ("timestamp", -1)],
+    frozenset({"category_keys", "location_key"}): [("category_keys", 1), ("location_key", 1), ("timestamp", -1)],
+    frozenset({"status", "category_keys", "location_key"}):
+        [("status", 1), ("category_keys", 1), ("location_key", 1), ("timestamp", -1)],
+}
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+# Words that describe where relative to a place rather than the place itself
+_LOCATION_FILLER = {
+    "a", "an", "the", "at", "in", "on", "near", "nearby", "by", "of", "outside", "inside", "opposite",
+    "behind", "beside", "next", "to", "front", "around", "area", "my"
+}
+
+def location_key(location: Optional[str]) -> str:
+    """Normalised location used for filtering and facets ("" if nothing is left)"""
+    words = _NON_WORD.sub(" ", (location or "").lower()).split()
+    return " ".join(word for word in words if word not in _LOCATION_FILLER)
+
+def _prefix_range(prefix: str) -> Dict[str, str]:
+    """Index range matching every key that starts with prefix"""
+    # Keys are lower-case ASCII letters, digits and spaces, so "~" sorts after all of them
+    return {"$gte": prefix, "$lt": prefix + "~"}
+
+def build_query(category: Optional[str] = None, status: Optional[str] = None, location: Optional[str] = None,
+                date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                has_image: Optional[bool] = None) -> Tuple[Dict[str, Any], List[Tuple[str, int]]]:
+    """MongoDB filter for the given filters, and the QUERY_INDEXES entry to hint
+
+    has_image is not part of any index: it is checked on the documents the
+    index scan returns, inside MongoDB.
+    """
+    query: Dict[str, Any] = {}
+    if status:
+        query["status"] = status
+    if category:
+        key = taxonomy.category_key(category) or taxonomy.OTHER
+        keys = taxonomy.expand(key)
+        query["category_keys"] = keys[0] if len(keys) == 1 else {"$in": keys}
+    if location:
+        key = location_key(location)
+        if key:
+            query["location_key"] = _prefix_range(key)
+    if date_from or date_to:
+        query["timestamp"] = {}
+        if date_from:
+            query["timestamp"]["$gte"] = date_from
+        if date_to:
+            query["timestamp"]["$lt"] = date_to
+    if has_image is not None:
+        query["image_file_id"] = {"$nin": [None, ""]} if has_image else {"$in": [None, ""]}
+
+    indexed_fields = frozenset(field for field in ("status", "category_keys", "location_key") if field in query)
+    return query, QUERY_INDEXES[indexed_fields]
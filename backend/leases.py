@@ -0,0 +1,45 @@
+"""Run singleton background jobs in one worker process
+
+Every gunicorn worker starts the same background threads, but jobs such as
+the orphaned image sweep and the archiver must not run several times at once
+against the same data. Before each run a job takes a lease in the `leases`
+collection; only the worker holding it runs the job, and it keeps the lease
+by renewing it on its next run. If that worker dies, the lease runs out and
+another worker takes over.
+"""
+import os
+import socket
+import time
+
+import mongodb as db
+
+def holder() -> str:
+    """This worker's name in the leases collection (computed per call, so it is right after a fork)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def acquire(name: str, ttl_seconds: float) -> bool:
+    """Whether this process holds (and has renewed) the lease on the job called name"""
+    try:
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            return False
+        return mongo_db.acquire_lease(name, holder(), ttl_seconds)
+    except Exception as e:
+        print(f"Error acquiring lease {name}: {e}")
+        return False
+
+def run_periodically(name: str, interval_seconds: float, job):
+    """Call job() every interval_seconds in whichever worker holds the lease on name
+
+    The lease lasts one and a half intervals, so its holder renews it before
+    anyone else may take it (a run is expected to finish well within that),
+    and it passes to another worker within two intervals if the holder dies.
+    """
+    while True:
+        time.sleep(interval_seconds)
+        if not acquire(name, interval_seconds * 1.5):
+            continue
+        try:
+            job()
+        except Exception as e:
+            print(f"Error in background job {name}: {e}")
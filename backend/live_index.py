@@ -0,0 +1,134 @@
+"""Keeping in-memory indexes of the live items current
+
+The fuzzy search, suggestion and visual indexes are built from the live collection
+once MongoDB is connected and then maintained without rescanning it:
+
+- this process's inserts and deletes are applied directly (record_insert /
+  record_delete, called from MongoDB's write methods),
+- items inserted by other workers are picked up every sync_seconds with an
+  _id range query. ObjectIds are generated by the clients, so one created
+  earlier can be committed after a later one; each sync therefore re-reads
+  the trailing LIVE_INDEX_SYNC_MARGIN_SECONDS before the newest ID loaded and
+  skips the IDs it already loaded from that window,
+- the index is rebuilt from scratch every rebuild_minutes, which drops items
+  other workers deleted; callers load results by ID, so those never show up
+  in the meantime.
+
+An index object only needs add(doc) and remove(item_id); if it has a
+loaded() method it is called once a rebuild has read every document. Documents
+are read with the projection given (the search text fields by default).
+"""
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from bson import ObjectId
+
+# How far before the newest loaded ObjectId's timestamp each sync starts reading,
+# to catch inserts committed out of _id order (slow writers, clock skew between hosts)
+LIVE_INDEX_SYNC_MARGIN_SECONDS = float(os.getenv("LIVE_INDEX_SYNC_MARGIN_SECONDS", "120"))
+
+class LiveIndex:
+    """One in-memory index plus the thread that keeps it current"""
+
+    def __init__(self, name: str, factory: Callable[[], Any], sync_seconds: float, rebuild_minutes: float,
+                 projection: Optional[Dict[str, int]] = None):
+        self.name = name
+        self.projection = projection
+        self.factory = factory
+        self.sync_seconds = sync_seconds
+        self.rebuild_minutes = rebuild_minutes
+        self.index = factory()
+        self.last_id = None  # Highest ObjectId loaded from the collection
+        self.recent: Dict[ObjectId, None] = {}  # IDs already indexed within the sync window
+        self._ready = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def record_insert(self, doc: Dict[str, Any]):
+        """Index a document just added to (or changed in) the live collection"""
+        if self._ready.is_set():
+            with self._sync_lock:
+                self.index.add(doc)
+                # So the next sync doesn't add it a second time from its window
+                self.recent[doc["_id"]] = None
+
+    def record_delete(self, item_id: str):
+        """Drop an item just removed from the live collection"""
+        if self._ready.is_set():
+            self.index.remove(item_id)
+
+    def rebuild(self, mongo_db):
+        """Build a fresh index from the live collection and swap it in"""
+        started = time.perf_counter()
+        index = self.factory()
+        last_id = None
+        recent = {}
+        for doc in mongo_db.iter_live_items(projection=self.projection):
+            index.add(doc)
+            last_id = doc["_id"]
+            recent[last_id] = None
+            if len(recent) % 1000 == 0:
+                recent = self._in_window(recent, last_id)
+        if hasattr(index, "loaded"):
+            index.loaded()
+        with self._sync_lock:
+            self.index = index
+            self.last_id = last_id
+            self.recent = self._in_window(recent, last_id)
+            self._ready.set()
+        self.sync(mongo_db)  # Items inserted while the new index was loading
+        print(f"🔤 {self.name} index: {index.describe()} in {time.perf_counter() - started:.1f}s")
+
+    @staticmethod
+    def _window_start(last_id: Optional[ObjectId]) -> Optional[ObjectId]:
+        if last_id is None:
+            return None
+        return ObjectId.from_datetime(last_id.generation_time - timedelta(seconds=LIVE_INDEX_SYNC_MARGIN_SECONDS))
+
+    def _in_window(self, ids: Dict[ObjectId, None], last_id: Optional[ObjectId]) -> Dict[ObjectId, None]:
+        start = self._window_start(last_id)
+        return {item_id: None for item_id in ids if start is None or item_id > start}
+
+    def sync(self, mongo_db) -> int:
+        """Index items inserted since the last load (e.g. by other workers)"""
+        with self._sync_lock:
+            added = 0
+            for doc in mongo_db.iter_live_items(after_id=self._window_start(self.last_id), projection=self.projection):
+                if doc["_id"] in self.recent:
+                    continue
+                self.index.add(doc)
+                self.recent[doc["_id"]] = None
+                if self.last_id is None or doc["_id"] > self.last_id:
+                    self.last_id = doc["_id"]
+                added += 1
+            self.recent = self._in_window(self.recent, self.last_id)
+        return added
+
+    def maintain(self, mongo_db):
+        """Background job: build the index, then sync every sync_seconds and rebuild periodically"""
+        last_rebuild = 0.0
+        while True:
+            try:
+                if not self._ready.is_set() or time.monotonic() - last_rebuild >= self.rebuild_minutes * 60:
+                    self.rebuild(mongo_db)
+                    last_rebuild = time.monotonic()
+                else:
+                    self.sync(mongo_db)
+            except Exception as e:
+                print(f"Error maintaining {self.name} index: {e}")
+            time.sleep(self.sync_seconds)
+
+    def start(self, mongo_db):
+        """Start the background maintain() thread (once per process)"""
+        with self._sync_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self.maintain, args=(mongo_db,), name=f"{self.name.lower()}-index", daemon=True
+                )
+                self._thread.start()
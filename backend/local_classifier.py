@@ -0,0 +1,147 @@
+"""Local image classifier trained on already-labelled items
+
+A k-nearest-neighbours vote over the colour features of stored items
+(image_utils.extract_features_from_bytes) and their canonical categories. It
+trains from the visual index every LOCAL_CLASSIFIER_RETRAIN_MINUTES, keeping
+at most LOCAL_CLASSIFIER_PER_CATEGORY of the newest items per category so a
+prediction is one small matrix-vector product (well under a millisecond) and
+rare categories aren't outvoted by common ones.
+
+LOCAL_CLASSIFIER_MODE decides when it answers instead of Gemini:
+
+- off: never,
+- fallback (default): when Gemini is busy, fails or has no API key, if the
+  vote's confidence is at least LOCAL_CLASSIFIER_MIN_CONFIDENCE,
+- first: also before calling Gemini at all when the confidence is at least
+  LOCAL_CLASSIFIER_FIRST_CONFIDENCE.
+
+Items it labels are stored with classified_by="local" and never used as
+training data.
+"""
+import collections
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import gemini_api
+import metrics
+import taxonomy
+import visual_index
+
+LOCAL_CLASSIFIER_MODE = os.getenv("LOCAL_CLASSIFIER_MODE", "fallback")
+LOCAL_CLASSIFIER_K = int(os.getenv("LOCAL_CLASSIFIER_K", "15"))
+LOCAL_CLASSIFIER_PER_CATEGORY = int(os.getenv("LOCAL_CLASSIFIER_PER_CATEGORY", "200"))
+LOCAL_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("LOCAL_CLASSIFIER_MIN_CONFIDENCE", "0.6"))
+LOCAL_CLASSIFIER_FIRST_CONFIDENCE = float(os.getenv("LOCAL_CLASSIFIER_FIRST_CONFIDENCE", "0.85"))
+LOCAL_CLASSIFIER_RETRAIN_MINUTES = float(os.getenv("LOCAL_CLASSIFIER_RETRAIN_MINUTES", "15"))
+MIN_CATEGORY_SAMPLES = 3  # Categories with fewer labelled items aren't predicted
+
+LOCAL_ANSWERS = metrics.Counter(
+    "local_classifier_answers_total", "Classifications answered by the local model instead of Gemini", ["reason"]
+)
+PREDICT_SECONDS = metrics.Histogram("local_classifier_predict_seconds", "Time for one local classifier prediction")
+metrics.Gauge("local_classifier_samples", "Labelled items the local classifier was trained on",
+              callback=lambda: len(_model.labels) if _model else 0)
+
+class KnnModel:
+    """Labelled unit feature vectors and a similarity-weighted k-nearest-neighbours vote"""
+
+    def __init__(self, matrix: np.ndarray, labels: List[str], k: int = LOCAL_CLASSIFIER_K):
+        self.classes = sorted(set(labels))
+        codes = {label: code for code, label in enumerate(self.classes)}
+        self.matrix = matrix
+        self.labels = np.fromiter((codes[label] for label in labels), dtype=np.int64, count=len(labels))
+        self.k = min(k, len(labels))
+
+    def predict(self, features) -> Optional[Tuple[str, float]]:
+        """(category key, share of the neighbours' vote) for a feature vector"""
+        vector = visual_index.normalize(features)
+        if vector is None or not self.k:
+            return None
+        similarities = self.matrix @ vector
+        nearest = np.argpartition(-similarities, self.k - 1)[:self.k]
+        votes = np.bincount(self.labels[nearest], weights=np.maximum(similarities[nearest], 0),
+                            minlength=len(self.classes))
+        total = votes.sum()
+        if not total:
+            return None
+        best = int(votes.argmax())
+        return self.classes[best], float(votes[best] / total)
+
+_model: Optional[KnnModel] = None
+_thread = None
+_thread_lock = threading.Lock()
+
+def train() -> Optional[KnnModel]:
+    """Fit a model on the visual index's labelled items and make it the current one"""
+    global _model
+    matrix, labels = visual_index.labelled_sample(LOCAL_CLASSIFIER_PER_CATEGORY, exclude=(None, taxonomy.OTHER))
+    counts = collections.Counter(labels)
+    keep = np.fromiter((counts[label] >= MIN_CATEGORY_SAMPLES for label in labels), dtype=bool, count=len(labels))
+    labels = [label for label, kept in zip(labels, keep) if kept]
+    if len(set(labels)) < 2:
+        # Nothing to choose between yet
+        _model = None
+        return None
+    _model = KnnModel(matrix[keep], labels)
+    print(f"🧮 Local classifier: {len(labels)} items, {len(_model.classes)} categories")
+    return _model
+
+def predict(features) -> Optional[Tuple[str, float]]:
+    """(category key, confidence) from the current model, or None if there is none yet"""
+    model = _model
+    if model is None or features is None:
+        return None
+    with PREDICT_SECONDS.time():
+        return model.predict(features)
+
+def _answer(prediction: Tuple[str, float], reason: str) -> Tuple[str, str]:
+    LOCAL_ANSWERS.inc(reason=reason)
+    return taxonomy.label(prediction[0]), "local"
+
+def classify(image_data: bytes, features, wait: Optional[float] = gemini_api.CLASSIFY_WAIT_SECONDS) -> Tuple[str, str]:
+    """(category, source) for an image, source being "gemini" or "local"
+
+    Raises ClassificationBusy when Gemini is at its concurrency cap and the
+    local model has no confident answer.
+    """
+    prediction = predict(features) if LOCAL_CLASSIFIER_MODE != "off" else None
+    if prediction and LOCAL_CLASSIFIER_MODE == "first" and prediction[1] >= LOCAL_CLASSIFIER_FIRST_CONFIDENCE:
+        return _answer(prediction, "confident")
+    fallback = prediction if prediction and prediction[1] >= LOCAL_CLASSIFIER_MIN_CONFIDENCE else None
+    if fallback and not gemini_api.has_api_key():
+        return _answer(fallback, "no_api_key")
+    try:
+        category = gemini_api.classify_image_from_bytes(image_data, wait)
+    except gemini_api.ClassificationBusy:
+        if fallback:
+            return _answer(fallback, "gemini_busy")
+        raise
+    if category == "Uncategorized" and fallback:
+        return _answer(fallback, "gemini_failed")
+    return category, "gemini"
+
+def maintain():
+    """Background job: train once the visual index is built, then retrain periodically"""
+    while True:
+        if visual_index.is_ready():
+            try:
+                train()
+            except Exception as e:
+                print(f"Error training local classifier: {e}")
+            time.sleep(LOCAL_CLASSIFIER_RETRAIN_MINUTES * 60)
+        else:
+            time.sleep(1)
+
+def start():
+    """Start the background maintain() thread (once per process, unless the mode is off)"""
+    global _thread
+    if LOCAL_CLASSIFIER_MODE == "off":
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=maintain, name="local-classifier", daemon=True)
+            _thread.start()
@@ -1,14 +1,26 @@
-from fastapi import FastAPI, UploadFile, Form, HTTPException
+import time
+
+# Cold start is measured from here: interpreter start-up before this point is outside our control
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, Form, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 import os
 import sys
-import io
 import tempfile
 import contextlib
-from datetime import datetime
+import hmac
+import json
+import struct
+import threading
+import zipfile
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional
 from dotenv import load_dotenv
+import anyio.to_thread
 
 # Load environment variables
 load_dotenv()
@@ -22,22 +34,121 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import modules - in Docker they will be in the same directory
 import mongodb as db, image_utils, gemini_api
+import archiver, bulk_import, classify_queue, exporter, facets, fuzzy, hybrid, idempotency, image_cache, image_pool, image_store, leases, local_classifier, metrics, ratelimit, suggest, tracing, uploads, visual_index
 from model import ReportItem
 
-app = FastAPI(title="Lost and Found API", version="1.0.0")
+# Threads available to sync endpoints in each worker process (AnyIO's default is 40)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+# Seconds from IMPORT_STARTED until the app serves requests and until MongoDB is connected
+startup_timings = {"app_ready": None, "db_ready": None}
+STARTUP_SECONDS = metrics.Gauge("startup_seconds", "Seconds from module import to each startup milestone", ["phase"])
+
+def _record_startup(phase: str):
+    seconds = round(time.perf_counter() - IMPORT_STARTED, 3)
+    startup_timings[phase] = seconds
+    STARTUP_SECONDS.set(seconds, phase=phase)
+    print(f"⏱️ Cold start: {phase} after {seconds}s")
+
+# Required as X-Admin-Token by the /admin/ routes that delete or rewrite data; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Renamed whenever the derived item keys change, so stored items get the new ones
+ITEM_KEYS_MIGRATION = "item-keys-v2"
+
+def backfill_item_keys_once(mongo_db):
+    """Derive the category and location keys of items stored before those keys existed
+
+    Runs once per database, in whichever worker takes the lease first; without
+    it category and location filters and /facets would miss those items.
+    """
+    try:
+        if mongo_db.migration_done(ITEM_KEYS_MIGRATION) or not leases.acquire(ITEM_KEYS_MIGRATION, 3600):
+            return
+        mongo_db.record_migration(ITEM_KEYS_MIGRATION, mongo_db.backfill_item_keys())
+    except Exception as e:
+        print(f"Error backfilling item keys: {e}")
+
+def _on_db_connected(mongo_db):
+    _record_startup("db_ready")
+    # Before the in-memory indexes are built, so they see the keys
+    backfill_item_keys_once(mongo_db)
+    # Pick up classifications interrupted by the last shutdown
+    classify_queue.requeue_pending()
+    fuzzy.start(mongo_db)
+    suggest.start(mongo_db)
+    visual_index.start(mongo_db)
+    local_classifier.start()
+    image_cache.start(mongo_db)
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start serving immediately; connect to MongoDB and warm up Gemini in the background"""
+    print(f"🚀 Starting Lost and Found API (pid {os.getpid()})...")
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # A misconfigured image store stops startup here rather than failing every request later
+    try:
+        image_store.validate_env()
+    except Exception as e:
+        print(f"❌ Image store configuration error: {e}")
+        raise
+    db.on_connect(_on_db_connected)
+    try:
+        db.init_db(background=True)
+    except Exception as e:
+        print(f"⚠️ MongoDB initialization warning: {e}")
+        print("💡 App will start without database - configure MongoDB Atlas or local MongoDB")
+    threading.Thread(target=gemini_api.warm_up, name="gemini-warm-up", daemon=True).start()
+    threading.Thread(target=image_pool.start, name="image-pool-start", daemon=True).start()
+    if IMAGE_GC_INTERVAL_MINUTES > 0:
+        threading.Thread(target=image_gc_loop, name="image-gc", daemon=True).start()
+    if archiver.ARCHIVE_INTERVAL_MINUTES > 0:
+        threading.Thread(target=archiver.archive_loop, name="archiver", daemon=True).start()
+    _record_startup("app_ready")
+    print("✅ FastAPI application started successfully")
+    print("🔍 Health checks available at /health/live and /health/ready")
+    yield
+    db.stop_reconnect()
+    image_pool.shutdown()
+
+app = FastAPI(title="Lost and Found API", version="1.0.0", lifespan=lifespan)
+
+@app.exception_handler(image_pool.PoolFull)
+async def image_pool_full_handler(request, exc: image_pool.PoolFull):
+    """Backpressure: tell clients to retry shortly instead of queueing more image work"""
+    return JSONResponse(
+        {"detail": "Image processing is busy, please retry shortly"},
+        status_code=503,
+        headers={"Retry-After": str(image_pool.RETRY_AFTER_SECONDS)}
+    )
+
+@app.exception_handler(gemini_api.ClassificationBusy)
+async def classification_busy_handler(request, exc: gemini_api.ClassificationBusy):
+    """Admission control: the Gemini concurrency cap is reached"""
+    return JSONResponse(
+        {"detail": "Image classification is busy, please retry shortly"},
+        status_code=503,
+        headers={"Retry-After": "2"}
+    )
 
 # Ultra-simple health endpoint that Railway can definitely reach
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
-# Add startup event
-@app.on_event("startup")
-async def startup_event():
-    """Startup event to ensure app is ready"""
-    print("🚀 Starting Lost and Found API...")
-    print("✅ FastAPI application started successfully")
-    print("🔍 Health check available at /health")
+@app.get("/health/live")
+def health_live():
+    """Liveness probe: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def health_ready():
+    """Readiness probe: 503 until the MongoDB connection is established"""
+    mongo_db = db.mongodb_instance
+    ready = mongo_db is not None and mongo_db.client is not None
+    body = {"status": "ready" if ready else "starting", "database": "connected" if ready else "connecting",
+            "cold_start_seconds": startup_timings}
+    return JSONResponse(body, status_code=200 if ready else 503)
 
 # Clean up any existing temporary files on startup
 def cleanup_temp_files():
@@ -87,9 +198,12 @@ def temporary_image_file(image_data: bytes, file_id: str):
 # Remove static files mount since we're using GridFS
 # Images will be served through API endpoints
 
-# Initialize MongoDB database (non-blocking) - moved after middleware
-# to prevent startup delays
-
+# Reject oversized uploads before their bodies are buffered
+app.add_middleware(uploads.UploadLimitMiddleware)
+# Turn away clients over their per-route limit before their uploads are read
+app.add_middleware(ratelimit.RateLimitMiddleware)
+# Added after the two limits so it wraps them: browsers can only read their
+# 413 and 429 responses when those carry the CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins=os.getenv("ALLOWED_ORIGINS", "*").split(",") if os.getenv("ALLOWED_ORIGINS") != "*" else ["*"],
@@ -97,15 +211,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Move MongoDB initialization after middleware setup
-try:
-    db.init_db()
-    print("✅ MongoDB initialized successfully")
-except Exception as e:
-    print(f"⚠️ MongoDB initialization warning: {e}")
-    print("💡 App will start without database - configure MongoDB Atlas or local MongoDB")
-    # Don't raise exception - let app start without database
+app.add_middleware(tracing.TracingMiddleware)
+# Outermost so the recorded latency covers the whole request
+app.add_middleware(metrics.MetricsMiddleware)
 
 @app.post("/report/")
 async def report_item(
@@ -115,7 +223,9 @@ async def report_item(
     status: str = Form(...),
     name: str = Form("Anonymous"),
     contact: str = Form(...),
-    file: UploadFile = None
+    category: str = Form(""),
+    file: UploadFile = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     try:
         # Check if database is available
@@ -123,70 +233,243 @@ async def report_item(
         if mongo_db.client is None:
             raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
         
-        image_file_id = None
-        category = "Uncategorized"
-
-        # Handle file upload to GridFS
-        if file:
-            # Validate file type
-            if not file.content_type.startswith('image/'):
-                raise HTTPException(status_code=400, detail="Only image files are allowed")
-            
-            # Read image data
-            image_data = await file.read()
-            
-            # Store image in GridFS and get file ID
-            image_file_id = db.store_image(image_data, file.filename)
-            
-            # For AI classification, use context manager for temporary file
-            try:
-                with temporary_image_file(image_data, image_file_id) as temp_path:
-                    category = gemini_api.classify_image(temp_path)
-            except Exception as e:
-                print(f"Error in image classification: {e}")
-                category = "Uncategorized"
-
-        # Create item
-        item = ReportItem(
-            title=title,
-            description=description,
-            location=location,
-            status=status,
-            name=name,
-            contact=contact,
-            category=category
+        if idempotency_key is None:
+            return await save_report(mongo_db, title, description, location, status, name, contact, category, file)
+        
+        # Repeats of a submission (e.g. after a client timeout) get the first response back
+        key = idempotency.check_key(idempotency_key)
+        request_fingerprint = idempotency.fingerprint(
+            title, description, location, status, name, contact, category,
+            await uploads.content_digest(file) if file else None
         )
-
-        # Save to database with image data
-        db.insert_item(item, image_data if file else None, file.filename if file else None)
-        return {"message": "Item reported successfully", "category": category}
+        stored = await run_in_threadpool(idempotency.claim, "/report/", key, request_fingerprint)
+        if stored is not None:
+            return JSONResponse(stored, headers={"Idempotent-Replayed": "true"})
+        try:
+            response = await save_report(mongo_db, title, description, location, status, name, contact, category,
+                                         file)
+        except BaseException:
+            await run_in_threadpool(idempotency.release, "/report/", key)
+            raise
+        await run_in_threadpool(idempotency.complete, "/report/", key, response)
+        return response
+    except (HTTPException, image_pool.PoolFull):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reporting item: {str(e)}")
 
+async def save_report(mongo_db, title: str, description: str, location: str, status: str, name: str,
+                      contact: str, reported_category: str, file: Optional[UploadFile]) -> dict:
+    """Store the image, classify it and insert the item; returns the /report/ response
+
+    The item keeps the reporter's category when one was chosen, else the
+    classification; both are matched by category filters (see taxonomy.py).
+    """
+    image_file_id = None
+    category = "Uncategorized"
+    features = None
+    classification_pending = False
+    classified_by = None
+
+    # Handle file upload to the image store
+    if file:
+        # Validate file type
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="Only image files are allowed")
+        
+        # Stream into the image store, checking type and size and hashing as the bytes arrive
+        image_file_id, image_data, _ = await uploads.stream_image_to_store(file, mongo_db)
+        
+        # Features first (image process pool): the local classifier may answer from
+        # them instead of Gemini, whose blocking call runs in the threadpool
+        try:
+            features = await extract_features(image_data)
+        except image_pool.PoolFull:
+            db.delete_image(image_file_id)
+            raise
+        try:
+            category, source = await run_in_threadpool(local_classifier.classify, image_data, features)
+            classified_by = "local" if source == "local" else None
+        except gemini_api.ClassificationBusy:
+            # Gemini is at its concurrency cap: save now, classify in the background
+            classification_pending = True
+        except Exception as e:
+            print(f"Error in image classification: {e}")
+
+    # Create item
+    item = ReportItem(
+        title=title,
+        description=description,
+        location=location,
+        status=status,
+        name=name,
+        contact=contact,
+        category=reported_category.strip() or category
+    )
+
+    # Save to database, reusing the image and classification from above
+    try:
+        item_id = await run_in_threadpool(
+            db.insert_item, item, image_file_id=image_file_id,
+            ai_category=category if image_file_id and not classification_pending else None,
+            features=features, classification_pending=classification_pending, classified_by=classified_by
+        )
+    except Exception:
+        # Don't leave an unreferenced image behind
+        if image_file_id:
+            db.delete_image(image_file_id)
+        raise
+    if classification_pending:
+        classify_queue.enqueue([item_id])
+        return {"message": "Item reported successfully", "category": category, "classification_pending": True}
+    return {"message": "Item reported successfully", "category": category}
+
+@app.post("/import/")
+def bulk_import_items(
+    data: UploadFile,
+    images: UploadFile = None,
+    import_id: str = Form(None),
+    format: str = Form(None)
+):
+    """Bulk import reports from NDJSON or CSV, with images from an optional zip archive
+    
+    Re-submit with the same import_id to resume an interrupted import.
+    """
+    try:
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+        
+        fmt = format or bulk_import.detect_format(data.filename)
+        if fmt not in ("ndjson", "csv"):
+            raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+        
+        archive = None
+        if images:
+            try:
+                archive = zipfile.ZipFile(images.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="images must be a zip archive")
+        
+        try:
+            # Uploads are spooled to disk, so rows are streamed rather than held in memory
+            return bulk_import.run_import(data.file, fmt, archive, import_id)
+        finally:
+            if archive is not None:
+                archive.close()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importing items: {str(e)}")
+
+@app.get("/import/{import_id}")
+def get_import_status(import_id: str):
+    """Progress and recent row errors of a bulk import"""
+    try:
+        state = db.get_mongodb().get_import_state(import_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching import: {str(e)}")
+    if not state:
+        raise HTTPException(status_code=404, detail=f"Import {import_id} not found")
+    state["import_id"] = state.pop("_id")
+    return state
+
+# Headers sent with every image, from memory, disk or the image store
+IMAGE_HEADERS = {
+    "Cache-Control": "public, max-age=3600",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET",
+    "Access-Control-Allow-Headers": "*"
+}
+
 @app.get("/images/{file_id}")
 async def get_image(file_id: str):
-    """Serve images from GridFS with proper browser headers"""
+    """Serve images through the memory and disk caches, reading the image store only on a miss"""
     try:
-        image_data = db.get_image(file_id)
-        if image_data:
-            # Create response with proper headers for browser compatibility
-            response = StreamingResponse(
-                io.BytesIO(image_data), 
-                media_type="image/jpeg",
-                headers={
-                    "Cache-Control": "public, max-age=3600",
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET",
-                    "Access-Control-Allow-Headers": "*"
-                }
-            )
-            return response
-        else:
+        cached = image_cache.get_memory(file_id)
+        if cached is None:
+            if db.get_mongodb().client is None:
+                raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+            cached = await run_in_threadpool(image_cache.fetch, file_id, db.get_image)
+        if cached is None:
             raise HTTPException(status_code=404, detail="Image not found")
+        if cached.path:
+            if image_cache.IMAGE_CACHE_ACCEL_REDIRECT:
+                # nginx sends the disk tier file itself (with sendfile)
+                return Response(media_type=cached.content_type, headers={
+                    **IMAGE_HEADERS, "X-Accel-Redirect": image_cache.accel_redirect_path(cached.path)
+                })
+            # Disk tier: streamed from the file in chunks
+            return FileResponse(cached.path, media_type=cached.content_type, headers=IMAGE_HEADERS)
+        return Response(cached.data, media_type=cached.content_type, headers=IMAGE_HEADERS)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in get_image endpoint: {e}")
         raise HTTPException(status_code=500, detail=f"Error retrieving image: {str(e)}")
 
+# Orphaned image sweeper: run every N minutes when set (0 disables), pausing between delete batches
+IMAGE_GC_INTERVAL_MINUTES = int(os.getenv("IMAGE_GC_INTERVAL_MINUTES", "0"))
+IMAGE_GC_PAUSE_SECONDS = float(os.getenv("IMAGE_GC_PAUSE_SECONDS", "0.5"))
+
+def image_gc_loop():
+    """Periodically delete orphaned image files (in one worker at a time)"""
+    leases.run_periodically(
+        "image-gc", IMAGE_GC_INTERVAL_MINUTES * 60,
+        lambda: db.sweep_orphan_images(dry_run=False, pause_seconds=IMAGE_GC_PAUSE_SECONDS)
+    )
+
+# Upper bound on thumbnails per batch request (a results page is 10-20 cards)
+MAX_BATCH_IMAGES = 50
+
+def pack_thumbnails(thumbnails: dict, size: int, missing: list) -> bytes:
+    """Pack thumbnails into one binary body
+    
+    Layout: 4-byte big-endian header length, a JSON header describing each
+    image's offset and length in the payload, then the concatenated JPEG bytes.
+    """
+    entries = []
+    offset = 0
+    for file_id, data in thumbnails.items():
+        entries.append({"id": file_id, "offset": offset, "length": len(data), "content_type": "image/jpeg"})
+        offset += len(data)
+    header = json.dumps({"size": size, "images": entries, "missing": missing}).encode("utf-8")
+    return b"".join([struct.pack(">I", len(header)), header, *thumbnails.values()])
+
+@app.post("/images/batch")
+def get_images_batch(request: dict):
+    """Serve thumbnails for a whole page of items in one response
+    
+    Body: {"file_ids": [...], "size": 120}. Returns an application/x-thumbnail-pack
+    body (see pack_thumbnails).
+    """
+    try:
+        file_ids = request.get("file_ids") or []
+        if not isinstance(file_ids, list) or not all(isinstance(file_id, str) for file_id in file_ids):
+            raise HTTPException(status_code=400, detail="file_ids must be a list of strings")
+        if len(file_ids) > MAX_BATCH_IMAGES:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IMAGES} file_ids per request")
+        
+        try:
+            size = image_utils.snap_thumbnail_size(int(request.get("size", 120)))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="size must be an integer")
+        
+        if db.get_mongodb().client is None:
+            raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+        thumbnails = db.get_thumbnails(file_ids, size)
+        missing = [file_id for file_id in file_ids if file_id not in thumbnails]
+        return Response(
+            content=pack_thumbnails(thumbnails, size, missing),
+            media_type="application/x-thumbnail-pack",
+            headers={"Cache-Control": "public, max-age=3600"}
+        )
+    except (HTTPException, image_pool.PoolFull):
+        raise
+    except Exception as e:
+        print(f"Error in get_images_batch endpoint: {e}")
+        raise HTTPException(status_code=500, detail=f"Error retrieving images: {str(e)}")
+
 @app.get("/items/")
 def get_items():
     try:
@@ -200,32 +483,119 @@ def get_items():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching items: {str(e)}")
 
+async def extract_features(image_data: bytes):
+    """Feature vector of an uploaded image, decoded in the image process pool (None if it can't be read)
+
+    Raises image_pool.PoolFull when the pool's queue is full.
+    """
+    try:
+        return await image_pool.run(image_utils.extract_features_from_bytes, image_data)
+    except image_pool.PoolFull:
+        raise
+    except Exception as e:
+        print(f"Error extracting image features: {e}")
+        return None
+
+async def query_image_category(image_data: bytearray, features) -> Optional[str]:
+    """Category of a query image for hybrid search: the local classifier's confident vote
+
+    Gemini is only asked when HYBRID_GEMINI_CATEGORY is set, so searches don't
+    spend paid calls or the classification slots reports need.
+    """
+    prediction = local_classifier.predict(features)
+    if prediction and prediction[1] >= local_classifier.LOCAL_CLASSIFIER_MIN_CONFIDENCE:
+        return prediction[0]
+    if not hybrid.HYBRID_GEMINI_CATEGORY:
+        return None
+    try:
+        category, _ = await run_in_threadpool(local_classifier.classify, image_data, features)
+        return category
+    except Exception as e:
+        # Busy or failed: rank without the category source rather than fail the search
+        print(f"Skipping category candidates: {e}")
+        return None
+
+async def run_hybrid_search(q: str, file: Optional[UploadFile], status: str, page: int, page_size: int) -> dict:
+    """Hybrid search for a text query and/or query image, one page of the fused ranking"""
+    q = q.strip()
+    if not q and not file:
+        raise HTTPException(status_code=400, detail="Provide a text query, an image, or both")
+    features = ai_category = None
+    if file:
+        image_data = await uploads.read_image(file)
+        features = await extract_features(image_data)
+        ai_category = await query_image_category(image_data, features)
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    result = await run_in_threadpool(
+        db.hybrid_search, q or None, features, ai_category, status if status != "All" else None, page, page_size
+    )
+    return {**result, "count": len(result["items"]), "page": page, "page_size": page_size, "query": q}
+
+@app.post("/search/hybrid")
+async def hybrid_search(
+    q: str = Form(""),
+    status: str = Form("All"),
+    page: int = Form(1),
+    page_size: int = Form(20),
+    file: UploadFile = None
+):
+    """Rank live items by text, category and visual similarity together (text, image or both)"""
+    try:
+        return await run_hybrid_search(q, file, status, page, page_size)
+    except (HTTPException, image_pool.PoolFull):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error in hybrid search: {str(e)}")
+
 @app.post("/search/visual/")
-async def visual_search(file: UploadFile):
+async def visual_search(file: UploadFile, status: str = Form("All"), page: int = Form(1), page_size: int = Form(20)):
     """Search for visually similar items using uploaded image"""
     try:
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Only image files are allowed")
-        
-        # Note: Visual search temporarily disabled for GridFS migration
-        # TODO: Implement visual search with GridFS images
-        return {"items": [], "count": 0, "message": "Visual search temporarily unavailable with GridFS storage"}
-        
+        return await run_hybrid_search("", file, status, page, page_size)
+    except (HTTPException, image_pool.PoolFull):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in visual search: {str(e)}")
 
 @app.get("/search/")
-def search_items(q: str = "", status: str = "All"):
+def search_items(q: str = "", status: str = "All", include_archived: bool = False, category: str = None,
+                 mode: Literal["substring", "fuzzy"] = "substring", limit: int = 50):
+    """Search items; mode=fuzzy tolerates typos and ranks by closeness (live items only, top `limit`)"""
     try:
-        if not q:
+        if not q and not category and not include_archived:
             # If no query, return all items
             items = db.fetch_all_items()
+        elif mode == "fuzzy" and q:
+            items = db.fuzzy_search_items(q, status if status != "All" else None, category, min(max(limit, 1), 200))
         else:
-            items = db.search_items(q, status if status != "All" else None)
+            items = db.search_items(q, status if status != "All" else None, include_archived, category)
         return {"items": items, "count": len(items), "query": q}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching items: {str(e)}")
 
+@app.get("/suggest")
+def get_suggestions(prefix: str = "", limit: int = 8):
+    """Completions for the search box: titles, categories and locations ranked by frequency and recency"""
+    if not 1 <= limit <= 20:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 20")
+    return {"prefix": prefix, "suggestions": suggest.suggest(prefix[:100], limit), "ready": suggest.is_ready()}
+
+@app.get("/facets")
+def get_facets():
+    """Item counts by status, category, location and month (cached, kept current on writes)"""
+    try:
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+        
+        return facets.get_facets(mongo_db.compute_facets)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in facets endpoint: {e}")
+        raise HTTPException(status_code=500, detail=f"Error computing facets: {str(e)}")
+
 @app.get("/")
 def read_root():
     """Root endpoint to verify API is running"""
@@ -247,6 +617,40 @@ def ping():
     """Simple ping endpoint for Railway health checks"""
     return {"status": "ok", "message": "pong"}
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+def require_debug_token(token: Optional[str]):
+    if not tracing.check_debug_token(token):
+        # Look like any unknown route unless the caller holds DEBUG_TOKEN
+        raise HTTPException(status_code=404, detail="Not Found")
+
+def require_admin_token(token: Optional[str]):
+    if not (ADMIN_TOKEN and token is not None and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())):
+        # Like the debug routes, unknown to anyone without ADMIN_TOKEN
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/debug/traces")
+def debug_traces(debug_token: Optional[str] = Header(None, alias="X-Debug-Token")):
+    """Recently finished traces (send X-Trace: 1 with X-Debug-Token or set TRACE_SAMPLE_RATE to record them)"""
+    require_debug_token(debug_token)
+    traces = tracing.recent_traces()
+    return {"traces": traces, "count": len(traces)}
+
+@app.get("/debug/profile/{trace_id}")
+def debug_profile(trace_id: str, format: str = "collapsed",
+                  debug_token: Optional[str] = Header(None, alias="X-Debug-Token")):
+    """Profile of one trace: collapsed stacks for flamegraph tools, or JSON with spans"""
+    require_debug_token(debug_token)
+    trace = tracing.get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found (it may have been evicted)")
+    if format == "json":
+        return {**trace.summary(), "spans": trace.spans, "stacks": dict(trace.samples)}
+    return PlainTextResponse(trace.collapsed_stacks())
+
 @app.get("/health/detailed")
 def health_check_detailed():
     """Detailed health check endpoint"""
@@ -289,7 +693,7 @@ def full_health_check():
     return {
         "status": "healthy" if database_status == "connected" else "degraded",
         "database": database_status,
-        "storage": "GridFS",
+        "storage": image_store.IMAGE_STORE,
         "service": "Lost and Found API",
         "timestamp": datetime.now().isoformat()
     }
@@ -315,6 +719,124 @@ def cleanup_temp_files_endpoint():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during cleanup: {str(e)}")
 
+def parse_date_param(value: str, name: str):
+    """Parse an ISO date/datetime query parameter (naive values are taken as UTC)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date, e.g. 2024-01-31")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+@app.get("/items/query")
+def query_items(
+    category: Optional[str] = None,
+    status: Optional[Literal["Lost", "Found"]] = None,
+    location: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    days: Optional[int] = None,
+    has_image: Optional[bool] = None,
+    limit: int = 100,
+    skip: int = 0
+):
+    """Filter items by category, status, location, date range (or the last `days` days) and image presence"""
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+    if skip < 0 or (days is not None and days < 1):
+        raise HTTPException(status_code=400, detail="skip must be >= 0 and days >= 1")
+    start = parse_date_param(date_from, "date_from")
+    end = parse_date_param(date_to, "date_to")
+    if days is not None:
+        start = datetime.now(timezone.utc) - timedelta(days=days)
+    try:
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+        
+        items = db.query_items(category, status, location, start, end, has_image, limit, skip)
+        return {"items": items, "count": len(items)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in query endpoint: {e}")
+        raise HTTPException(status_code=500, detail=f"Error querying items: {str(e)}")
+
+@app.get("/export")
+def export_items(
+    format: str = "ndjson",
+    gzip: bool = False,
+    status: str = "All",
+    date_from: str = None,
+    date_to: str = None,
+    batch_size: int = 1000
+):
+    """Stream the whole catalogue (or a status/date slice of it) as NDJSON or CSV"""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    if not 1 <= batch_size <= 10000:
+        raise HTTPException(status_code=400, detail="batch_size must be between 1 and 10000")
+    start = parse_date_param(date_from, "date_from")
+    end = parse_date_param(date_to, "date_to")
+    
+    mongo_db = db.get_mongodb()
+    if mongo_db.client is None:
+        raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+    
+    filename = f"items.{format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        exporter.stream_export(format, gzip, status, start, end, batch_size),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.post("/admin/gc-images")
+def gc_images_endpoint(dry_run: bool = True, batch_size: int = 500, min_age_minutes: int = 60,
+                       admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Admin endpoint to report (dry_run) or delete image files no item references"""
+    require_admin_token(admin_token)
+    try:
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+        return db.sweep_orphan_images(dry_run, max(1, min(batch_size, 5000)), IMAGE_GC_PAUSE_SECONDS, min_age_minutes)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error sweeping images: {str(e)}")
+
+@app.post("/admin/archive")
+def archive_endpoint(dry_run: bool = True, max_batches: int = None,
+                     admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Admin endpoint to move items matching the archive policy to the cold tier"""
+    require_admin_token(admin_token)
+    try:
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+        return archiver.run_archive(dry_run=dry_run, max_batches=max_batches)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error archiving items: {str(e)}")
+
+@app.post("/admin/backfill-item-keys")
+def backfill_item_keys_endpoint(recompute: bool = False,
+                                admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Admin endpoint to set category and location keys on existing items (recompute=true redoes all)"""
+    require_admin_token(admin_token)
+    try:
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            raise HTTPException(status_code=503, detail="Database not available. Please check MongoDB connection.")
+        return db.backfill_item_keys(recompute=recompute)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error backfilling item keys: {str(e)}")
+
 @app.get("/api/items-with-urls")
 def get_items_with_urls():
     """Get all items with shareable image URLs"""
@@ -339,6 +861,8 @@ def search_by_image_url(request: dict):
             "count": len(results),
             "query_url": image_url
         }
+    except (HTTPException, gemini_api.ClassificationBusy):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in image search: {str(e)}")
 
@@ -346,17 +870,18 @@ def search_by_image_url(request: dict):
 def classify_image_endpoint(image_url: str):
     """Classify an image from URL using Gemini AI"""
     try:
-        from gemini_api import classify_image_from_url
-        
         if not image_url:
             raise HTTPException(status_code=400, detail="image_url parameter is required")
         
-        category = classify_image_from_url(image_url)
+        # Our own /images/{id} URLs are resolved from the database, others are downloaded
+        category = db.classify_image_url(image_url)
         return {
             "image_url": image_url,
             "category": category,
             "success": True
         }
+    except (HTTPException, gemini_api.ClassificationBusy):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error classifying image: {str(e)}")
 
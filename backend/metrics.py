@@ -0,0 +1,279 @@
+"""Lightweight Prometheus-style metrics
+
+A minimal in-process registry of counters, gauges and histograms rendered in
+the Prometheus text exposition format by the /metrics endpoint. Recording a
+sample is a dict lookup and a few additions under a lock, so instrumenting
+hot paths costs well under a microsecond.
+
+Usage:
+    @metrics.mongo_op
+    def get_image(self, file_id): ...
+
+    metrics.GRIDFS_BYTES_READ.inc(len(data))
+"""
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to slow AI calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: List["_Metric"] = []
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class Gauge(_Metric):
+    """Point-in-time value, either set directly or read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        if self._callback is not None:
+            try:
+                return [f"{self.name} {_format_value(self._callback())}"]
+            except Exception:
+                return []
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class Histogram(_Metric):
+    """Bucketed distribution of observations (cumulative buckets on render)"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        """Context manager observing the elapsed time of its block"""
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+# --- Metrics shared across modules ---
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+)
+MONGO_OP_SECONDS = Histogram("mongo_operation_duration_seconds", "MongoDB method latency", ["op"])
+MONGO_OP_ERRORS = Counter("mongo_operation_errors_total", "MongoDB method calls that failed, whether they raised or returned a default", ["op"])
+GRIDFS_BYTES_READ = Counter("gridfs_bytes_read_total", "Bytes read from GridFS")
+GRIDFS_BYTES_WRITTEN = Counter("gridfs_bytes_written_total", "Bytes written to GridFS")
+GEMINI_SECONDS = Histogram("gemini_request_duration_seconds", "Gemini classification latency", ["source"])
+GEMINI_ERRORS = Counter("gemini_errors_total", "Failed Gemini classifications", ["source"])
+GEMINI_TIMEOUTS = Counter("gemini_timeouts_total", "Gemini classifications that timed out", ["source"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by result", ["cache", "result"])
+
+def _cache_hit_ratio(cache: str) -> float:
+    hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+    total = hits + CACHE_REQUESTS.value(cache=cache, result="miss")
+    return hits / total if total else 0.0
+
+def register_cache(cache: str):
+    """Expose a <cache>_cache_hit_ratio gauge computed from CACHE_REQUESTS"""
+    Gauge(f"{cache}_cache_hit_ratio", f"Hit ratio of the {cache} cache", callback=lambda: _cache_hit_ratio(cache))
+
+def cache_result(cache: str, hit: bool, count: int = 1):
+    """Record cache hits or misses"""
+    if count:
+        CACHE_REQUESTS.inc(count, cache=cache, result="hit" if hit else "miss")
+
+# Per thread: [op, seconds spent outside MongoDB] for each mongo_op call in progress
+_mongo_ops = threading.local()
+
+def _op_stack() -> list:
+    stack = getattr(_mongo_ops, "stack", None)
+    if stack is None:
+        stack = _mongo_ops.stack = []
+    return stack
+
+def mongo_op(func):
+    """Decorator timing a MongoDB method under its own name
+
+    Time spent in functions marked with not_mongo (Gemini calls, image
+    processing) is left out, so the histogram measures the database work.
+    """
+    op = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _op_stack()
+        frame = [op, 0.0]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            MONGO_OP_ERRORS.inc(op=op)
+            raise
+        finally:
+            stack.pop()
+            MONGO_OP_SECONDS.observe(max(0.0, time.perf_counter() - start - frame[1]), op=op)
+    return wrapper
+
+def mongo_error():
+    """Count an error that the current mongo_op method handles instead of raising"""
+    stack = _op_stack()
+    if stack:
+        MONGO_OP_ERRORS.inc(op=stack[-1][0])
+
+def not_mongo(func):
+    """Decorator excluding a function's time from the mongo_op methods that call it"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _op_stack()
+        if not stack:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            for frame in stack:
+                frame[1] += elapsed
+    return wrapper
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route template
+
+    Labels use the matched route path (e.g. /images/{file_id}) rather than the
+    raw URL so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"]
+            )
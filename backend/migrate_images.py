@@ -0,0 +1,111 @@
+"""Copy images from one image store to another
+
+Streams the source store's listing and copies each original image that the
+target doesn't have yet, keeping its ID, so items need no update. Derived
+images (thumbnails) aren't copied: they are regenerated on first request.
+
+Run it while the API serves with IMAGE_STORE=<target> and
+IMAGE_STORE_MIGRATE_FROM=<source> (see image_store.py): new uploads already go
+to the target and reads fall back to the source meanwhile. Copying is
+idempotent, so an interrupted run is resumed by starting it again. Once it
+reports nothing left to copy, drop IMAGE_STORE_MIGRATE_FROM; --delete-source
+then frees the old store. Anything left behind by a delete racing the copy is
+an orphan that sweep_orphan_images removes.
+
+Usage:
+    python migrate_images.py --from gridfs --to filesystem
+    python migrate_images.py --from gridfs --to s3 --dry-run
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict
+
+import image_store
+import mongodb as db
+
+PROGRESS_EVERY = 1000
+
+def migrate(source: image_store.ImageStore, target: image_store.ImageStore, batch_size: int = 100,
+            dry_run: bool = False, delete_source: bool = False, pause_seconds: float = 0.0) -> Dict[str, Any]:
+    """Copy every original image in source that target lacks; returns counts"""
+    report = {"dry_run": dry_run, "seen": 0, "copied": 0, "skipped": 0, "missing": 0, "errors": 0,
+              "bytes": 0, "source_deleted": 0}
+    started = time.time()
+    batch = []
+
+    def flush():
+        pending = [image for image in batch if not target.exists(image["file_id"])]
+        report["skipped"] += len(batch) - len(pending)
+        if dry_run:
+            report["copied"] += len(pending)
+            report["bytes"] += sum(image["length"] for image in pending)
+            batch.clear()
+            return
+        found = source.get_many([image["file_id"] for image in pending])
+        # Deleted since it was listed
+        report["missing"] += len(pending) - len(found)
+        copied = [image["file_id"] for image in batch if image not in pending]
+        for file_id, data in found.items():
+            try:
+                info = source.info(file_id) or {}
+                target.put(data, info.get("filename"), info.get("content_type"), file_id, info.get("metadata"))
+            except Exception as e:
+                # Most likely a read-through copy by the API got there first
+                if not target.exists(file_id):
+                    print(f"Error copying image {file_id}: {e}")
+                    report["errors"] += 1
+                    continue
+            report["copied"] += 1
+            report["bytes"] += len(data)
+            copied.append(file_id)
+        if delete_source:
+            report["source_deleted"] += source.delete(copied)
+        batch.clear()
+        if pause_seconds:
+            time.sleep(pause_seconds)
+
+    for image in source.iter_files():
+        if image["derived_from"]:
+            continue
+        report["seen"] += 1
+        batch.append(image)
+        if len(batch) >= batch_size:
+            flush()
+        if report["seen"] % PROGRESS_EVERY == 0:
+            print(f"📦 {report['seen']} images seen, {report['copied']} copied, "
+                  f"{report['skipped']} already there ({time.time() - started:.0f}s)")
+    flush()
+
+    report["seconds"] = round(time.time() - started, 1)
+    print(f"📦 Image migration ({'dry run' if dry_run else 'copy'}): {report['seen']} images, "
+          f"{report['copied']} copied, {report['skipped']} already there, {report['errors']} errors")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy images between image stores")
+    parser.add_argument("--from", dest="source", required=True, choices=["gridfs", "filesystem", "s3"])
+    parser.add_argument("--to", dest="target", required=True, choices=["gridfs", "filesystem", "s3"])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be copied")
+    parser.add_argument("--delete-source", action="store_true",
+                        help="Delete each image from the source once the target has it")
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--from and --to must be different stores")
+
+    database = None
+    if "gridfs" in (args.source, args.target):
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            raise SystemExit("Could not connect to MongoDB")
+        database = mongo_db.db
+    source = image_store.create(args.source, database, db.ARCHIVE_BUCKET_NAME)
+    target = image_store.create(args.target, database, db.ARCHIVE_BUCKET_NAME)
+    print(f"📦 Copying images from {source.describe()} to {target.describe()}")
+    result = migrate(source, target, max(1, args.batch_size), args.dry_run, args.delete_source, args.pause)
+    print(json.dumps(result, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
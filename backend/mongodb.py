@@ -2,9 +2,22 @@ from pymongo import MongoClient
 from datetime import datetime
 import pytz
 import os
-import gridfs
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Iterator
 from dotenv import load_dotenv
+import facets
+import fuzzy
+import hybrid
+import image_cache
+import image_fetch
+import image_pool
+import image_store
+import item_query
+import suggest
+import metrics
+import taxonomy
+import tracing
+import visual_index
 
 # Load environment variables
 load_dotenv()
@@ -12,38 +25,195 @@ load_dotenv()
 # MongoDB connection settings
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "lost_and_found")
+# Connections per process; with several gunicorn workers the total is workers * pool size
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
 COLLECTION_NAME = "items"
+# Cold tier: archived items and (optionally) their images
+ARCHIVE_COLLECTION_NAME = "items_archive"
+ARCHIVE_BUCKET_NAME = "fs_archive"
+IMPORTS_COLLECTION_NAME = "imports"
+MAX_IMPORT_ERRORS = 1000  # Row errors kept per import record
+RATE_LIMITS_COLLECTION_NAME = "rate_limits"  # Shared token buckets (RATE_LIMIT_BACKEND=mongo)
+IDEMPOTENCY_COLLECTION_NAME = "idempotency_keys"  # Claimed Idempotency-Keys and their responses
+LEASES_COLLECTION_NAME = "leases"  # Which worker runs each singleton background job
+MIGRATIONS_COLLECTION_NAME = "migrations"  # One-off data migrations that have completed
+DELETED_IMAGES_COLLECTION_NAME = "deleted_images"  # Recent image deletions, for other workers' image caches
+DELETED_IMAGES_TTL_SECONDS = 24 * 3600
 
+# Unique: one file per source image and variant (originals lack both fields)
+DERIVED_INDEX = [("metadata.derived_from", 1), ("metadata.variant", 1)]
+DERIVED_INDEX_NAME = "metadata.derived_from_1_metadata.variant_1"
+
+# Indexes replaced by later ones (category filters moved to category_keys; the
+# first facet index used the raw location), dropped by ensure_indexes
+OBSOLETE_INDEXES = {
+    COLLECTION_NAME: [
+        "category_key_1_timestamp_-1", "status_1_category_key_1_timestamp_-1",
+        "category_key_1_location_key_1_timestamp_-1", "status_1_category_key_1_location_1_timestamp_1"
+    ],
+    ARCHIVE_COLLECTION_NAME: ["category_key_1_timestamp_-1"],
+}
+
+# Fields read for exports (keeps large internal fields off the wire)
+EXPORT_PROJECTION = {
+    "title": 1, "description": 1, "category": 1, "ai_category": 1, "location": 1,
+    "status": 1, "name": 1, "contact": 1, "image_file_id": 1, "timestamp": 1
+}
+
+# Fields a facet count needs; also what delete/archive read back to uncount an item
+FACET_PROJECTION = {"status": 1, "category_key": 1, "location_key": 1, "timestamp": 1}
+# Covers FACET_PROJECTION, so compute_facets scans the index without loading documents
+# (the query indexes hold the category_keys array, and multikey indexes can't cover)
+FACET_INDEX = [("status", 1), ("category_key", 1), ("location_key", 1), ("timestamp", -1)]
+
+# Fields the in-memory text search indexes (fuzzy, suggest) are built from
+SEARCH_TEXT_PROJECTION = {
+    "title": 1, "description": 1, "category": 1, "ai_category": 1, "status": 1, "category_key": 1,
+    "category_keys": 1, "location": 1, "timestamp": 1
+}
+
+# Fields left out when listing items (feature vectors are only read by visual search)
+LIST_PROJECTION = {"features": 0}
+
+# Per-row helpers are left out so a search doesn't record one span per result
+@tracing.traced_class("mongodb", exclude=(
+    "get_ist_timestamp", "format_ist_timestamp", "generate_image_url", "build_item_document", "item_to_dict"
+))
 class MongoDB:
-    def __init__(self):
+    def __init__(self, connect: bool = True):
         self.client = None
         self.db = None
         self.collection = None
-        self.fs = None  # GridFS for image storage
+        self.images = None  # Image storage (GridFS unless IMAGE_STORE says otherwise)
+        self.archive_collection = None
         # Use environment variable for base URL, fallback to localhost for development
         self.base_url = os.getenv("BASE_URL", "http://localhost:8000")  # Configurable base URL for global access
-        self.connect()
+        if connect:
+            self.connect()
     
-    def connect(self):
-        """Connect to MongoDB with improved error handling"""
+    def connect(self) -> bool:
+        """Connect to MongoDB with improved error handling
+        
+        Only connection failures return False (and are retried by init_db); an
+        image store that can't be created raises, since retrying won't fix it
+        (image_store.validate_env normally stops startup before this).
+        """
+        client = None
         try:
-            self.client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
-            self.db = self.client[DATABASE_NAME]
-            self.collection = self.db[COLLECTION_NAME]
-            self.fs = gridfs.GridFS(self.db)  # Initialize GridFS
+            client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000, maxPoolSize=MONGO_MAX_POOL_SIZE)
             # Test the connection with timeout
-            self.client.admin.command('ping')
-            print(f"✅ Connected to MongoDB at {MONGO_URL}")
-            print("✅ GridFS initialized for image storage")
+            client.admin.command('ping')
         except Exception as e:
             print(f"❌ Failed to connect to MongoDB: {e}")
             print("💡 Make sure MongoDB is running or use MongoDB Atlas cloud service")
             print("⚠️  API will start but database operations will fail until connection is established")
+            if client is not None:
+                # Stop its monitor threads and sockets, or every reconnect attempt leaks them
+                client.close()
             # Don't raise the exception - let the app start without DB connection
             self.client = None
             self.db = None
             self.collection = None
-            self.fs = None
+            self.images = None
+            self.archive_collection = None
+            return False
+        database = client[DATABASE_NAME]
+        try:
+            images = image_store.from_env(database, ARCHIVE_BUCKET_NAME)
+        except Exception as e:
+            print(f"❌ Image store misconfigured: {e}")
+            client.close()
+            raise
+        self.db = database
+        self.collection = database[COLLECTION_NAME]
+        self.images = images
+        self.archive_collection = database[ARCHIVE_COLLECTION_NAME]
+        # Set last: request handlers treat a non-None client as "ready"
+        self.client = client
+        print(f"✅ Connected to MongoDB at {MONGO_URL}")
+        print(f"✅ Image store: {self.images.describe()}")
+        self.ensure_indexes()
+        return True
+    
+    def ensure_indexes(self):
+        """Create the indexes our queries rely on (no-op if they already exist)"""
+        try:
+            # Derived images (thumbnails) are looked up by their source file and variant
+            self.ensure_derived_index()
+            # Listings and exports are ordered by timestamp, optionally per status
+            self.collection.create_index([("timestamp", -1)])
+            self.collection.create_index([("status", 1), ("timestamp", -1)])
+            # Image cleanup looks items up by their image file
+            self.collection.create_index("image_file_id", sparse=True)
+            # Archived items are listed by date and looked up by image
+            self.archive_collection.create_index([("timestamp", -1)])
+            self.archive_collection.create_index("image_file_id", sparse=True)
+            # Images moved to the archive bucket are copied at the document level,
+            # so the indexes GridFS normally creates on first write are added here
+            archive_bucket = self.db[ARCHIVE_BUCKET_NAME]
+            archive_bucket.chunks.create_index([("files_id", 1), ("n", 1)], unique=True)
+            archive_bucket.files.create_index(DERIVED_INDEX)
+            # Bulk imports tag rows so replays after a crash are skipped
+            self.collection.create_index("import_ref", unique=True, sparse=True)
+            # Background classification picks up pending items
+            self.collection.create_index("classification_pending", sparse=True)
+            # Category filters and image search are equality lookups on the canonical keys
+            self.archive_collection.create_index([("category_keys", 1), ("timestamp", -1)])
+            # Structured queries hint one index per combination of filters
+            for keys in item_query.QUERY_INDEXES.values():
+                self.collection.create_index(keys)
+            self.collection.create_index(FACET_INDEX)
+            self.drop_obsolete_indexes()
+            # Idle rate limit buckets expire once they would have refilled
+            self.db[RATE_LIMITS_COLLECTION_NAME].create_index("expires_at", expireAfterSeconds=0)
+            # Image deletions only need to outlive the image caches' polling interval
+            self.db[DELETED_IMAGES_COLLECTION_NAME].create_index(
+                "deleted_at", expireAfterSeconds=DELETED_IMAGES_TTL_SECONDS
+            )
+            # Idempotency keys are kept for IDEMPOTENCY_TTL_HOURS
+            self.db[IDEMPOTENCY_COLLECTION_NAME].create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            print(f"⚠️ Could not create indexes: {e}")
+    
+    def ensure_derived_index(self):
+        """Make the (source, variant) index of derived images unique, so concurrent
+        thumbnail requests can't store the same variant twice
+
+        Duplicates stored while the index wasn't unique are removed first.
+        """
+        from pymongo.errors import OperationFailure
+        files = self.db.fs.files
+        index = files.index_information().get(DERIVED_INDEX_NAME)
+        if index and index.get("unique"):
+            return
+        groups = files.aggregate([
+            {"$match": {"metadata.derived_from": {"$exists": True}}},
+            {"$group": {
+                "_id": {"source": "$metadata.derived_from", "variant": "$metadata.variant"},
+                "ids": {"$push": "$_id"}, "count": {"$sum": 1}
+            }},
+            {"$match": {"count": {"$gt": 1}}},
+        ], allowDiskUse=True)
+        extra = [object_id for group in groups for object_id in sorted(group["ids"])[1:]]
+        if extra:
+            self._delete_files_bulk(extra)
+            print(f"🗑️ Removed {len(extra)} duplicate derived images")
+        if index:
+            try:
+                files.drop_index(DERIVED_INDEX_NAME)
+            except OperationFailure:
+                pass  # another worker got there first
+        files.create_index(DERIVED_INDEX, unique=True, sparse=True, name=DERIVED_INDEX_NAME)
+    
+    def drop_obsolete_indexes(self):
+        """Drop the indexes in OBSOLETE_INDEXES that still exist"""
+        for collection_name, names in OBSOLETE_INDEXES.items():
+            collection = self.db[collection_name]
+            existing = set(collection.index_information())
+            for name in names:
+                if name in existing:
+                    collection.drop_index(name)
+                    print(f"🗑️ Dropped obsolete index {collection_name}.{name}")
     
     def get_ist_timestamp(self):
         """Get current timestamp in Indian Standard Time"""
@@ -67,48 +237,109 @@ class MongoDB:
         except:
             return str(timestamp) + ' IST'
     
+    @metrics.mongo_op
     def store_image(self, image_data: bytes, filename: str) -> str:
-        """Store image in GridFS and return the file ID"""
+        """Store an image in the image store and return the file ID"""
         try:
-            file_id = self.fs.put(image_data, filename=filename)
-            return str(file_id)
+            return self.images.put(image_data, filename)
         except Exception as e:
-            print(f"Error storing image in GridFS: {e}")
+            print(f"Error storing image: {e}")
             raise e
     
+    def open_image_upload(self, filename: str, content_type: str = None) -> image_store.ImageUpload:
+        """Open an upload stream for an image written chunk by chunk (see uploads.py)"""
+        return self.images.open_upload(filename, content_type)
+    
+    @metrics.mongo_op
     def get_image(self, file_id: str) -> bytes:
-        """Retrieve image from GridFS by file ID"""
+        """Retrieve an image from the image store by file ID"""
+        try:
+            data = self.images.get(file_id)
+            if data is None:
+                print(f"No image found with ID: {file_id}")
+            return data
+        except Exception as e:
+            metrics.mongo_error()
+            print(f"Error retrieving image: {e}")
+            return None
+    
+    @metrics.mongo_op
+    def get_thumbnails(self, file_ids: List[str], size: int = 120) -> Dict[str, bytes]:
+        """Get JPEG thumbnails for many images in one batched read per kind
+        
+        Thumbnails are stored back into the image store as derived files so later
+        requests only read the small derivative. Unknown or invalid IDs are left out of the result.
+        """
         try:
             from bson import ObjectId
-            from bson.errors import InvalidId
-            from gridfs.errors import NoFile
+            from image_utils import make_thumbnail
             
-            # Validate ObjectId format
-            try:
-                object_id = ObjectId(file_id)
-            except InvalidId:
-                print(f"Invalid ObjectId format: {file_id}")
-                return None
+            source_ids = [str(file_id) for file_id in dict.fromkeys(file_ids) if ObjectId.is_valid(file_id)]
+            if not source_ids:
+                return {}
+            variant = f"thumb_{size}"
             
-            # Check if file exists and retrieve it
-            grid_out = self.fs.get(object_id)
-            return grid_out.read()
+            # Already generated thumbnails
+            thumbnails = self.images.get_derived_many(source_ids, variant)
             
-        except NoFile:
-            print(f"No file found in GridFS with ID: {file_id}")
-            return None
+            # Generate the rest from the originals and store them for next time
+            missing = [file_id for file_id in source_ids if file_id not in thumbnails]
+            metrics.cache_result("thumbnail", True, len(thumbnails))
+            metrics.cache_result("thumbnail", False, len(missing))
+            if missing:
+                originals = self.images.get_many(missing)
+                # Decode and resize in the image process pool, spread across cores
+                results = image_pool.map_sync(make_thumbnail, [(data, (size,)) for data in originals.values()])
+                for file_id, thumbnail in zip(originals, results):
+                    if isinstance(thumbnail, Exception):
+                        print(f"Error generating thumbnail for {file_id}: {thumbnail}")
+                        continue
+                    self.images.put_derived(file_id, variant, thumbnail)
+                    thumbnails[file_id] = thumbnail
+            
+            return thumbnails
+        except image_pool.PoolFull:
+            raise
         except Exception as e:
-            print(f"Error retrieving image from GridFS: {e}")
-            return None
+            metrics.mongo_error()
+            print(f"Error retrieving thumbnails: {e}")
+            return {}
+    
+    def _delete_files_bulk(self, object_ids: List[Any], bucket: str = "fs") -> int:
+        """Remove GridFS files and their chunks with one delete_many each"""
+        self._invalidate_cached_images([str(object_id) for object_id in object_ids])
+        return image_store.delete_gridfs_files(self.db, object_ids, bucket)
+    
+    def _invalidate_cached_images(self, file_ids: List[str]):
+        """Drop deleted images from this worker's image cache and tell the other workers"""
+        for file_id in file_ids:
+            image_cache.invalidate(file_id)
+        if not file_ids:
+            return
+        now = datetime.utcnow()
+        try:
+            self.db[DELETED_IMAGES_COLLECTION_NAME].insert_many(
+                [{"file_id": file_id, "deleted_at": now} for file_id in file_ids], ordered=False
+            )
+        except Exception as e:
+            print(f"Error recording image deletions: {e}")
+    
+    @metrics.mongo_op
+    def deleted_images_since(self, since: datetime) -> List[str]:
+        """IDs of images deleted (by any worker) at or after since"""
+        cursor = self.db[DELETED_IMAGES_COLLECTION_NAME].find({"deleted_at": {"$gte": since}}, {"file_id": 1, "_id": 0})
+        return [doc["file_id"] for doc in cursor]
     
+    @metrics.mongo_op
     def delete_image(self, file_id: str) -> bool:
-        """Delete image from GridFS"""
+        """Delete image from the image store together with all of its derived files (thumbnails)"""
         try:
-            from bson import ObjectId
-            self.fs.delete(ObjectId(file_id))
-            return True
+            deleted = self.images.delete([file_id])
+            self._invalidate_cached_images([file_id])
+            return deleted > 0
         except Exception as e:
-            print(f"Error deleting image from GridFS: {e}")
+            metrics.mongo_error()
+            print(f"Error deleting image: {e}")
             return False
     
     def generate_image_url(self, file_id: str) -> str:
@@ -117,18 +348,47 @@ class MongoDB:
             return None
         return f"{self.base_url}/images/{file_id}"
     
-    def insert_item(self, item, image_data: bytes = None, image_filename: str = None) -> str:
-        """Insert a new item into the database with image stored in GridFS and AI classification"""
+    def build_item_document(self, item, image_file_id: str = None, ai_category: str = None, timestamp=None,
+                            features=None) -> Dict[str, Any]:
+        """Build the stored document for a reported item"""
+        document = {
+            "title": item.title,
+            "description": item.description,
+            "category": item.category,
+            "ai_category": ai_category,  # Store AI classification
+            "location": item.location,
+            "status": item.status,
+            "name": item.name,
+            "contact": item.contact,
+            "image_file_id": image_file_id,  # Store image file ID instead of path
+            "image_url": self.generate_image_url(image_file_id),  # Store shareable URL
+            **taxonomy.item_keys(ai_category, item.category),
+            "location_key": item_query.location_key(item.location),
+            "timestamp": timestamp or self.get_ist_timestamp()
+        }
+        if features is not None and len(features):
+            # Colour features of the image, used for visual similarity without re-decoding it
+            document["features"] = [float(value) for value in features]
+        return document
+    
+    @metrics.mongo_op
+    def insert_item(self, item, image_data: bytes = None, image_filename: str = None,
+                    image_file_id: str = None, ai_category: str = None, features=None,
+                    classification_pending: bool = False, classified_by: str = None) -> str:
+        """Insert a new item into the database with image stored in the image store and AI classification
+        
+        Pass image_file_id (and ai_category) when the caller has already stored
+        and classified the image, so it is not written or classified twice.
+        features are the image's extract_features_from_bytes vector, if computed.
+        classification_pending marks the item for the background classify queue.
+        classified_by="local" records that ai_category came from local_classifier.
+        """
         try:
-            image_file_id = None
-            ai_category = None
-            image_url = None
-            
-            if image_data and image_filename:
-                # Store image in GridFS
+            if image_data and image_filename and not image_file_id:
+                # Store image in the image store
                 image_file_id = self.store_image(image_data, image_filename)
-                image_url = self.generate_image_url(image_file_id)
-                
+            
+            if image_data and ai_category is None and not classification_pending:
                 # Use Gemini API to classify the image
                 try:
                     from gemini_api import classify_image_from_bytes
@@ -138,30 +398,207 @@ class MongoDB:
                     print(f"AI classification failed: {e}")
                     ai_category = "Uncategorized"
             
-            document = {
-                "title": item.title,
-                "description": item.description,
-                "category": item.category,
-                "ai_category": ai_category,  # Store AI classification
-                "location": item.location,
-                "status": item.status,
-                "name": item.name,
-                "contact": item.contact,
-                "image_file_id": image_file_id,  # Store GridFS file ID instead of path
-                "image_url": image_url,  # Store shareable URL
-                "timestamp": self.get_ist_timestamp()
-            }
-            
+            document = self.build_item_document(item, image_file_id, ai_category, features=features)
+            if classification_pending:
+                document["classification_pending"] = True
+            if classified_by:
+                document["classified_by"] = classified_by
             result = self.collection.insert_one(document)
+            facets.record_insert(document)
+            fuzzy.record_insert(document)
+            suggest.record_insert(document)
+            visual_index.record_insert(document)
             return str(result.inserted_id)
         except Exception as e:
             print(f"Error inserting item: {e}")
             raise e
     
+    @metrics.mongo_op
+    def insert_items_bulk(self, documents: List[Dict[str, Any]]) -> tuple:
+        """Insert many item documents with one unordered insert_many
+        
+        Returns (inserted ids by document index, indexes rejected as duplicates).
+        Duplicates are expected when an interrupted import is replayed.
+        """
+        from pymongo.errors import BulkWriteError
+        
+        if not documents:
+            return {}, []
+        try:
+            result = self.collection.insert_many(documents, ordered=False)
+            inserted, failed = {index: str(_id) for index, _id in enumerate(result.inserted_ids)}, set()
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in write_errors):
+                raise
+            failed = {error["index"] for error in write_errors}
+            # insert_many sets _id on each document before sending it
+            inserted = {index: str(doc["_id"]) for index, doc in enumerate(documents) if index not in failed}
+        for index in inserted:
+            facets.record_insert(documents[index])
+            fuzzy.record_insert(documents[index])
+            suggest.record_insert(documents[index])
+            visual_index.record_insert(documents[index])
+        return inserted, sorted(failed)
+    
+    @metrics.mongo_op
+    def find_existing_import_refs(self, import_refs: List[str]) -> set:
+        """Return the subset of import references that are already stored"""
+        cursor = self.collection.find({"import_ref": {"$in": import_refs}}, {"import_ref": 1})
+        return {doc["import_ref"] for doc in cursor}
+    
+    @metrics.mongo_op
+    def get_import_state(self, import_id: str) -> Optional[Dict[str, Any]]:
+        """Get the progress record of a bulk import"""
+        return self.db[IMPORTS_COLLECTION_NAME].find_one({"_id": import_id})
+    
+    @metrics.mongo_op
+    def save_import_state(self, import_id: str, state: Dict[str, Any], new_errors: List[Dict] = None):
+        """Upsert the progress record of a bulk import, keeping the most recent row errors"""
+        update = {"$set": {**state, "updated_at": datetime.utcnow()}}
+        if new_errors:
+            update["$push"] = {"errors": {"$each": new_errors, "$slice": -MAX_IMPORT_ERRORS}}
+        self.db[IMPORTS_COLLECTION_NAME].update_one({"_id": import_id}, update, upsert=True)
+    
+    @metrics.mongo_op
+    def claim_idempotency_key(self, key: str, fingerprint: str, lock_seconds: float,
+                              ttl_seconds: float) -> Optional[Dict[str, Any]]:
+        """Claim an idempotency key; returns None when claimed, else the existing record
+        
+        An unfinished claim whose lock has run out (its request died with its
+        worker) is taken over.
+        """
+        from datetime import timedelta
+        from pymongo.errors import DuplicateKeyError
+        keys = self.db[IDEMPOTENCY_COLLECTION_NAME]
+        now = datetime.utcnow()
+        locked_until = now + timedelta(seconds=lock_seconds)
+        try:
+            keys.insert_one({
+                "_id": key,
+                "fingerprint": fingerprint,
+                "response": None,
+                "created_at": now,
+                "locked_until": locked_until,
+                "expires_at": now + timedelta(seconds=ttl_seconds)
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+        taken = keys.update_one(
+            {"_id": key, "fingerprint": fingerprint, "response": None, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": locked_until}}
+        )
+        if taken.modified_count:
+            return None
+        record = keys.find_one({"_id": key})
+        if record is None:
+            # Expired or released in the meantime
+            return self.claim_idempotency_key(key, fingerprint, lock_seconds, ttl_seconds)
+        return record
+    
+    @metrics.mongo_op
+    def complete_idempotency_key(self, key: str, response: Dict[str, Any]):
+        """Store the response of a claimed idempotency key"""
+        self.db[IDEMPOTENCY_COLLECTION_NAME].update_one({"_id": key}, {"$set": {"response": response}})
+    
+    @metrics.mongo_op
+    def release_idempotency_key(self, key: str):
+        """Forget an unfinished idempotency key claim"""
+        self.db[IDEMPOTENCY_COLLECTION_NAME].delete_one({"_id": key, "response": None})
+    
+    @metrics.mongo_op
+    def claim_pending_classification(self, item_id: str, claim_seconds: float) -> Optional[Dict[str, Any]]:
+        """Atomically claim a pending item for classification; None if it is done or claimed elsewhere
+        
+        Every worker re-queues pending items on startup, so the claim is what keeps
+        them from classifying the same item in parallel. A claim that runs out
+        (its worker died) can be taken again.
+        """
+        from bson import ObjectId
+        from datetime import timedelta
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                "_id": ObjectId(item_id),
+                "classification_pending": True,
+                "$or": [{"classification_claimed_until": None}, {"classification_claimed_until": {"$lt": now}}]
+            },
+            {"$set": {"classification_claimed_until": now + timedelta(seconds=claim_seconds)}},
+            {"image_file_id": 1, "features": 1}
+        )
+    
+    @metrics.mongo_op
+    def acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        """Take or renew the lease on a background job; False while another holder's lease is live"""
+        from datetime import timedelta
+        from pymongo.errors import DuplicateKeyError
+        now = datetime.utcnow()
+        try:
+            self.db[LEASES_COLLECTION_NAME].update_one(
+                {"_id": name, "$or": [{"holder": holder}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"holder": holder, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # The lease exists and is held by someone else
+            return False
+    
+    @metrics.mongo_op
+    def migration_done(self, name: str) -> bool:
+        """Whether the one-off migration called name has completed on this database"""
+        return self.db[MIGRATIONS_COLLECTION_NAME].find_one({"_id": name}, {"_id": 1}) is not None
+    
+    @metrics.mongo_op
+    def record_migration(self, name: str, result: Dict[str, Any]):
+        """Mark the migration called name as completed, with its result"""
+        self.db[MIGRATIONS_COLLECTION_NAME].update_one(
+            {"_id": name}, {"$set": {"result": result, "completed_at": datetime.utcnow()}}, upsert=True
+        )
+    
+    @metrics.mongo_op
+    def find_pending_classification(self, limit: int = 1000) -> List[str]:
+        """IDs of items still waiting for background AI classification"""
+        cursor = self.collection.find({"classification_pending": True}, {"_id": 1}).limit(limit)
+        return [str(doc["_id"]) for doc in cursor]
+    
+    @metrics.mongo_op
+    def set_ai_category(self, item_id: str, ai_category: str, classified_by: str = None) -> bool:
+        """Store a background classification result and clear the pending flag
+        
+        classified_by="local" records that the result came from local_classifier.
+        """
+        from bson import ObjectId
+        doc = self.collection.find_one({"_id": ObjectId(item_id)}, {"category": 1, **FACET_PROJECTION})
+        if doc is None:
+            return False
+        keys = taxonomy.item_keys(ai_category, doc.get("category"))
+        key = keys["category_key"]
+        update = {
+            "$set": {"ai_category": ai_category, **keys},
+            "$unset": {"classification_pending": "", "classification_claimed_until": ""}
+        }
+        if classified_by:
+            update["$set"]["classified_by"] = classified_by
+        else:
+            update["$unset"]["classified_by"] = ""
+        result = self.collection.update_one({"_id": doc["_id"]}, update)
+        if result.modified_count and doc.get("category_key") != key:
+            facets.record_delete(doc)
+            facets.record_insert({**doc, "category_key": key})
+        if result.modified_count:
+            updated = self.collection.find_one({"_id": doc["_id"]}, {**SEARCH_TEXT_PROJECTION, "classified_by": 1})
+            fuzzy.record_insert(updated)
+            suggest.record_insert(updated)
+            visual_index.record_insert(updated)
+        return result.modified_count > 0
+    
+    @metrics.mongo_op
     def fetch_all_items(self) -> List[tuple]:
         """Fetch all items from the database"""
         try:
-            cursor = self.collection.find().sort("timestamp", -1)
+            cursor = self.collection.find({}, LIST_PROJECTION).sort("timestamp", -1)
             items = []
             
             for doc in cursor:
@@ -187,26 +624,43 @@ class MongoDB:
             
             return items
         except Exception as e:
+            metrics.mongo_error()
             print(f"Error fetching items: {e}")
             return []
     
-    def search_items(self, query: str, status_filter: Optional[str] = None) -> List[tuple]:
-        """Search items by title, description, or category"""
+    @metrics.mongo_op
+    def search_items(self, query: str, status_filter: Optional[str] = None, include_archived: bool = False,
+                     category: Optional[str] = None) -> List[tuple]:
+        """Search items by title, description, or category (optionally across archived items too)
+        
+        category is matched through the canonical taxonomy (an indexed equality
+        lookup on category_keys, including sub-categories, so the AI and the
+        reported category both count).
+        """
         try:
             # Build search filter
-            search_filter = {
-                "$or": [
+            search_filter = {}
+            if query:
+                search_filter["$or"] = [
                     {"title": {"$regex": query, "$options": "i"}},
                     {"description": {"$regex": query, "$options": "i"}},
                     {"category": {"$regex": query, "$options": "i"}}
                 ]
-            }
             
             # Add status filter if provided
             if status_filter and status_filter != "All":
                 search_filter["status"] = status_filter
             
-            cursor = self.collection.find(search_filter).sort("timestamp", -1)
+            if category and category != "All":
+                key = taxonomy.category_key(category) or taxonomy.OTHER
+                search_filter["category_keys"] = {"$in": taxonomy.expand(key)}
+            
+            cursor = self.collection.find(search_filter, LIST_PROJECTION).sort("timestamp", -1)
+            if include_archived:
+                import heapq
+                archived = self.archive_collection.find(search_filter, LIST_PROJECTION).sort("timestamp", -1)
+                # Both cursors are newest-first, so merge them without re-sorting
+                cursor = heapq.merge(cursor, archived, key=self._timestamp_sort_key, reverse=True)
             items = []
             
             for doc in cursor:
@@ -219,26 +673,249 @@ class MongoDB:
                     doc.get("status", ""),
                     doc.get("name", ""),
                     doc.get("contact", ""),
-                    doc.get("image_file_id", ""),  # GridFS file ID
+                    doc.get("image_file_id", ""),  # Image file ID
                     self.format_ist_timestamp(doc.get("timestamp", ""))
                 )
                 items.append(item_tuple)
                 
             return items
         except Exception as e:
+            metrics.mongo_error()
             print(f"Error searching items: {e}")
             return []
     
+    @metrics.mongo_op
+    def query_items(self, category: Optional[str] = None, status: Optional[str] = None, location: Optional[str] = None,
+                    date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                    has_image: Optional[bool] = None, limit: int = 100, skip: int = 0) -> List[tuple]:
+        """Items matching typed filters, newest first, using the planned index for the filter combination"""
+        query, index = item_query.build_query(category, status, location, date_from, date_to, has_image)
+        cursor = self.collection.find(query, LIST_PROJECTION).hint(index).sort("timestamp", -1).skip(skip).limit(limit)
+        items = []
+        for doc in cursor:
+            image_url = doc.get("image_url")
+            if not image_url and doc.get("image_file_id"):
+                image_url = self.generate_image_url(doc.get("image_file_id"))
+            items.append((
+                str(doc["_id"]),
+                doc.get("title", ""),
+                doc.get("description", ""),
+                doc.get("category", ""),
+                doc.get("location", ""),
+                doc.get("status", ""),
+                doc.get("name", ""),
+                doc.get("contact", ""),
+                image_url or "",
+                self.format_ist_timestamp(doc.get("timestamp", ""))
+            ))
+        return items
+    
+    @metrics.mongo_op
+    def fuzzy_search_items(self, query: str, status_filter: Optional[str] = None, category: Optional[str] = None,
+                           limit: int = 50) -> List[tuple]:
+        """Typo-tolerant search ranked by the in-memory fuzzy index (live items only)
+        
+        Falls back to search_items until the index has been built.
+        """
+        if not fuzzy.is_ready():
+            return self.search_items(query, status_filter, category=category)
+        category_keys = None
+        if category and category != "All":
+            category_keys = taxonomy.expand(taxonomy.category_key(category) or taxonomy.OTHER)
+        ranked = fuzzy.search(query, limit, status_filter if status_filter != "All" else None, category_keys)
+        return self._rows_by_ids([item_id for item_id, _ in ranked])
+    
+    def _rows_by_ids(self, item_ids: List[str]) -> List[tuple]:
+        """Item tuples for the given IDs, in that order (items deleted since they were ranked are left out)"""
+        from bson import ObjectId
+        if not item_ids:
+            return []
+        docs = {
+            str(doc["_id"]): doc
+            for doc in self.collection.find({"_id": {"$in": [ObjectId(item_id) for item_id in item_ids]}}, LIST_PROJECTION)
+        }
+        items = []
+        for item_id in item_ids:
+            doc = docs.get(item_id)
+            if doc is None:
+                continue  # Deleted by another worker since the index last synced
+            items.append((
+                item_id,
+                doc.get("title", ""),
+                doc.get("description", ""),
+                doc.get("category", ""),
+                doc.get("location", ""),
+                doc.get("status", ""),
+                doc.get("name", ""),
+                doc.get("contact", ""),
+                doc.get("image_file_id", ""),
+                self.format_ist_timestamp(doc.get("timestamp", ""))
+            ))
+        return items
+    
+    def _newest_item_ids(self, query_filter: Dict[str, Any], hint, limit: int) -> List[str]:
+        cursor = self.collection.find(query_filter, {"_id": 1}).hint(hint).sort("timestamp", -1).limit(limit)
+        return [str(doc["_id"]) for doc in cursor]
+    
+    @metrics.mongo_op
+    def hybrid_search(self, query: Optional[str] = None, features=None, ai_category: Optional[str] = None,
+                      status_filter: Optional[str] = None, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """Rank live items by text, category and visual similarity together (see hybrid.py)
+        
+        features are the query image's extract_features_from_bytes vector and
+        ai_category its classification, if there is an image.
+        """
+        import re
+        status = status_filter if status_filter and status_filter != "All" else None
+        limit = hybrid.HYBRID_CANDIDATES
+        rankings = {}
+        if query:
+            if fuzzy.is_ready():
+                rankings["text"] = [item_id for item_id, _ in fuzzy.search(query, limit, status)]
+            else:
+                # Until the fuzzy index is built: substring matches, newest first
+                pattern = {"$regex": re.escape(query), "$options": "i"}
+                text_filter, hint = item_query.build_query(status=status)
+                text_filter["$or"] = [{"title": pattern}, {"description": pattern}, {"category": pattern}]
+                rankings["text"] = self._newest_item_ids(text_filter, hint, limit)
+        category_key = hybrid.query_category_key(query, ai_category)
+        if category_key:
+            category_filter, hint = item_query.build_query(category=category_key, status=status)
+            rankings["category"] = self._newest_item_ids(category_filter, hint, limit)
+        if features is not None:
+            rankings["visual"] = [item_id for item_id, _ in visual_index.search(features, limit, status)]
+        hybrid.record_candidates(rankings)
+        
+        ranked, total = hybrid.paginate(hybrid.fuse(rankings), page, page_size)
+        rows = {row[0]: row for row in self._rows_by_ids([entry["id"] for entry in ranked])}
+        matches = [entry for entry in ranked if entry["id"] in rows]
+        return {
+            "items": [rows[entry["id"]] for entry in matches],
+            "matches": [{"id": entry["id"], "score": round(entry["score"], 6), "ranks": entry["ranks"]} for entry in matches],
+            "total": total,
+            "category_key": category_key,
+        }
+    
+    def iter_live_items(self, after_id=None, projection: Optional[Dict[str, int]] = None,
+                        batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Stream live items in _id order (only those after after_id, if given)
+
+        projection defaults to the text fields the search indexes are built from.
+        """
+        query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+        cursor = self.collection.find(query, projection or SEARCH_TEXT_PROJECTION).sort("_id", 1).batch_size(batch_size)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+    
+    @staticmethod
+    def _timestamp_sort_key(doc: Dict[str, Any]):
+        timestamp = doc.get("timestamp")
+        if not isinstance(timestamp, datetime):
+            return datetime.min
+        # PyMongo returns naive UTC datetimes
+        return timestamp.replace(tzinfo=None) if timestamp.tzinfo else timestamp
+    
+    @metrics.mongo_op
+    def archive_items(self, archive_filter: Dict[str, Any], batch_size: int = 500, move_images: bool = False) -> Dict[str, int]:
+        """Move one batch of items matching archive_filter from the live collection to the archive
+        
+        Documents are copied before they are deleted, and copies that already
+        exist are ignored, so a batch interrupted half way is simply redone.
+        """
+        docs = list(self.collection.find(archive_filter).limit(batch_size))
+        if not docs:
+            return {"items": 0, "images": 0}
+        
+        self._insert_ignoring_duplicates(self.archive_collection, docs)
+        images = 0
+        if move_images:
+            images = self._archive_images([doc["image_file_id"] for doc in docs if doc.get("image_file_id")])
+        self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        for doc in docs:
+            facets.record_delete(doc)
+            fuzzy.record_delete(str(doc["_id"]))
+            suggest.record_delete(str(doc["_id"]))
+            visual_index.record_delete(str(doc["_id"]))
+        return {"items": len(docs), "images": images}
+    
+    @metrics.mongo_op
+    def count_archivable_items(self, archive_filter: Dict[str, Any]) -> int:
+        """Count live items an archive run would move"""
+        return self.collection.count_documents(archive_filter)
+    
+    def _insert_ignoring_duplicates(self, collection, documents: List[Dict[str, Any]]):
+        """insert_many that tolerates documents already present (replayed batches)"""
+        from pymongo.errors import BulkWriteError
+        
+        if not documents:
+            return
+        try:
+            collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+    
+    def _archive_images(self, file_ids: List[str], chunk_batch_size: int = 64) -> int:
+        """Move images and their derived files from the live GridFS bucket to the archive bucket
+        
+        Other image stores have no archive tier, so their images stay where they are.
+        """
+        from bson import ObjectId
+        
+        if not isinstance(self.images, image_store.GridFSStore):
+            return 0
+        source_ids = [file_id for file_id in file_ids if ObjectId.is_valid(file_id)]
+        if not source_ids:
+            return 0
+        file_docs = list(self.db.fs.files.find({"$or": [
+            {"_id": {"$in": [ObjectId(file_id) for file_id in source_ids]}},
+            {"metadata.derived_from": {"$in": source_ids}}
+        ]}))
+        object_ids = [doc["_id"] for doc in file_docs]
+        if not object_ids:
+            return 0
+        
+        archive_bucket = self.db[ARCHIVE_BUCKET_NAME]
+        # Copy chunks in small batches so large images are never all in memory
+        batch = []
+        for chunk in self.db.fs.chunks.find({"files_id": {"$in": object_ids}}):
+            batch.append(chunk)
+            if len(batch) >= chunk_batch_size:
+                self._insert_ignoring_duplicates(archive_bucket.chunks, batch)
+                batch = []
+        self._insert_ignoring_duplicates(archive_bucket.chunks, batch)
+        # Files last, so a file document is only visible once its chunks are complete
+        self._insert_ignoring_duplicates(archive_bucket.files, file_docs)
+        
+        self._delete_files_bulk(object_ids)
+        return len(object_ids)
+    
+    @metrics.mongo_op
     def delete_item(self, item_id: str) -> bool:
-        """Delete an item by ID"""
+        """Delete an item by ID, along with its image and derived images"""
         try:
             from bson import ObjectId
-            result = self.collection.delete_one({"_id": ObjectId(item_id)})
-            return result.deleted_count > 0
+            doc = self.collection.find_one_and_delete({"_id": ObjectId(item_id)}, {"image_file_id": 1, **FACET_PROJECTION})
+            if doc is not None:
+                facets.record_delete(doc)
+                fuzzy.record_delete(item_id)
+                suggest.record_delete(item_id)
+                visual_index.record_delete(item_id)
+            else:
+                doc = self.archive_collection.find_one_and_delete({"_id": ObjectId(item_id)}, {"image_file_id": 1})
+            if doc is None:
+                return False
+            if doc.get("image_file_id"):
+                self.delete_image(doc["image_file_id"])
+            return True
         except Exception as e:
+            metrics.mongo_error()
             print(f"Error deleting item: {e}")
             return False
     
+    @metrics.mongo_op
     def get_item_by_id(self, item_id: str) -> Optional[Dict[str, Any]]:
         """Get a single item by ID"""
         try:
@@ -249,124 +926,423 @@ class MongoDB:
                 doc["timestamp"] = self.format_ist_timestamp(doc.get("timestamp", ""))
             return doc
         except Exception as e:
+            metrics.mongo_error()
             print(f"Error getting item by ID: {e}")
             return None
     
+    def item_to_dict(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a stored item document to its API dictionary form"""
+        return {
+            "id": str(doc["_id"]),
+            "title": doc.get("title", ""),
+            "description": doc.get("description", ""),
+            "category": doc.get("category", ""),
+            "ai_category": doc.get("ai_category", ""),
+            "location": doc.get("location", ""),
+            "status": doc.get("status", ""),
+            "name": doc.get("name", ""),
+            "contact": doc.get("contact", ""),
+            "image_file_id": doc.get("image_file_id", ""),
+            "image_url": self.generate_image_url(doc.get("image_file_id")),
+            "category_key": doc.get("category_key", ""),
+            "timestamp": self.format_ist_timestamp(doc.get("timestamp", ""))
+        }
+    
+    def iter_items(self, status: Optional[str] = None, date_from: Optional[datetime] = None,
+                   date_to: Optional[datetime] = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Stream item documents, newest first, from a server-side cursor
+        
+        Only batch_size documents are held in memory at a time, so this is safe
+        to use for exports of the whole collection.
+        """
+        query = {}
+        if status and status != "All":
+            query["status"] = status
+        if date_from or date_to:
+            query["timestamp"] = {}
+            if date_from:
+                query["timestamp"]["$gte"] = date_from
+            if date_to:
+                query["timestamp"]["$lt"] = date_to
+        
+        cursor = self.collection.find(query, EXPORT_PROJECTION).sort("timestamp", -1).batch_size(batch_size)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+    
+    @metrics.mongo_op
     def fetch_all_items_with_urls(self) -> List[Dict]:
         """Fetch all items with image URLs instead of tuples"""
         try:
-            cursor = self.collection.find().sort("timestamp", -1)
+            cursor = self.collection.find({}, LIST_PROJECTION).sort("timestamp", -1)
             items = []
             
             for doc in cursor:
-                item_dict = {
-                    "id": str(doc["_id"]),
-                    "title": doc.get("title", ""),
-                    "description": doc.get("description", ""),
-                    "category": doc.get("category", ""),
-                    "ai_category": doc.get("ai_category", ""),
-                    "location": doc.get("location", ""),
-                    "status": doc.get("status", ""),
-                    "name": doc.get("name", ""),
-                    "contact": doc.get("contact", ""),
-                    "image_file_id": doc.get("image_file_id", ""),
-                    "image_url": self.generate_image_url(doc.get("image_file_id")),
-                    "timestamp": self.format_ist_timestamp(doc.get("timestamp", ""))
-                }
-                items.append(item_dict)
+                items.append(self.item_to_dict(doc))
             
             return items
         except Exception as e:
+            metrics.mongo_error()
             print(f"Error fetching items: {e}")
             return []
     
+    @metrics.mongo_op
+    def classify_image_url(self, image_url: str) -> str:
+        """Classify the image at image_url, without any network request for our own image URLs
+        
+        For /images/{file_id} URLs served by this API the category already stored
+        on the owning item is reused, or the bytes are read from the image store and
+        classified; only external URLs are downloaded.
+        """
+        from gemini_api import classify_image_from_bytes, classify_image_from_url
+        
+        file_id = image_fetch.local_file_id(image_url, self.base_url)
+        if file_id is None:
+            return classify_image_from_url(image_url)
+        
+        known = {"image_file_id": file_id, "ai_category": {"$nin": [None, "", "Uncategorized"]}}
+        for collection in (self.collection, self.archive_collection):
+            doc = collection.find_one(known, {"ai_category": 1})
+            if doc:
+                return doc["ai_category"]
+        image_data = self.get_image(file_id)
+        return classify_image_from_bytes(image_data) if image_data else "Uncategorized"
+    
+    @metrics.mongo_op
     def search_by_image_url(self, image_url: str) -> List[Dict]:
         """Search for similar items using image URL and AI classification"""
+        from gemini_api import ClassificationBusy
         try:
-            from gemini_api import classify_image_from_url
-            
             # Classify the search image
-            search_category = classify_image_from_url(image_url)
+            search_category = self.classify_image_url(image_url)
             print(f"Search image classified as: {search_category}")
             
-            # Search for items with similar AI categories
-            search_filter = {
-                "$or": [
-                    {"ai_category": {"$regex": search_category, "$options": "i"}},
-                    {"category": {"$regex": search_category, "$options": "i"}},
-                    {"title": {"$regex": search_category, "$options": "i"}},
-                    {"description": {"$regex": search_category, "$options": "i"}}
-                ]
-            }
+            key = taxonomy.category_key(search_category)
+            if key and key != taxonomy.OTHER:
+                # Items in the same canonical category (index equality lookup)
+                search_filter = {"category_keys": {"$in": taxonomy.expand(key)}}
+            else:
+                # Answers outside the taxonomy can only be matched as text
+                import re
+                pattern = re.escape(search_category)
+                search_filter = {
+                    "$or": [
+                        {"ai_category": {"$regex": pattern, "$options": "i"}},
+                        {"category": {"$regex": pattern, "$options": "i"}},
+                        {"title": {"$regex": pattern, "$options": "i"}},
+                        {"description": {"$regex": pattern, "$options": "i"}}
+                    ]
+                }
             
-            cursor = self.collection.find(search_filter).sort("timestamp", -1)
+            cursor = self.collection.find(search_filter, LIST_PROJECTION).sort("timestamp", -1)
             items = []
             
             for doc in cursor:
-                item_dict = {
-                    "id": str(doc["_id"]),
-                    "title": doc.get("title", ""),
-                    "description": doc.get("description", ""),
-                    "category": doc.get("category", ""),
-                    "ai_category": doc.get("ai_category", ""),
-                    "location": doc.get("location", ""),
-                    "status": doc.get("status", ""),
-                    "name": doc.get("name", ""),
-                    "contact": doc.get("contact", ""),
-                    "image_file_id": doc.get("image_file_id", ""),
-                    "image_url": self.generate_image_url(doc.get("image_file_id")),
-                    "timestamp": self.format_ist_timestamp(doc.get("timestamp", ""))
-                }
-                items.append(item_dict)
+                items.append(self.item_to_dict(doc))
             
             return items
+        except ClassificationBusy:
+            raise
         except Exception as e:
             print(f"Error in image search: {e}")
+            metrics.mongo_error()
             return []
 
+    @metrics.mongo_op
+    def backfill_item_keys(self, recompute: bool = False, batch_size: int = 1000) -> Dict[str, int]:
+        """Set the derived category keys and location_key on stored items (live and archived)
+        
+        By default only items missing a key are touched; recompute=True
+        re-derives every key, e.g. after the synonym table changed.
+        """
+        from pymongo import UpdateOne
+        
+        derived = ("category_key", "user_category_key", "category_keys", "location_key")
+        query = {} if recompute else {"$or": [{field: {"$exists": False}} for field in derived]}
+        projection = {"ai_category": 1, "category": 1, "location": 1, **{field: 1 for field in derived}}
+        counts = {"scanned": 0, "updated": 0}
+        for collection in (self.collection, self.archive_collection):
+            cursor = collection.find(query, projection).batch_size(batch_size)
+            operations = []
+            for doc in cursor:
+                counts["scanned"] += 1
+                keys = {
+                    **taxonomy.item_keys(doc.get("ai_category"), doc.get("category")),
+                    "location_key": item_query.location_key(doc.get("location"))
+                }
+                if any(doc.get(field) != value for field, value in keys.items()):
+                    operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": keys}))
+                if len(operations) >= batch_size:
+                    counts["updated"] += collection.bulk_write(operations, ordered=False).modified_count
+                    operations = []
+            if operations:
+                counts["updated"] += collection.bulk_write(operations, ordered=False).modified_count
+        if counts["updated"]:
+            facets.invalidate()
+        print(f"🏷️ Item keys: scanned {counts['scanned']}, updated {counts['updated']}")
+        return counts
+    
+    @metrics.mongo_op
+    def compute_facets(self) -> Dict[str, Dict[str, int]]:
+        """Count live items per status, category key, location and IST month in one aggregation
+        
+        The leading projection only needs FACET_INDEX's fields, so the scan is
+        covered by that index; the four groupings then run over the index keys.
+        """
+        def count_by(expression):
+            return [{"$group": {"_id": expression, "count": {"$sum": 1}}}]
+        
+        pipeline = [
+            {"$project": {"_id": 0, **FACET_PROJECTION}},
+            {"$facet": {
+                "status": count_by("$status"),
+                "category": count_by("$category_key"),
+                "location": count_by("$location_key"),
+                "month": count_by({"$dateToString": {"format": "%Y-%m", "date": "$timestamp", "timezone": "Asia/Kolkata"}}),
+            }}
+        ]
+        result = next(self.collection.aggregate(pipeline, hint=FACET_INDEX), {})
+        counts = {}
+        for field, groups in result.items():
+            counts[field] = {}
+            for group in groups:
+                # Missing and empty values share one bucket, as in facets.facet_values
+                key = group["_id"] or facets.UNKNOWN
+                counts[field][key] = counts[field].get(key, 0) + group["count"]
+        return counts
+    
+    @metrics.mongo_op
     def list_all_images(self) -> List[Dict]:
-        """List all images stored in GridFS with metadata"""
+        """List all images in the image store with metadata"""
         try:
-            files = []
-            for grid_file in self.fs.find():
-                files.append({
-                    'file_id': str(grid_file._id),
-                    'filename': grid_file.filename,
-                    'upload_date': grid_file.upload_date,
-                    'length': grid_file.length,
-                    'content_type': getattr(grid_file, 'contentType', 'image/jpeg')
-                })
-            return files
+            return list(self.images.iter_files())
         except Exception as e:
+            metrics.mongo_error()
             print(f"Error listing images: {e}")
             return []
+    
+    def iter_orphan_images(self, min_age_minutes: int = 60, batch_size: int = 500, bucket: str = "fs") -> Iterator[Dict[str, Any]]:
+        """Stream GridFS files that no item references (anti-join of fs.files against items)
+        
+        Derived files count as referenced when their source image is. Files newer
+        than min_age_minutes are skipped so uploads whose item document has not
+        been written yet are never treated as orphans.
+        """
+        from datetime import timedelta
+        cutoff = datetime.utcnow() - timedelta(minutes=min_age_minutes)
+        pipeline = [
+            {"$match": {"uploadDate": {"$lt": cutoff}}},
+            {"$addFields": {"owner_id": {"$ifNull": ["$metadata.derived_from", {"$toString": "$_id"}]}}},
+            {"$lookup": {
+                "from": COLLECTION_NAME,
+                "localField": "owner_id",
+                "foreignField": "image_file_id",
+                "as": "owners"
+            }},
+            {"$match": {"owners": {"$size": 0}}},
+            # Items in the cold tier still own their images
+            {"$lookup": {
+                "from": ARCHIVE_COLLECTION_NAME,
+                "localField": "owner_id",
+                "foreignField": "image_file_id",
+                "as": "archived_owners"
+            }},
+            {"$match": {"archived_owners": {"$size": 0}}},
+            {"$project": {"owners": 0, "archived_owners": 0, "owner_id": 0}}
+        ]
+        cursor = self.db[bucket].files.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+        for file_doc in cursor:
+            yield {**image_store.gridfs_summary(file_doc), 'bucket': bucket}
+    
+    def _iter_unowned(self, images: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """The images in a batch whose owning image no live or archived item references"""
+        owner_ids = list({image["derived_from"] or image["file_id"] for image in images})
+        owned = set()
+        for collection in (self.collection, self.archive_collection):
+            owned.update(doc["image_file_id"] for doc in collection.find(
+                {"image_file_id": {"$in": owner_ids}}, {"_id": 0, "image_file_id": 1}
+            ))
+        for image in images:
+            if (image["derived_from"] or image["file_id"]) not in owned:
+                yield image
+    
+    def iter_orphan_store_images(self, min_age_minutes: int = 60, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream images no item references from a store that isn't GridFS
+        
+        Walks the store's listing and looks owners up batch by batch, since the
+        files can't be joined against items inside MongoDB.
+        """
+        from datetime import timedelta
+        cutoff = datetime.utcnow() - timedelta(minutes=min_age_minutes)
+        batch = []
+        for image in self.images.iter_files():
+            if image["upload_date"] is None or image["upload_date"].replace(tzinfo=None) >= cutoff:
+                continue
+            batch.append(image)
+            if len(batch) >= batch_size:
+                yield from self._iter_unowned(batch)
+                batch = []
+        if batch:
+            yield from self._iter_unowned(batch)
+    
+    @metrics.mongo_op
+    def sweep_orphan_images(self, dry_run: bool = True, batch_size: int = 500, pause_seconds: float = 0.5,
+                            min_age_minutes: int = 60, sample_size: int = 50) -> Dict[str, Any]:
+        """Find and (unless dry_run) delete unreferenced image files in rate-limited batches"""
+        import time
+        from bson import ObjectId
+        
+        report = {"dry_run": dry_run, "orphans_found": 0, "bytes": 0, "files_deleted": 0, "sample": []}
+        batch = []
+        
+        def flush(bucket):
+            if not dry_run and batch:
+                if bucket is None:
+                    # Deleting the owning image takes its derived files with it
+                    owner_ids = list({image["derived_from"] or image["file_id"] for image in batch})
+                    self._invalidate_cached_images(owner_ids)
+                    report["files_deleted"] += self.images.delete(owner_ids)
+                else:
+                    report["files_deleted"] += self._delete_files_bulk([ObjectId(image["file_id"]) for image in batch], bucket)
+                # Give regular traffic room between bulk deletes
+                time.sleep(pause_seconds)
+            batch.clear()
+        
+        if isinstance(self.images, image_store.GridFSStore):
+            sources = [(bucket, self.iter_orphan_images(min_age_minutes, batch_size, bucket))
+                       for bucket in ("fs", ARCHIVE_BUCKET_NAME)]
+        else:
+            sources = [(None, self.iter_orphan_store_images(min_age_minutes, batch_size))]
+        for bucket, orphans in sources:
+            for image in orphans:
+                report["orphans_found"] += 1
+                report["bytes"] += image["length"]
+                if len(report["sample"]) < sample_size:
+                    report["sample"].append(image)
+                batch.append(image)
+                if len(batch) >= batch_size:
+                    flush(bucket)
+            flush(bucket)
+        
+        print(f"🧹 Orphaned image sweep ({'dry run' if dry_run else 'delete'}): "
+              f"{report['orphans_found']} files, {report['bytes']} bytes, {report['files_deleted']} deleted")
+        return report
+
+metrics.register_cache("thumbnail")
 
 # Global MongoDB instance
 mongodb_instance = None
+_instance_lock = threading.Lock()
+_connect_callbacks = []
+_stop_reconnect = threading.Event()
 
 def get_mongodb():
     """Get MongoDB instance (singleton pattern)"""
     global mongodb_instance
     if mongodb_instance is None:
-        mongodb_instance = MongoDB()
+        created = False
+        with _instance_lock:
+            if mongodb_instance is None:
+                mongodb_instance = MongoDB()
+                created = True
+        if created and mongodb_instance.client is not None:
+            _run_connect_callbacks(mongodb_instance)
     return mongodb_instance
 
+def on_connect(callback):
+    """Register a function called with the MongoDB instance once the connection is established
+    
+    Used for work that needs the database at startup (re-queuing jobs, building
+    in-memory indexes) without blocking startup on the connection.
+    """
+    _connect_callbacks.append(callback)
+    return callback
+
+def _run_connect_callbacks(instance):
+    for callback in _connect_callbacks:
+        try:
+            callback(instance)
+        except Exception as e:
+            print(f"Error in MongoDB connect callback {getattr(callback, '__name__', callback)}: {e}")
+
+def _reconnect_loop(instance, max_backoff: float):
+    """Retry the initial connection with exponential backoff until it succeeds"""
+    backoff = 1.0
+    while instance.client is None and not instance.connect():
+        print(f"🔄 Retrying MongoDB connection in {backoff:.0f}s")
+        if _stop_reconnect.wait(backoff):
+            return
+        backoff = min(backoff * 2, max_backoff)
+    _run_connect_callbacks(instance)
+
 # Wrapper functions to maintain compatibility with existing code
-def init_db():
-    """Initialize MongoDB connection"""
-    get_mongodb()
+def init_db(background: bool = False, max_backoff: float = 30.0):
+    """Initialize MongoDB connection
+    
+    With background=True this returns immediately; the connection (and retries
+    while the database is unreachable) happen on a daemon thread and requests
+    see client=None until it succeeds.
+    """
+    global mongodb_instance
+    if not background:
+        get_mongodb()
+        return
+    with _instance_lock:
+        if mongodb_instance is None:
+            mongodb_instance = MongoDB(connect=False)
+    # Started even when already connected so the on_connect callbacks still run off the caller's thread
+    _stop_reconnect.clear()
+    threading.Thread(
+        target=_reconnect_loop, args=(mongodb_instance, max_backoff), name="mongo-connect", daemon=True
+    ).start()
 
-def insert_item(item, image_data=None, image_filename=None):
-    """Insert item using MongoDB with GridFS image storage"""
-    return get_mongodb().insert_item(item, image_data, image_filename)
+def reset_after_fork():
+    """Drop the connection inherited from a parent process
+    
+    MongoClient is not fork-safe: a process forked after the client was created
+    must build its own. The next get_mongodb()/init_db() call reconnects.
+    """
+    global mongodb_instance, _instance_lock
+    mongodb_instance = None
+    _instance_lock = threading.Lock()
+    _stop_reconnect.clear()
+
+def stop_reconnect():
+    """Stop a pending background reconnect loop (used on shutdown)"""
+    _stop_reconnect.set()
+
+def insert_item(item, image_data=None, image_filename=None, image_file_id=None, ai_category=None, features=None,
+                classification_pending=False, classified_by=None):
+    """Insert item using MongoDB with image storage"""
+    return get_mongodb().insert_item(
+        item, image_data, image_filename, image_file_id, ai_category, features, classification_pending, classified_by
+    )
+
+def insert_items_bulk(documents):
+    """Insert many item documents using MongoDB"""
+    return get_mongodb().insert_items_bulk(documents)
 
 def fetch_all_items():
     """Fetch all items using MongoDB"""
     return get_mongodb().fetch_all_items()
 
-def search_items(query, status_filter=None):
+def search_items(query, status_filter=None, include_archived=False, category=None):
     """Search items using MongoDB"""
-    return get_mongodb().search_items(query, status_filter)
+    return get_mongodb().search_items(query, status_filter, include_archived, category)
+
+def fuzzy_search_items(query, status_filter=None, category=None, limit=50):
+    """Typo-tolerant search using the fuzzy index"""
+    return get_mongodb().fuzzy_search_items(query, status_filter, category, limit)
+
+def hybrid_search(query=None, features=None, ai_category=None, status_filter=None, page=1, page_size=20):
+    """Rank items by text, category and visual similarity together"""
+    return get_mongodb().hybrid_search(query, features, ai_category, status_filter, page, page_size)
+
+def query_items(category=None, status=None, location=None, date_from=None, date_to=None, has_image=None,
+                limit=100, skip=0):
+    """Filter items with the structured query planner"""
+    return get_mongodb().query_items(category, status, location, date_from, date_to, has_image, limit, skip)
 
 def delete_item(item_id):
     """Delete item using MongoDB"""
@@ -377,21 +1353,49 @@ def get_item_by_id(item_id):
     return get_mongodb().get_item_by_id(item_id)
 
 def get_image(file_id):
-    """Get image from GridFS"""
+    """Get image from the image store"""
     return get_mongodb().get_image(file_id)
 
+def get_thumbnails(file_ids, size=120):
+    """Get thumbnails for many images"""
+    return get_mongodb().get_thumbnails(file_ids, size)
+
 def store_image(image_data, filename):
-    """Store image in GridFS"""
+    """Store image in the image store"""
     return get_mongodb().store_image(image_data, filename)
 
+def iter_items(status=None, date_from=None, date_to=None, batch_size=1000):
+    """Stream items from a MongoDB cursor"""
+    return get_mongodb().iter_items(status, date_from, date_to, batch_size)
+
 def fetch_all_items_with_urls():
     """Fetch all items with URLs using MongoDB"""
     return get_mongodb().fetch_all_items_with_urls()
 
+def classify_image_url(image_url):
+    """Classify an image URL, reading our own images straight from the image store"""
+    return get_mongodb().classify_image_url(image_url)
+
 def search_by_image_url(image_url):
     """Search items by image URL using MongoDB"""
     return get_mongodb().search_by_image_url(image_url)
 
+def delete_image(file_id):
+    """Delete image and its derivatives from the image store"""
+    return get_mongodb().delete_image(file_id)
+
 def list_all_images():
     """List all images using MongoDB"""
     return get_mongodb().list_all_images()
+
+def sweep_orphan_images(dry_run=True, batch_size=500, pause_seconds=0.5, min_age_minutes=60):
+    """Find or delete unreferenced image files"""
+    return get_mongodb().sweep_orphan_images(dry_run, batch_size, pause_seconds, min_age_minutes)
+
+def backfill_item_keys(recompute=False, batch_size=1000):
+    """Set category and location keys on stored items"""
+    return get_mongodb().backfill_item_keys(recompute, batch_size)
+
+def compute_facets():
+    """Wrapper function for compute_facets"""
+    return get_mongodb().compute_facets()
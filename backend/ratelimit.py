@@ -0,0 +1,156 @@
+"""Per-client rate limiting for expensive routes
+
+Each (client IP, route) pair gets a token bucket: RATE_LIMITS sets how many
+requests a client may burst and the window over which that allowance refills,
+e.g. "/report/=10/60" allows 10 reports per minute with a burst of 10.
+Requests over the limit get an immediate 429 with Retry-After, before the
+body is read or any work is queued.
+
+Buckets live in process memory by default. With RATE_LIMIT_BACKEND=mongo they
+are shared by all workers through the rate_limits collection (one atomic
+update per request); if MongoDB is unavailable the limiter falls back to the
+local buckets rather than failing requests.
+
+The global cap on concurrent Gemini calls lives in gemini_api.
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
+
+import metrics
+import mongodb as db
+
+DEFAULT_RATE_LIMITS = "/report/=10/60,/api/classify-image=30/60,/api/search-by-image-url=30/60,/search/visual/=30/60,/search/hybrid=30/60"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Use the first X-Forwarded-For address (only behind a proxy that sets it, e.g. Railway)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+MAX_BUCKETS = 100_000
+
+RATE_LIMITED = metrics.Counter("rate_limited_total", "Requests rejected by the rate limiter", ["route"])
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse "path=requests/seconds,..." into {path: (capacity, tokens per second)}"""
+    limits = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        path, rule = part.strip().rsplit("=", 1)
+        requests, seconds = rule.split("/")
+        limits[path] = (float(requests), float(requests) / float(seconds))
+    return limits
+
+RATE_LIMITS = parse_limits(os.getenv("RATE_LIMITS", DEFAULT_RATE_LIMITS))
+
+class MemoryBuckets:
+    """Token buckets in this process"""
+
+    def __init__(self):
+        # key -> (tokens, last refill time)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        """Take a token; returns 0 when allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if len(self._buckets) > MAX_BUCKETS:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now: float):
+        """Drop buckets idle long enough to have refilled (they would start full anyway)"""
+        idle_after = max(capacity / rate for capacity, rate in RATE_LIMITS.values()) if RATE_LIMITS else 0
+        self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < idle_after}
+
+class MongoBuckets:
+    """Token buckets shared by all workers, updated atomically in MongoDB"""
+
+    def take(self, key: str, capacity: float, rate: float) -> Optional[float]:
+        """Like MemoryBuckets.take; returns None when MongoDB is not reachable"""
+        mongo_db = db.get_mongodb()
+        if mongo_db.client is None:
+            return None
+        now = datetime.now(timezone.utc)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, rate]}]}]}
+        try:
+            doc = mongo_db.db[db.RATE_LIMITS_COLLECTION_NAME].find_one_and_update(
+                {"_id": key},
+                [
+                    {"$set": {"tokens": refilled, "updated_at": now,
+                              "expires_at": now + timedelta(seconds=capacity / rate)}},
+                    {"$set": {"allowed": {"$gte": ["$tokens", 1]},
+                              "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            print(f"Rate limit store unavailable, using local buckets: {e}")
+            return None
+        return 0.0 if doc["allowed"] else (1 - doc["tokens"]) / rate
+
+_memory = MemoryBuckets()
+_mongo = MongoBuckets() if RATE_LIMIT_BACKEND == "mongo" else None
+
+async def check(client: str, route: str) -> float:
+    """Seconds the client must wait before calling route again (0 when allowed)"""
+    limit = RATE_LIMITS.get(route)
+    if limit is None:
+        return 0.0
+    capacity, rate = limit
+    key = f"{route}|{client}"
+    if _mongo is not None:
+        wait = await run_in_threadpool(_mongo.take, key, capacity, rate)
+        if wait is not None:
+            return wait
+    return _memory.take(key, capacity, rate)
+
+def client_address(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 with Retry-After for clients over their route's limit"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in RATE_LIMITS or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        wait = await check(client_address(scope), scope["path"])
+        if wait <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        RATE_LIMITED.inc(route=scope["path"])
+        retry_after = str(max(1, math.ceil(wait)))
+        body = b'{"detail":"Too many requests, please slow down"}'
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", retry_after.encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,184 @@
+"""Search-box suggestions
+
+GET /suggest?prefix= completes what the user is typing from the titles,
+canonical categories and locations of the live items. Each distinct phrase
+is a suggestion, scored by how often it occurs with recent items counting
+more: an item adds 2 ** (age / SUGGEST_HALF_LIFE_DAYS) relative to when the
+index was built, so a report from one half-life ago weighs half as much as
+one made today, and scores never need re-decaying as time passes.
+
+Phrases are found through a sorted array of keys, one per word a phrase
+contains ("black leather wallet", "leather wallet", "wallet"), so "wal" also
+completes "Black leather wallet". A prefix is a bisect range in that array;
+the phrases in the range are scored with NumPy. New keys go to a small
+unsorted buffer that is merged into the array once it grows.
+
+The index is built in the background once MongoDB is connected and kept
+current by live_index (SUGGEST_SYNC_SECONDS, SUGGEST_REBUILD_MINUTES).
+"""
+import bisect
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import live_index
+import metrics
+
+SUGGEST_HALF_LIFE_DAYS = float(os.getenv("SUGGEST_HALF_LIFE_DAYS", "30"))
+SUGGEST_SYNC_SECONDS = float(os.getenv("SUGGEST_SYNC_SECONDS", "30"))
+SUGGEST_REBUILD_MINUTES = float(os.getenv("SUGGEST_REBUILD_MINUTES", "60"))
+MAX_PHRASE_WORDS = 8  # Keys per phrase (later words of long titles aren't completed)
+BUFFER_SIZE = 512
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+SUGGEST_SECONDS = metrics.Histogram("suggest_duration_seconds", "Time to rank suggestions in memory")
+metrics.Gauge("suggest_index_phrases", "Phrases in the suggestion index", callback=lambda: len(_live.index.texts))
+
+def normalize(text: Optional[str]) -> str:
+    return " ".join(_NON_WORD.sub(" ", (text or "").lower()).split())
+
+def _phrases(doc: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    """(kind, key, display text) of each phrase an item contributes"""
+    phrases = []
+    for kind, text in (("title", doc.get("title")), ("category", doc.get("category_key")),
+                       ("location", doc.get("location"))):
+        key = normalize(text)
+        if key and key != "other":
+            phrases.append((kind, key, " ".join((text or "").split()) if kind != "category" else key))
+    return phrases
+
+class SuggestIndex:
+    """Phrase scores plus a sorted array of word-start keys pointing at them"""
+
+    def __init__(self):
+        self.epoch = time.time()
+        self.phrase_ids: Dict[Tuple[str, str], int] = {}  # (kind, key) -> phrase id
+        self.kinds: List[str] = []
+        self.texts: List[str] = []  # Display text, as first reported
+        self.counts: List[int] = []
+        self.scores = np.zeros(1024, dtype=np.float64)
+        self.keys: List[str] = []  # Sorted
+        self.key_phrases = np.zeros(0, dtype=np.int64)  # Phrase id of each key
+        self._buffer: List[Tuple[str, int]] = []  # (key, phrase id) not merged yet
+        self._loading = True  # While a rebuild reads the collection, keys are sorted once at the end
+        self.items: Dict[str, Tuple[float, Tuple[int, ...]]] = {}  # item ID -> (weight, phrase ids)
+        self.lock = threading.Lock()
+
+    def _weight(self, timestamp) -> float:
+        if not isinstance(timestamp, datetime):
+            return 1.0
+        if timestamp.tzinfo is None:
+            # Read back from MongoDB: naive UTC
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        age_days = (timestamp.timestamp() - self.epoch) / 86400
+        return 2.0 ** (max(age_days, -20 * SUGGEST_HALF_LIFE_DAYS) / SUGGEST_HALF_LIFE_DAYS)
+
+    def _phrase_id(self, kind: str, key: str, text: str) -> int:
+        phrase_id = self.phrase_ids.get((kind, key))
+        if phrase_id is not None:
+            return phrase_id
+        phrase_id = self.phrase_ids[(kind, key)] = len(self.texts)
+        self.kinds.append(kind)
+        self.texts.append(text)
+        self.counts.append(0)
+        if phrase_id >= len(self.scores):
+            self.scores = np.concatenate([self.scores, np.zeros(len(self.scores), dtype=np.float64)])
+        words = key.split()
+        for start in range(min(len(words), MAX_PHRASE_WORDS)):
+            self._buffer.append((" ".join(words[start:]), phrase_id))
+        if len(self._buffer) >= BUFFER_SIZE and not self._loading:
+            self._merge()
+        return phrase_id
+
+    def _merge(self):
+        """Fold the buffer into the sorted key array"""
+        if not self._buffer:
+            return
+        merged = list(zip(self.keys, self.key_phrases.tolist()))
+        merged.extend(self._buffer)
+        merged.sort()  # Two sorted runs: Timsort merges them in linear time
+        self.keys = [key for key, _ in merged]
+        self.key_phrases = np.fromiter((phrase_id for _, phrase_id in merged), dtype=np.int64, count=len(merged))
+        self._buffer = []
+
+    def add(self, doc: Dict[str, Any]):
+        item_id = str(doc["_id"])
+        weight = self._weight(doc.get("timestamp"))
+        with self.lock:
+            self._remove(item_id)
+            phrase_ids = tuple(self._phrase_id(kind, key, text) for kind, key, text in _phrases(doc))
+            for phrase_id in phrase_ids:
+                self.scores[phrase_id] += weight
+                self.counts[phrase_id] += 1
+            self.items[item_id] = (weight, phrase_ids)
+
+    def remove(self, item_id: str):
+        with self.lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id: str):
+        entry = self.items.pop(item_id, None)
+        if entry is None:
+            return
+        weight, phrase_ids = entry
+        for phrase_id in phrase_ids:
+            # Phrases that drop to zero stay in the arrays but are never suggested
+            self.counts[phrase_id] -= 1
+            self.scores[phrase_id] = max(0.0, self.scores[phrase_id] - weight) if self.counts[phrase_id] else 0.0
+
+    def loaded(self):
+        with self.lock:
+            self._loading = False
+            self._merge()
+
+    def describe(self) -> str:
+        return f"{len(self.texts)} phrases, {len(self.keys) + len(self._buffer)} keys"
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[Dict[str, Any]]:
+        """Best phrases with a word starting with prefix (multi-word prefixes match word sequences)"""
+        prefix = normalize(prefix) + (" " if prefix[-1:].isspace() and prefix.strip() else "")
+        if not prefix.strip():
+            return []
+        with self.lock:
+            low = bisect.bisect_left(self.keys, prefix)
+            high = bisect.bisect_left(self.keys, prefix + "\uffff", low)
+            candidates = self.key_phrases[low:high]
+            buffered = [phrase_id for key, phrase_id in self._buffer if key.startswith(prefix)]
+            if buffered:
+                candidates = np.concatenate([candidates, np.array(buffered, dtype=np.int64)])
+            if not len(candidates):
+                return []
+            scores = self.scores[candidates]
+            # A phrase can match through several of its words; take a few extra before de-duplicating
+            take = min(len(candidates), limit * 4)
+            top = np.argpartition(-scores, take - 1)[:take] if take < len(candidates) else np.arange(len(candidates))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            results, seen = [], set()
+            for position in top:
+                phrase_id = int(candidates[position])
+                if phrase_id in seen or not self.counts[phrase_id]:
+                    continue
+                seen.add(phrase_id)
+                results.append({"text": self.texts[phrase_id], "type": self.kinds[phrase_id],
+                                "count": self.counts[phrase_id]})
+                if len(results) >= limit:
+                    break
+        return results
+
+_live = live_index.LiveIndex("Suggest", SuggestIndex, SUGGEST_SYNC_SECONDS, SUGGEST_REBUILD_MINUTES)
+
+is_ready = _live.is_ready
+record_insert = _live.record_insert
+record_delete = _live.record_delete
+start = _live.start
+
+def suggest(prefix: str, limit: int = 8) -> List[Dict[str, Any]]:
+    """Top suggestions for what the user has typed so far (empty until the index has been built)"""
+    with SUGGEST_SECONDS.time():
+        return _live.index.suggest(prefix, limit)
@@ -0,0 +1,183 @@
+"""Canonical item categories
+
+Gemini answers in free text ("Phone", "smartphone", "Mobile.") and reporters
+pick broad form categories ("Electronics", "Documents & Cards"). Both are
+mapped onto one controlled vocabulary through a synonym table. Each item
+stores `category_key` (the AI classification when it is recognised, else the
+reported category; used for facets and display), `user_category_key` (the
+reporter's choice) and `category_keys`, both of them as an indexed array, so
+a category filter matches either one with an index equality lookup instead of
+a regex scan over several fields.
+
+Keys form a shallow hierarchy: filtering by a parent key (e.g. "electronics")
+also matches its children ("phone", "laptop", ...), see expand().
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+OTHER = "other"
+
+# Canonical key -> parent key (None for top-level keys)
+CATEGORY_PARENTS: Dict[str, Optional[str]] = {
+    "electronics": None,
+    "phone": "electronics",
+    "laptop": "electronics",
+    "tablet": "electronics",
+    "headphones": "electronics",
+    "charger": "electronics",
+    "calculator": "electronics",
+    "personal_items": None,
+    "wallet": "personal_items",
+    "keys": "personal_items",
+    "bag": "personal_items",
+    "book": None,
+    "stationery": "book",
+    "clothing": None,
+    "jewelry": None,
+    "watch": "jewelry",
+    "glasses": "personal_items",
+    "documents": None,
+    "id_card": "documents",
+    "bottle": "personal_items",
+    "umbrella": "personal_items",
+    "sports": None,
+    OTHER: None,
+}
+
+# Canonical key -> name shown to people (e.g. as a locally classified ai_category)
+CATEGORY_LABELS: Dict[str, str] = {
+    "electronics": "Electronics",
+    "phone": "Phone",
+    "laptop": "Laptop",
+    "tablet": "Tablet",
+    "headphones": "Headphones",
+    "charger": "Charger",
+    "calculator": "Calculator",
+    "personal_items": "Personal Items",
+    "wallet": "Wallet",
+    "keys": "Keys",
+    "bag": "Bag",
+    "book": "Book",
+    "stationery": "Stationery",
+    "clothing": "Clothing",
+    "jewelry": "Jewelry",
+    "watch": "Watch",
+    "glasses": "Glasses",
+    "documents": "Documents",
+    "id_card": "ID Card",
+    "bottle": "Bottle",
+    "umbrella": "Umbrella",
+    "sports": "Sports",
+    OTHER: "Other",
+}
+
+# Normalised term -> canonical key. Terms are matched after lower-casing,
+# dropping punctuation and a trailing plural "s".
+SYNONYMS: Dict[str, str] = {
+    # electronics
+    "electronic": "electronics", "electronics": "electronics", "gadget": "electronics", "device": "electronics",
+    "camera": "electronics", "speaker": "electronics", "mouse": "electronics", "usb": "electronics",
+    "pendrive": "electronics", "pen drive": "electronics", "flash drive": "electronics", "power bank": "electronics",
+    "phone": "phone", "smartphone": "phone", "mobile": "phone", "mobile phone": "phone", "cellphone": "phone",
+    "cell phone": "phone", "iphone": "phone", "android": "phone",
+    "laptop": "laptop", "notebook computer": "laptop", "macbook": "laptop", "computer": "laptop",
+    "tablet": "tablet", "ipad": "tablet",
+    "headphone": "headphones", "headphones": "headphones", "earphone": "headphones", "earbud": "headphones",
+    "airpod": "headphones", "headset": "headphones",
+    "charger": "charger", "cable": "charger", "adapter": "charger", "charging cable": "charger",
+    "calculator": "calculator",
+    # personal items
+    "personal item": "personal_items", "personal items": "personal_items", "personal belonging": "personal_items",
+    "belonging": "personal_items", "wallet": "wallet", "purse": "wallet", "billfold": "wallet", "card holder": "wallet",
+    "key": "keys", "keys": "keys", "keychain": "keys", "key chain": "keys", "keyring": "keys", "key ring": "keys",
+    "bag": "bag", "backpack": "bag", "handbag": "bag", "rucksack": "bag", "tote": "bag", "satchel": "bag",
+    "luggage": "bag", "pouch": "bag",
+    "book": "book", "textbook": "book", "novel": "book", "books stationery": "book", "books and stationery": "book",
+    "stationery": "stationery", "notebook": "stationery", "pen": "stationery", "pencil": "stationery",
+    "pencil case": "stationery", "diary": "stationery", "file": "stationery", "folder": "stationery",
+    "clothing": "clothing", "clothes": "clothing", "clothing accessories": "clothing",
+    "clothing and accessories": "clothing", "jacket": "clothing", "coat": "clothing", "hoodie": "clothing",
+    "sweater": "clothing", "shirt": "clothing", "cap": "clothing", "hat": "clothing", "scarf": "clothing",
+    "shoe": "clothing", "glove": "clothing", "apparel": "clothing",
+    "jewelry": "jewelry", "jewellery": "jewelry", "ring": "jewelry", "necklace": "jewelry", "bracelet": "jewelry",
+    "earring": "jewelry", "chain": "jewelry",
+    "watch": "watch", "wristwatch": "watch", "smartwatch": "watch",
+    "glasses": "glasses", "glass": "glasses", "spectacle": "glasses", "eyeglass": "glasses", "sunglass": "glasses",
+    "document": "documents", "documents": "documents", "paper": "documents", "certificate": "documents",
+    "documents cards": "documents", "documents and cards": "documents", "passport": "documents",
+    "id": "id_card", "id card": "id_card", "identity card": "id_card", "card": "id_card", "student id": "id_card",
+    "license": "id_card", "licence": "id_card", "credit card": "id_card", "debit card": "id_card",
+    "bottle": "bottle", "water bottle": "bottle", "flask": "bottle", "tumbler": "bottle",
+    "umbrella": "umbrella",
+    "sport": "sports", "sports": "sports", "sports equipment": "sports", "ball": "sports", "racket": "sports",
+    "racquet": "sports", "bat": "sports",
+    "other": OTHER, "uncategorized": OTHER, "unknown": OTHER,
+}
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_FILLER = {"a", "an", "the", "of", "and", "or", "my", "some"}
+
+def _normalize(text: str) -> str:
+    words = [word for word in _NON_WORD.sub(" ", text.lower()).split() if word not in _FILLER]
+    return " ".join(words)
+
+def _lookup(term: str) -> Optional[str]:
+    if term in SYNONYMS:
+        return SYNONYMS[term]
+    if term.endswith("es") and term[:-2] in SYNONYMS:
+        return SYNONYMS[term[:-2]]
+    if term.endswith("s") and term[:-1] in SYNONYMS:
+        return SYNONYMS[term[:-1]]
+    return None
+
+def category_key(text: Optional[str]) -> Optional[str]:
+    """Canonical key for a model answer or category name, or None if nothing matches
+
+    Tries the whole phrase, then two-word and single-word pieces from the end
+    (the head noun: "black leather wallet" -> wallet, "mobile phone" -> phone).
+    """
+    if not text:
+        return None
+    term = _normalize(text)
+    if not term:
+        return None
+    key = _lookup(term)
+    if key:
+        return key
+    words = term.split()
+    for size in (2, 1):
+        for end in range(len(words), size - 1, -1):
+            key = _lookup(" ".join(words[end - size:end]))
+            if key:
+                return key
+    return None
+
+def item_category_key(ai_category: Optional[str], category: Optional[str]) -> str:
+    """Key stored on an item: the AI classification when it is recognised, else the reported category"""
+    for text in (ai_category, category):
+        key = category_key(text)
+        if key and key != OTHER:
+            return key
+    return OTHER
+
+def item_keys(ai_category: Optional[str], category: Optional[str]) -> Dict[str, Any]:
+    """The derived category fields stored on an item (see the module docstring)"""
+    key = item_category_key(ai_category, category)
+    user_key = category_key(category) or OTHER
+    return {
+        "category_key": key,
+        "user_category_key": user_key,
+        "category_keys": [key] if user_key == key else [key, user_key],
+    }
+
+def label(key: str) -> str:
+    """Display name of a canonical key"""
+    return CATEGORY_LABELS.get(key) or key.replace("_", " ").title()
+
+def expand(key: str) -> List[str]:
+    """The key plus all keys below it in the hierarchy"""
+    keys = [key]
+    for child, parent in CATEGORY_PARENTS.items():
+        if parent == key:
+            keys.extend(expand(child))
+    return keys
@@ -0,0 +1,284 @@
+"""Opt-in request tracing and sampling profiler
+
+A request is traced when it carries an `X-Trace: 1` header together with a
+valid `X-Debug-Token`, or is picked by TRACE_SAMPLE_RATE. Traced requests record a span around every instrumented
+call (MongoDB methods, Gemini calls, image processing) and are sampled by a
+background profiler thread that snapshots the stacks of the threads working
+on the request every TRACE_PROFILE_INTERVAL_MS. The event loop thread is
+shared by every request, so it is only sampled while the request's own task
+is the one running on it (or inside one of its spans).
+
+Finished traces are kept in a bounded in-memory ring buffer and exposed by
+/debug/traces and /debug/profile/{trace_id}; the profile is available in the
+collapsed-stack format read by flamegraph.pl, speedscope and friends. Stacks
+and timings reveal internals, so those endpoints answer 404 unless
+DEBUG_TOKEN is set, and then require it in the X-Debug-Token header.
+
+Untraced requests pay a single context variable lookup per instrumented call.
+"""
+import asyncio
+import collections
+import contextvars
+import functools
+import hmac
+import inspect
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_PROFILE_INTERVAL_MS = float(os.getenv("TRACE_PROFILE_INTERVAL_MS", "5"))
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+TRACE_HEADER = b"x-trace"
+DEBUG_TOKEN_HEADER = b"x-debug-token"
+MAX_STACK_DEPTH = 64
+MAX_SPANS_PER_TRACE = 2000
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_finished = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+_active = set()
+_active_lock = threading.Lock()
+_sampler_wakeup = threading.Event()
+_sampler_thread = None
+
+class Trace:
+    """Spans and stack samples collected for one request"""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.status = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans: List[Dict[str, Any]] = []
+        self.samples = collections.Counter()
+        # thread id -> number of open spans (or request scope) in that thread
+        self.threads: Dict[int, int] = {}
+        # The request's task on the event loop, sampled only while it is the running task
+        self.loop = None
+        self.task = None
+        self.loop_thread = None
+        self._lock = threading.Lock()
+
+    def enter_thread(self, thread_id: int):
+        with self._lock:
+            self.threads[thread_id] = self.threads.get(thread_id, 0) + 1
+
+    def exit_thread(self, thread_id: int):
+        with self._lock:
+            remaining = self.threads.get(thread_id, 0) - 1
+            if remaining > 0:
+                self.threads[thread_id] = remaining
+            else:
+                self.threads.pop(thread_id, None)
+
+    def summary(self) -> Dict[str, Any]:
+        span_totals = collections.defaultdict(float)
+        for span in self.spans:
+            span_totals[span["name"]] += span["duration_ms"]
+        return {
+            "trace_id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "span_count": len(self.spans),
+            "sample_count": sum(self.samples.values()),
+            "time_by_span_ms": {name: round(total, 3) for name, total in
+                                sorted(span_totals.items(), key=lambda item: -item[1])}
+        }
+
+    def collapsed_stacks(self) -> str:
+        """Profile in the collapsed-stack format ("frame;frame;frame count" per line)"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+class _Span:
+    __slots__ = ("trace", "name", "start", "thread_id")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.trace.enter_thread(self.thread_id)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self.trace.exit_thread(self.thread_id)
+        if len(self.trace.spans) >= MAX_SPANS_PER_TRACE:
+            return False
+        self.trace.spans.append({
+            "name": self.name,
+            "start_ms": round((self.start - self.trace.start) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "thread": self.thread_id,
+            "error": exc_type.__name__ if exc_type else None
+        })
+        return False
+
+def span(name: str):
+    """Context manager recording a span on the current trace (no-op when not tracing)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name)
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def traced(name: Optional[str] = None):
+    """Decorator recording a span around each call of the wrapped function"""
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            with _Span(trace, span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced_class(prefix: str, exclude=()):
+    """Class decorator tracing every public method except generators and those in exclude"""
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or attr in exclude or not inspect.isfunction(value):
+                continue
+            if inspect.isgeneratorfunction(inspect.unwrap(value)):
+                continue
+            setattr(cls, attr, traced(f"{prefix}.{attr}")(value))
+        return cls
+    return decorator
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}.{code.co_name}"
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+# Running task per event loop (a private table, read without the loop's cooperation)
+_running_tasks = getattr(asyncio.tasks, "_current_tasks", {})
+
+def _sampler_loop():
+    interval = TRACE_PROFILE_INTERVAL_MS / 1000
+    while True:
+        with _active_lock:
+            traces = list(_active)
+        if not traces:
+            _sampler_wakeup.wait()
+            _sampler_wakeup.clear()
+            continue
+        frames = sys._current_frames()
+        for trace in traces:
+            with trace._lock:
+                thread_ids = list(trace.threads)
+            if (trace.loop_thread is not None and trace.loop_thread not in thread_ids
+                    and _running_tasks.get(trace.loop) is trace.task):
+                thread_ids.append(trace.loop_thread)
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    trace.samples[_collapse(frame)] += 1
+        del frames
+        time.sleep(interval)
+
+def _ensure_sampler():
+    global _sampler_thread
+    if _sampler_thread is None or not _sampler_thread.is_alive():
+        with _active_lock:
+            if _sampler_thread is None or not _sampler_thread.is_alive():
+                _sampler_thread = threading.Thread(target=_sampler_loop, name="trace-sampler", daemon=True)
+                _sampler_thread.start()
+    _sampler_wakeup.set()
+
+def recent_traces() -> List[Dict[str, Any]]:
+    """Summaries of the buffered traces, newest first"""
+    return [trace.summary() for trace in reversed(_finished)]
+
+def check_debug_token(token: Optional[str]) -> bool:
+    """Whether a request may read the debug endpoints (never while DEBUG_TOKEN is unset)"""
+    return bool(DEBUG_TOKEN) and token is not None and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+def get_trace(trace_id: str) -> Optional[Trace]:
+    for trace in _finished:
+        if trace.id == trace_id:
+            return trace
+    return None
+
+class TracingMiddleware:
+    """ASGI middleware starting a trace for opted-in or sampled requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_trace(scope):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        trace.loop = asyncio.get_running_loop()
+        trace.task = asyncio.current_task()
+        trace.loop_thread = threading.get_ident()
+        with _active_lock:
+            _active.add(trace)
+        _ensure_sampler()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace.id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            trace.duration = time.perf_counter() - trace.start
+            trace.loop_thread = None
+            with _active_lock:
+                _active.discard(trace)
+            _current_trace.reset(token)
+            _finished.append(trace)
+
+    @staticmethod
+    def _should_trace(scope) -> bool:
+        if scope["path"].startswith("/debug/"):
+            return False
+        headers = dict(scope.get("headers", ()))
+        requested = headers.get(TRACE_HEADER)
+        if requested is not None:
+            if requested in (b"0", b"false", b""):
+                return False
+            # Profiling is costly, so only DEBUG_TOKEN holders may ask for it
+            token = headers.get(DEBUG_TOKEN_HEADER)
+            if check_debug_token(token.decode("latin-1") if token is not None else None):
+                return True
+        return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
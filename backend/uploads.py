@@ -0,0 +1,170 @@
+"""Image uploads
+
+FastAPI parses the whole multipart body before a handler runs, spooling the
+file part to a temporary file (in memory up to 1 MB, on disk beyond), so the
+functions here work on an upload that has already been received. They copy
+it into the image store chunk by chunk while the SHA-256 is computed and the
+size limit is enforced, and sniff the first bytes so non-images are rejected
+before anything is written to the store. The image is also collected once in
+memory (at most max_bytes) for feature extraction and classification.
+
+UploadLimitMiddleware is what keeps oversized bodies from being received: it
+answers 413 immediately when Content-Length is too large, otherwise as soon
+as the received bytes cross the limit, before the body is fully spooled.
+"""
+import hashlib
+import os
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+import metrics
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Allowance for the other form fields and multipart boundaries around the file
+FORM_OVERHEAD_BYTES = 64 * 1024
+# Matches the GridFS chunk size, so each write maps to one chunk insert
+CHUNK_SIZE = 255 * 1024
+
+# Request body limits by path, enforced by UploadLimitMiddleware
+UPLOAD_LIMITS = {
+    path: MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES for path in ("/report/", "/search/hybrid", "/search/visual/")
+}
+
+UPLOADS_REJECTED = metrics.Counter("uploads_rejected_total", "Uploads rejected before being stored", ["reason"])
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Content type from an image's magic bytes, or None if it is not a supported image"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def _reject(status_code: int, reason: str, detail: str) -> HTTPException:
+    UPLOADS_REJECTED.inc(reason=reason)
+    return HTTPException(status_code=status_code, detail=detail)
+
+async def stream_image_to_store(upload: UploadFile, mongo_db,
+                                max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, bytearray, str]:
+    """Copy an uploaded image into the image store in chunks
+
+    Returns (file_id, image bytes, sha256 hex digest). The bytes are the one
+    in-memory copy (a bytearray, bounded by max_bytes) used by the feature
+    extraction and classification that follow. Raises HTTPException 413 for
+    oversized and 415 for non-image uploads; nothing is left in the store in
+    either case.
+    """
+    head = b""
+    while len(head) < 12:
+        chunk = await upload.read(12 - len(head))
+        if not chunk:
+            break
+        head += chunk
+    content_type = sniff_image_type(head)
+    if content_type is None:
+        raise _reject(415, "not_image", "Only JPEG, PNG, GIF and WebP images are allowed")
+
+    digest = hashlib.sha256(head)
+    data = bytearray(head)
+    writer = await run_in_threadpool(mongo_db.open_image_upload, upload.filename, content_type)
+    try:
+        await run_in_threadpool(writer.write, head)
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(data) + len(chunk) > max_bytes:
+                raise _reject(413, "too_large", f"Image exceeds the limit of {max_bytes} bytes")
+            digest.update(chunk)
+            data += chunk
+            await run_in_threadpool(writer.write, chunk)
+        await run_in_threadpool(writer.close, {"sha256": digest.hexdigest()})
+    except BaseException:
+        await run_in_threadpool(writer.abort)
+        raise
+    return writer.file_id, data, digest.hexdigest()
+
+async def content_digest(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """SHA-256 hex digest of an upload's bytes, leaving it rewound for reading again
+
+    Reads the spooled upload once more in chunks (nothing is kept in memory);
+    an upload over max_bytes is only hashed that far, since it will be
+    rejected when it is read for real.
+    """
+    digest = hashlib.sha256()
+    read = 0
+    while read <= max_bytes:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        read += len(chunk)
+    await upload.seek(0)
+    return digest.hexdigest()
+
+async def read_image(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytearray:
+    """Read an uploaded query image into memory (nothing is stored)
+
+    Raises HTTPException 413 for oversized and 415 for non-image uploads.
+    """
+    data = bytearray()
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(data) + len(chunk) > max_bytes:
+            raise _reject(413, "too_large", f"Image exceeds the limit of {max_bytes} bytes")
+        data += chunk
+    if sniff_image_type(bytes(data[:12])) is None:
+        raise _reject(415, "not_image", "Only JPEG, PNG, GIF and WebP images are allowed")
+    return data
+
+class UploadLimitMiddleware:
+    """ASGI middleware returning 413 for request bodies over the path's limit"""
+
+    def __init__(self, app, limits=None):
+        self.app = app
+        self.limits = UPLOAD_LIMITS if limits is None else limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                UPLOADS_REJECTED.inc(reason="too_large")
+                await self._send_413(send, limit)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # An HTTPException passes through FastAPI's body parsing unchanged
+                    raise _reject(413, "too_large", f"Request body exceeds {limit} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    async def _send_413(send, limit: int):
+        body = f'{{"detail":"Request body exceeds {limit} bytes"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")]
+        })
+        await send({"type": "http.response.body", "body": body})
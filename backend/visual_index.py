@@ -0,0 +1,169 @@
+"""In-memory index of the live items' image features
+
+Each item with a stored feature vector (image_utils.extract_features_from_bytes)
+is a row of one float32 matrix, scaled to unit length so cosine similarity to
+a query image is a single matrix-vector product: about 10 ms for 100k items,
+at roughly 800 bytes of memory per item. Rows of removed items are zeroed; the
+space is reclaimed at the next rebuild.
+
+The index is built in the background once MongoDB is connected and kept
+current by live_index (VISUAL_SYNC_SECONDS, VISUAL_REBUILD_MINUTES).
+"""
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import live_index
+import metrics
+
+VISUAL_SYNC_SECONDS = float(os.getenv("VISUAL_SYNC_SECONDS", "30"))
+VISUAL_REBUILD_MINUTES = float(os.getenv("VISUAL_REBUILD_MINUTES", "60"))
+FEATURE_DIM = 198  # 3 x 64 histogram bins + mean and std per channel
+
+# What the index is loaded from
+PROJECTION = {"features": 1, "status": 1, "category_key": 1, "classified_by": 1}
+
+SEARCH_SECONDS = metrics.Histogram("visual_search_duration_seconds", "Time to rank visual search candidates in memory")
+metrics.Gauge("visual_index_items", "Items in the visual search index", callback=lambda: len(_live.index.slots))
+
+def normalize(features) -> Optional[np.ndarray]:
+    """A feature vector scaled to unit length, or None if it isn't a usable vector"""
+    if features is None:
+        return None
+    vector = np.asarray(features, dtype=np.float32).ravel()
+    if vector.shape != (FEATURE_DIM,):
+        return None
+    norm = float(np.linalg.norm(vector))
+    if not norm or not np.isfinite(norm):
+        return None
+    return vector / norm
+
+class VisualIndex:
+    """Unit feature vectors in a growable matrix, one row (slot) per item"""
+
+    def __init__(self):
+        self.slots: Dict[str, int] = {}  # item ID -> slot
+        self.ids: List[Optional[str]] = []  # slot -> item ID (None once removed)
+        self.matrix = np.zeros((1024, FEATURE_DIM), dtype=np.float32)
+        # Status and category_key of each slot, as codes into values so filters are array comparisons
+        self.codes: Dict[Optional[str], int] = {}
+        self.values: List[Optional[str]] = []
+        self.statuses = np.full(1024, -1, dtype=np.int32)
+        self.categories = np.full(1024, -1, dtype=np.int32)
+        self.local_labels = np.zeros(1024, dtype=bool)  # Category came from local_classifier, not Gemini
+        self.lock = threading.Lock()
+
+    def _code(self, value: Optional[str]) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def add(self, doc: Dict[str, Any]):
+        """Index an item's features; without a features field only its status and category are updated"""
+        item_id = str(doc["_id"])
+        vector = normalize(doc.get("features"))
+        with self.lock:
+            if vector is None:
+                slot = self.slots.get(item_id)
+                if slot is not None and "features" not in doc:
+                    if "status" in doc:
+                        self.statuses[slot] = self._code(doc["status"])
+                    if "category_key" in doc:
+                        self.categories[slot] = self._code(doc["category_key"])
+                        self.local_labels[slot] = doc.get("classified_by") == "local"
+                return
+            self._remove(item_id)
+            slot = len(self.ids)
+            if slot >= len(self.matrix):
+                self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+                self.statuses = np.concatenate([self.statuses, np.full_like(self.statuses, -1)])
+                self.categories = np.concatenate([self.categories, np.full_like(self.categories, -1)])
+                self.local_labels = np.concatenate([self.local_labels, np.zeros_like(self.local_labels)])
+            self.matrix[slot] = vector
+            self.statuses[slot] = self._code(doc.get("status"))
+            self.categories[slot] = self._code(doc.get("category_key"))
+            self.local_labels[slot] = doc.get("classified_by") == "local"
+            self.slots[item_id] = slot
+            self.ids.append(item_id)
+
+    def remove(self, item_id: str):
+        with self.lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id: str):
+        slot = self.slots.pop(item_id, None)
+        if slot is None:
+            return
+        self.matrix[slot] = 0
+        self.statuses[slot] = -1
+        self.categories[slot] = -1
+        self.local_labels[slot] = False
+        self.ids[slot] = None
+
+    def describe(self) -> str:
+        return f"{len(self.slots)} items"
+
+    def labelled_sample(self, per_label: int, exclude: Iterable[Optional[str]] = (None,)) -> Tuple[np.ndarray, List[str]]:
+        """Unit feature rows of the newest per_label items of each category, and their categories
+
+        Items whose category the local classifier assigned itself are left
+        out, so it only learns from Gemini's (or the reporters') labels.
+        """
+        excluded = set(exclude)
+        with self.lock:
+            count = len(self.ids)
+            categories = np.where(self.local_labels[:count], -1, self.categories[:count])
+            present = np.unique(categories[categories >= 0])
+            slots, labels = [], []
+            for code in present.tolist():
+                if self.values[code] in excluded:
+                    continue
+                chosen = np.flatnonzero(categories == code)[-per_label:]
+                slots.append(chosen)
+                labels.extend([self.values[code]] * len(chosen))
+            if not slots:
+                return np.zeros((0, FEATURE_DIM), dtype=np.float32), []
+            return self.matrix[np.concatenate(slots)], labels
+
+    def search(self, features, limit: int, status: Optional[str] = None,
+               category_keys: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Top (item ID, cosine similarity) pairs for a query image's features, most similar first"""
+        vector = normalize(features)
+        if vector is None:
+            return []
+        category_keys = set(category_keys) if category_keys else None
+        with self.lock:
+            count = len(self.ids)
+            similarities = self.matrix[:count] @ vector
+            if status:
+                similarities = np.where(self.statuses[:count] == self.codes.get(status, -2), similarities, 0)
+            if category_keys:
+                wanted = [self.codes[key] for key in category_keys if key in self.codes]
+                similarities = np.where(np.isin(self.categories[:count], wanted), similarities, 0)
+            candidates = np.flatnonzero(similarities > 0)
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-similarities[candidates], limit - 1)[:limit]]
+            # Most similar first, ties to the newer item
+            order = candidates[np.lexsort((-candidates, -similarities[candidates]))]
+            return [(self.ids[slot], float(similarities[slot])) for slot in order]
+
+_live = live_index.LiveIndex("Visual", VisualIndex, VISUAL_SYNC_SECONDS, VISUAL_REBUILD_MINUTES, PROJECTION)
+
+is_ready = _live.is_ready
+record_insert = _live.record_insert
+record_delete = _live.record_delete
+start = _live.start
+
+def labelled_sample(per_label: int, exclude: Iterable[Optional[str]] = (None,)) -> Tuple[np.ndarray, List[str]]:
+    """Training data for local_classifier (empty until the index has been built)"""
+    return _live.index.labelled_sample(per_label, exclude)
+
+def search(features, limit: int = 50, status: Optional[str] = None,
+           category_keys: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+    """Ranked (item ID, similarity) pairs; empty until the index has been built"""
+    with SEARCH_SECONDS.time():
+        return _live.index.search(features, limit, status, category_keys)
@@ -0,0 +1,278 @@
+"""End-to-end load test for the Lost and Found API
+
+Seeds a database with synthetic items and images, starts the API in-process
+behind uvicorn, and drives /report/, /items/, /search/ and /images/{id} with a
+weighted mix of concurrent requests. Gemini is replaced by a fake model client
+with configurable latency, so runs are repeatable and free. Throughput and
+latency percentiles are printed (and optionally written) as JSON so results can
+be compared release to release.
+
+Usage:
+    # In-memory Mongo stand-in (pip install -r bench/requirements.txt)
+    python bench/loadtest.py --rows 10000 --duration 30 --concurrency 16
+
+    # Local mongod (a scratch database is used unless DATABASE_NAME is set)
+    MONGO_URL=mongodb://localhost:27017/ python bench/loadtest.py --mongo mongod --rows 100000
+
+    # An already running server (no seeding, no Gemini stub)
+    python bench/loadtest.py --url http://localhost:8000 --duration 60
+
+    # Write results for later comparison
+    python bench/loadtest.py --rows 1000000 --output results/loadtest-1m.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(os.path.dirname(BENCH_DIR), "backend")
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+
+DEFAULT_MIX = "search=50,image=30,items=10,report=10"
+SIZE_PRESETS = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+def parse_rows(value: str) -> int:
+    return SIZE_PRESETS.get(value.lower()) or int(value)
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"report", "items", "search", "image"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown operations in mix: {', '.join(sorted(unknown))}")
+    return mix
+
+def install_fake_gemini(latency_ms: float, seed: int):
+    """Replace google.generativeai with a fake client so gemini_api runs without network calls"""
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class FakeModel:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def generate_content(self, parts, *args, **kwargs):
+            time.sleep(latency_ms / 1000)
+            with rng_lock:
+                return types.SimpleNamespace(text=rng.choice(synthetic.AI_CATEGORIES))
+
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = FakeModel
+    google = sys.modules.get("google") or types.ModuleType("google")
+    google.generativeai = genai
+    sys.modules["google"] = google
+    sys.modules["google.generativeai"] = genai
+    os.environ.setdefault("GEMINI_API_KEY", "loadtest")
+
+def use_mongomock():
+    import mongomock
+    import mongomock.gridfs
+    import mongodb
+
+    mongomock.gridfs.enable_gridfs_integration()
+    mongodb.MongoClient = mongomock.MongoClient
+
+def seed_database(rows: int, image_count: int, seed: int, reseed: bool) -> Dict[str, float]:
+    """Insert synthetic images and items, reusing an existing seed of the same size"""
+    import mongodb
+
+    mongo_db = mongodb.get_mongodb()
+    if mongo_db.client is None:
+        raise SystemExit("Could not connect to MongoDB")
+
+    if reseed:
+        mongo_db.collection.delete_many({})
+        mongo_db.db.fs.files.delete_many({})
+        mongo_db.db.fs.chunks.delete_many({})
+    existing = mongo_db.collection.estimated_document_count()
+    if existing >= rows:
+        print(f"Reusing {existing} existing items")
+        return {"rows": existing, "images": mongo_db.db.fs.files.estimated_document_count(), "seconds": 0.0}
+
+    start = time.perf_counter()
+    image_ids = [
+        mongo_db.store_image(synthetic.make_image(seed + index), f"seed_{index}.jpg")
+        for index in range(image_count)
+    ]
+    batch = []
+    for doc in synthetic.iter_item_documents(rows - existing, image_ids, seed, mongo_db.base_url):
+        batch.append(doc)
+        if len(batch) >= 5000:
+            mongo_db.collection.insert_many(batch)
+            batch = []
+            print(f"  seeded {mongo_db.collection.estimated_document_count()} / {rows} items", end="\r")
+    if batch:
+        mongo_db.collection.insert_many(batch)
+    seconds = time.perf_counter() - start
+    print(f"Seeded {rows} items and {image_count} images in {seconds:.1f}s")
+    return {"rows": rows, "images": image_count, "seconds": round(seconds, 2)}
+
+def start_server() -> Tuple[str, object]:
+    """Run the API with uvicorn in a background thread on a free port"""
+    import uvicorn
+    import main
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise SystemExit("API server did not start")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+def discover_image_ids(base_url: str, limit: int = 1000) -> List[str]:
+    """Read image IDs from the start of the export stream"""
+    image_ids = []
+    with requests.get(f"{base_url}/export", stream=True, timeout=30) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            row = json.loads(line)
+            if row.get("image_file_id"):
+                image_ids.append(row["image_file_id"])
+            if len(image_ids) >= limit:
+                break
+    return image_ids
+
+class Worker:
+    """One client issuing requests from the mix until the deadline"""
+
+    def __init__(self, base_url: str, mix: Dict[str, float], image_ids: List[str], upload_images: List[bytes], seed: int):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.rng = random.Random(seed)
+        self.ops = list(mix)
+        self.weights = list(mix.values())
+        self.image_ids = image_ids
+        self.upload_images = upload_images
+        self.terms = synthetic.search_terms()
+        self.samples: List[Tuple[str, float, bool]] = []
+
+    def request(self, op: str) -> requests.Response:
+        if op == "search":
+            return self.session.get(f"{self.base_url}/search/", params={"q": self.rng.choice(self.terms)}, timeout=60)
+        if op == "items":
+            return self.session.get(f"{self.base_url}/items/", timeout=120)
+        if op == "image":
+            return self.session.get(f"{self.base_url}/images/{self.rng.choice(self.image_ids)}", timeout=30)
+        form = synthetic.make_item(self.rng.randrange(10**9), self.rng)
+        form.pop("timestamp")
+        image = self.rng.choice(self.upload_images)
+        return self.session.post(f"{self.base_url}/report/", data=form, files={"file": ("item.jpg", image, "image/jpeg")}, timeout=120)
+
+    def run(self, deadline: float):
+        while time.perf_counter() < deadline:
+            op = self.rng.choices(self.ops, self.weights)[0]
+            if op == "image" and not self.image_ids:
+                continue
+            start = time.perf_counter()
+            try:
+                ok = self.request(op).status_code < 400
+            except requests.RequestException:
+                ok = False
+            self.samples.append((op, time.perf_counter() - start, ok))
+
+def summarize(latencies: List[float], errors: int, seconds: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def percentile(q: float) -> float:
+        return round(latencies[min(count - 1, int(q * count))] * 1000, 3) if count else 0.0
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / seconds, 2) if seconds else 0.0,
+        "mean_ms": round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(latencies[-1] * 1000, 3) if count else 0.0,
+    }
+
+def run_load(base_url: str, mix: Dict[str, float], concurrency: int, duration: float, seed: int) -> Dict[str, Dict]:
+    image_ids = discover_image_ids(base_url)
+    upload_images = [synthetic.make_image(seed + 10_000 + index, 640) for index in range(8)]
+    workers = [Worker(base_url, mix, image_ids, upload_images, seed + index) for index in range(concurrency)]
+
+    start = time.perf_counter()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker.run, deadline) for worker in workers]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    samples = [sample for worker in workers for sample in worker.samples]
+    results = {"overall": summarize([s[1] for s in samples], sum(not s[2] for s in samples), elapsed), "by_op": {}}
+    for op in mix:
+        op_samples = [s for s in samples if s[0] == op]
+        results["by_op"][op] = summarize([s[1] for s in op_samples], sum(not s[2] for s in op_samples), elapsed)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test for the Lost and Found API")
+    parser.add_argument("--url", help="Target an already running server instead of starting one")
+    parser.add_argument("--mongo", choices=["mongomock", "mongod"], default="mongomock",
+                        help="Database for the in-process server (mongod uses MONGO_URL)")
+    parser.add_argument("--rows", type=parse_rows, default="10k", help="Items to seed: 10k, 100k, 1m or a number")
+    parser.add_argument("--images", type=int, default=200, help="Distinct synthetic images shared by the seeded items")
+    parser.add_argument("--reseed", action="store_true", help="Drop existing items and images before seeding")
+    parser.add_argument("--gemini-latency-ms", type=float, default=500.0, help="Latency of the fake Gemini model")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"Weighted operation mix (default {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    seed_info = None
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        os.environ.setdefault("DATABASE_NAME", "lost_and_found_loadtest")
+        # Every simulated client shares one IP, so the default per-IP limits would turn the load into 429s
+        os.environ.setdefault("RATE_LIMITS", "")
+        sys.path.insert(0, BACKEND_DIR)
+        install_fake_gemini(args.gemini_latency_ms, args.seed)
+        if args.mongo == "mongomock":
+            use_mongomock()
+        seed_info = seed_database(args.rows, args.images, args.seed, args.reseed)
+        base_url, server = start_server()
+
+    print(f"Driving {base_url} with {args.concurrency} clients for {args.duration:.0f}s ...")
+    results = run_load(base_url, args.mix, args.concurrency, args.duration, args.seed)
+    if server is not None:
+        server.should_exit = True
+
+    report = {"config": config, "seed": seed_info, "results": results}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Microbenchmarks for image_utils and the row-building hot paths
+
+Fixed synthetic images and documents are used so numbers are comparable
+between runs. Each benchmark is calibrated to run for at least --min-time
+seconds per round; the best of --rounds rounds is reported as items per second.
+
+Usage:
+    python bench/microbench.py                              # run everything
+    python bench/microbench.py -k similar                   # only benchmarks whose name contains "similar"
+    python bench/microbench.py --save bench/baseline.json   # store a baseline
+    python bench/microbench.py --compare bench/baseline.json --threshold 0.1
+        # exits non-zero when any benchmark is more than 10% slower than the baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(os.path.dirname(BENCH_DIR), "backend")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import synthetic
+
+# name -> setup function returning (function to time, items processed per call)
+BENCHMARKS: Dict[str, Callable[[], Tuple[Callable[[], object], int]]] = {}
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+_image_dir = None
+
+def fixture_images(count: int, size: int = 256) -> List[str]:
+    """Paths of deterministic JPEGs written once per run"""
+    global _image_dir
+    if _image_dir is None:
+        _image_dir = tempfile.mkdtemp(prefix="microbench_")
+    paths = []
+    for index in range(count):
+        path = os.path.join(_image_dir, f"img_{size}_{index}.jpg")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(synthetic.make_image(index, size))
+        paths.append(path)
+    return paths
+
+def fixture_documents(count: int) -> List[dict]:
+    docs = list(synthetic.iter_item_documents(count, [f"{index:024x}" for index in range(50)], seed=7))
+    for index, doc in enumerate(docs):
+        doc["_id"] = f"{index:024x}"
+    return docs
+
+class _FakeCursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def batch_size(self, *args):
+        return self
+
+    def close(self):
+        pass
+
+class _FakeCollection:
+    """Returns fixed documents so only the Python row building is measured"""
+
+    def __init__(self, docs: List[dict]):
+        self.docs = docs
+
+    def find(self, *args, **kwargs):
+        return _FakeCursor(self.docs)
+
+def offline_mongodb(docs: List[dict]):
+    """A MongoDB instance wired to an in-memory collection (no connection attempt)"""
+    import mongodb
+
+    instance = mongodb.MongoDB.__new__(mongodb.MongoDB)
+    instance.client = object()
+    instance.collection = _FakeCollection(docs)
+    instance.archive_collection = _FakeCollection([])
+    instance.base_url = "http://localhost:8000"
+    mongodb.mongodb_instance = instance
+    return instance
+
+# --- image_utils ---
+
+@benchmark("image_utils.extract_features[256px]")
+def bench_extract_features():
+    from image_utils import extract_features
+    paths = fixture_images(16)
+
+    def run():
+        for path in paths:
+            extract_features(path)
+    return run, len(paths)
+
+@benchmark("image_utils.extract_features[1024px]")
+def bench_extract_features_large():
+    from image_utils import extract_features
+    paths = fixture_images(4, 1024)
+
+    def run():
+        for path in paths:
+            extract_features(path)
+    return run, len(paths)
+
+@benchmark("image_utils.compare_images")
+def bench_compare_images():
+    from image_utils import compare_images
+    paths = fixture_images(8)
+    pairs = [(paths[i], paths[j]) for i in range(len(paths)) for j in range(i + 1, len(paths))][:16]
+
+    def run():
+        for first, second in pairs:
+            compare_images(first, second)
+    return run, len(pairs)
+
+def _similar_benchmark(corpus_size: int):
+    def setup():
+        from image_utils import find_similar_images
+        paths = fixture_images(corpus_size)
+        query = paths[0]
+
+        def run():
+            find_similar_images(query, paths)[:10]
+        return run, 1
+    return setup
+
+for _corpus_size in (10, 50, 200):
+    benchmark(f"image_utils.find_similar_images[top10,n={_corpus_size}]")(_similar_benchmark(_corpus_size))
+
+@benchmark("image_utils.make_thumbnail[120px]")
+def bench_make_thumbnail():
+    from image_utils import make_thumbnail
+    images = [synthetic.make_image(index, 1024) for index in range(4)]
+
+    def run():
+        for data in images:
+            make_thumbnail(data, 120)
+    return run, len(images)
+
+# --- row serialization ---
+
+@benchmark("mongodb.fetch_all_items[rows]")
+def bench_fetch_all_items():
+    docs = fixture_documents(2000)
+    instance = offline_mongodb(docs)
+    return instance.fetch_all_items, len(docs)
+
+@benchmark("mongodb.search_items[rows]")
+def bench_search_items():
+    docs = fixture_documents(2000)
+    instance = offline_mongodb(docs)
+    return (lambda: instance.search_items("wallet")), len(docs)
+
+@benchmark("mongodb.item_to_dict[rows]")
+def bench_item_to_dict():
+    docs = fixture_documents(2000)
+    instance = offline_mongodb(docs)
+
+    def run():
+        for doc in docs:
+            instance.item_to_dict(doc)
+    return run, len(docs)
+
+@benchmark("exporter.stream_export[ndjson rows]")
+def bench_export_ndjson():
+    import exporter
+    docs = fixture_documents(2000)
+    offline_mongodb(docs)
+
+    def run():
+        for _ in exporter.stream_export("ndjson"):
+            pass
+    return run, len(docs)
+
+@benchmark("exporter.stream_export[csv rows]")
+def bench_export_csv():
+    import exporter
+    docs = fixture_documents(2000)
+    offline_mongodb(docs)
+
+    def run():
+        for _ in exporter.stream_export("csv"):
+            pass
+    return run, len(docs)
+
+# --- fuzzy search ---
+
+def _fuzzy_benchmark(corpus_size: int):
+    def setup():
+        import fuzzy
+        from bson import ObjectId
+        index = fuzzy.FuzzyIndex()
+        for doc in synthetic.iter_item_documents(corpus_size, [], seed=11):
+            doc["_id"] = ObjectId()
+            index.add(doc)
+        queries = ["walet", "iphne", "calculater", "blak bakpack", "umbrela", "silver watch"]
+
+        def run():
+            for query in queries:
+                index.search(query, 50)
+        return run, len(queries)
+    return setup
+
+for _corpus_size in (10_000, 100_000):
+    benchmark(f"fuzzy.search[top50,n={_corpus_size}]")(_fuzzy_benchmark(_corpus_size))
+
+# --- visual search ---
+
+def _visual_benchmark(corpus_size: int):
+    def setup():
+        import visual_index
+        import numpy as np
+        from bson import ObjectId
+        rng = np.random.default_rng(13)
+        index = visual_index.VisualIndex()
+        for features in rng.random((corpus_size, visual_index.FEATURE_DIM), dtype=np.float32):
+            index.add({"_id": ObjectId(), "features": features, "status": "Lost", "category_key": "phone"})
+        queries = rng.random((8, visual_index.FEATURE_DIM), dtype=np.float32)
+
+        def run():
+            for query in queries:
+                index.search(query, 200, status="Lost")
+        return run, len(queries)
+    return setup
+
+for _corpus_size in (10_000, 100_000):
+    benchmark(f"visual_index.search[top200,n={_corpus_size}]")(_visual_benchmark(_corpus_size))
+
+def measure(setup, rounds: int, min_time: float) -> Dict[str, float]:
+    func, items = setup()
+    func()  # warm up caches and lazy imports
+
+    # Calibrate the loop count so one round lasts at least min_time
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        # Aim a little past min_time, growing at most 10x per step
+        loops = max(loops + 1, min(loops * 10, int(loops * min_time * 1.2 / max(elapsed, 1e-9))))
+
+    timings = [elapsed / loops]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+
+    best = min(timings)
+    return {
+        "per_second": round(items / best, 2),
+        "best_ms": round(best * 1000, 4),
+        "mean_ms": round(statistics.mean(timings) * 1000, 4),
+        "stdev_ms": round(statistics.stdev(timings) * 1000, 4) if len(timings) > 1 else 0.0,
+        "loops": loops,
+        "items_per_call": items,
+    }
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """Print per-benchmark changes and return the names that regressed beyond threshold"""
+    regressions = []
+    print(f"\n{'benchmark':58} {'baseline/s':>14} {'current/s':>14} {'change':>9}")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            print(f"{name:58} {'-':>14} {current['per_second']:>14,.1f} {'new':>9}")
+            continue
+        change = current["per_second"] / before["per_second"] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:58} {before['per_second']:>14,.1f} {current['per_second']:>14,.1f} {change:>+8.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for image and serialization hot paths")
+    parser.add_argument("-k", dest="keyword", help="Only run benchmarks whose name contains this string")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per round")
+    parser.add_argument("--save", help="Write results as a baseline JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown before failing (fraction)")
+    args = parser.parse_args()
+
+    random.seed(0)
+    selected = {name: setup for name, setup in BENCHMARKS.items() if not args.keyword or args.keyword in name}
+    results = {}
+    for name, setup in selected.items():
+        results[name] = measure(setup, args.rounds, args.min_time)
+        print(f"{name:58} {results[name]['per_second']:>14,.1f}/s  (best {results[name]['best_ms']} ms/call)")
+
+    if args.save:
+        payload = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+        with open(args.save, "w") as f:
+            json.dump(payload, f, indent=2)
+            f.write("\n")
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Exercise the s3 image store against a real S3-compatible endpoint
+
+Runs every ImageStore operation of S3Store (put, get, uploads, derived
+images, listing, delete) under a fresh prefix of a bucket and reports each
+check, so an S3 stand-in such as MinIO can be verified before the API is
+pointed at it. Everything written is deleted again at the end.
+
+Usage:
+    docker run -d -p 9000:9000 -e MINIO_ROOT_USER=minio -e MINIO_ROOT_PASSWORD=minio123 minio/minio server /data
+    AWS_ACCESS_KEY_ID=minio AWS_SECRET_ACCESS_KEY=minio123 AWS_DEFAULT_REGION=us-east-1 \\
+        python bench/s3_store_check.py --endpoint-url http://localhost:9000 --bucket lost-found --create-bucket
+
+Needs boto3 (pip install boto3). Exits non-zero when any check fails.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(os.path.dirname(BENCH_DIR), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+from PIL import Image
+
+import image_store
+
+def sample_jpeg(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def run_checks(store: image_store.S3Store) -> list:
+    """(check name, passed) for each operation"""
+    results = []
+
+    def check(name: str, passed: bool):
+        results.append((name, bool(passed)))
+        print(f"{'✅' if passed else '❌'} {name}")
+
+    first, second = sample_jpeg((200, 0, 0)), sample_jpeg((0, 0, 200))
+    first_id = store.put(first, "first.jpg", "image/jpeg", metadata={"sha256": "abc"})
+    check("put then get returns the bytes", store.get(first_id) == first)
+    check("exists is true for a stored image", store.exists(first_id))
+
+    upload = store.open_upload("second.jpg", "image/jpeg")
+    for start in range(0, len(second), 256):
+        upload.write(second[start:start + 256])
+    upload.close({"sha256": "def"})
+    check("chunked upload is readable after close", store.get(upload.file_id) == second)
+    check("get_many finds both images", store.get_many([first_id, upload.file_id]) == {first_id: first, upload.file_id: second})
+
+    missing_id = image_store.new_file_id()
+    check("get of a missing image is None", store.get(missing_id) is None)
+    check("exists of a missing image is false", not store.exists(missing_id))
+
+    variant = image_store.DERIVED_VARIANTS[0]
+    store.put_derived(first_id, variant, b"thumbnail")
+    check("derived image is returned for its source", store.get_derived_many([first_id, upload.file_id], variant) == {first_id: b"thumbnail"})
+    try:
+        store.put_derived(first_id, "unknown_variant", b"x")
+        check("unknown variants are rejected", False)
+    except ValueError:
+        check("unknown variants are rejected", True)
+
+    listed = {stored["file_id"]: stored for stored in store.iter_files()}
+    check("iter_files lists originals and derived images",
+          first_id in listed and upload.file_id in listed and f"{first_id}.{variant}" in listed
+          and listed[f"{first_id}.{variant}"]["derived_from"] == first_id)
+
+    store.delete([first_id, upload.file_id, missing_id])
+    check("delete removes the originals", not store.exists(first_id) and not store.exists(upload.file_id))
+    check("delete removes derived images", store.get_derived_many([first_id], variant) == {})
+    check("nothing is left under the prefix", not list(store.iter_files()))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the s3 image store against an S3-compatible endpoint")
+    parser.add_argument("--endpoint-url", default=image_store.IMAGE_STORE_S3_ENDPOINT_URL,
+                        help="e.g. http://localhost:9000 for MinIO (default: IMAGE_STORE_S3_ENDPOINT_URL, else AWS)")
+    parser.add_argument("--bucket", default=image_store.IMAGE_STORE_S3_BUCKET,
+                        help="Bucket to use (default: IMAGE_STORE_S3_BUCKET)")
+    parser.add_argument("--create-bucket", action="store_true", help="Create the bucket if it doesn't exist")
+    args = parser.parse_args()
+    if not args.bucket:
+        parser.error("--bucket (or IMAGE_STORE_S3_BUCKET) is required")
+
+    # A prefix of its own, so the check never touches stored images
+    store = image_store.S3Store(args.bucket, args.endpoint_url, f"store-check-{int(time.time() * 1000)}/")
+    if args.create_bucket:
+        try:
+            store.client.head_bucket(Bucket=args.bucket)
+        except Exception:
+            store.client.create_bucket(Bucket=args.bucket)
+    store.check()
+    print(f"🪣 Checking {store.describe()} under {store.prefix}")
+    try:
+        results = run_checks(store)
+    finally:
+        leftovers = [obj["Key"] for obj in store._list(store.prefix)]
+        for start in range(0, len(leftovers), image_store.S3_DELETE_BATCH):
+            batch = leftovers[start:start + image_store.S3_DELETE_BATCH]
+            store.client.delete_objects(Bucket=args.bucket, Delete={"Objects": [{"Key": key} for key in batch]})
+    failed = [name for name, passed in results if not passed]
+    print(f"{len(results) - len(failed)}/{len(results)} checks passed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Deterministic synthetic items and images for the benchmarks"""
+import io
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List
+
+from PIL import Image, ImageDraw
+
+OBJECTS = [
+    "wallet", "iphone", "phone", "keys", "backpack", "umbrella", "calculator", "laptop", "charger",
+    "earphones", "textbook", "notebook", "water bottle", "id card", "watch", "jacket", "glasses", "ring"
+]
+ADJECTIVES = ["blue", "black", "red", "silver", "brown", "green", "white", "leather", "small", "old", "new"]
+LOCATIONS = ["Library", "Cafeteria", "Main Building", "Gym", "Parking Lot", "Lab 3", "Auditorium", "Hostel A"]
+CATEGORIES = [
+    "Electronics", "Books & Stationery", "Clothing & Accessories", "Documents & Cards",
+    "Sports Equipment", "Personal Items", "Other"
+]
+AI_CATEGORIES = ["phone", "wallet", "keys", "bag", "book", "electronics", "clothing", "jewelry", "documents"]
+
+def make_image(seed: int, size: int = 256) -> bytes:
+    """A JPEG with a few random shapes, distinct per seed"""
+    rng = random.Random(seed)
+    background = tuple(rng.randrange(256) for _ in range(3))
+    img = Image.new("RGB", (size, size), background)
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x0, y0 = rng.randrange(size), rng.randrange(size)
+        x1, y1 = x0 + rng.randrange(8, size // 2), y0 + rng.randrange(8, size // 2)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle([x0, y0, x1, y1], fill=color)
+        else:
+            draw.ellipse([x0, y0, x1, y1], fill=color)
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+def make_item(index: int, rng: random.Random, now: datetime = None) -> Dict[str, Any]:
+    """A report in the shape of the /report/ form fields"""
+    now = now or datetime.now(timezone.utc)
+    obj = rng.choice(OBJECTS)
+    return {
+        "title": f"{rng.choice(ADJECTIVES).title()} {obj}",
+        "description": f"{rng.choice(ADJECTIVES)} {obj} with a {rng.choice(ADJECTIVES)} {rng.choice(OBJECTS)} #{index}",
+        "category": rng.choice(CATEGORIES),
+        "location": rng.choice(LOCATIONS),
+        "status": rng.choice(["Lost", "Found"]),
+        "name": f"User {index % 997}",
+        "contact": f"user{index}@example.edu",
+        "timestamp": now - timedelta(minutes=rng.randrange(365 * 24 * 60)),
+    }
+
+def iter_item_documents(count: int, image_ids: List[str], seed: int = 0, base_url: str = "http://localhost:8000") -> Iterator[Dict[str, Any]]:
+    """Item documents as stored by MongoDB.build_item_document, cycling through image_ids"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    for index in range(count):
+        doc = make_item(index, rng, now)
+        image_file_id = image_ids[index % len(image_ids)] if image_ids else None
+        doc.update({
+            "ai_category": rng.choice(AI_CATEGORIES) if image_file_id else None,
+            "image_file_id": image_file_id,
+            "image_url": f"{base_url}/images/{image_file_id}" if image_file_id else None,
+        })
+        yield doc
+
+def search_terms() -> List[str]:
+    return OBJECTS + ADJECTIVES
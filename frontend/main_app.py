@@ -5,6 +5,9 @@ import io
 import datetime
 import pytz
 import os
+import json
+import struct
+import uuid
 
 # Configuration for Streamlit deployment
 st.set_page_config(
@@ -64,6 +67,50 @@ def display_image(image_file_id, width=150):
     else:
         st.write("📷 No image")
 
+def image_id_from_url(image_url):
+    """Extract the GridFS file ID from an image URL (or return the ID unchanged)"""
+    if not image_url:
+        return None
+    return image_url.split('/')[-1] if '/images/' in image_url else image_url
+
+def fetch_thumbnails(items, size=120):
+    """Fetch thumbnails for a page of items with a single request
+    
+    Returns a dict of image ID -> JPEG bytes. Cards without a thumbnail here
+    fall back to loading the full image URL.
+    """
+    image_ids = [image_id_from_url(item[8]) for item in items if len(item) >= 9 and item[8]]
+    thumbnails = {}
+    # The backend accepts up to 50 IDs per batch
+    for start in range(0, len(image_ids), 50):
+        try:
+            response = requests.post(
+                f"{API_URL}/images/batch",
+                json={"file_ids": image_ids[start:start + 50], "size": size},
+                timeout=10
+            )
+            if response.status_code != 200:
+                continue
+            
+            body = response.content
+            header_length = struct.unpack(">I", body[:4])[0]
+            header = json.loads(body[4:4 + header_length])
+            payload = body[4 + header_length:]
+            for entry in header.get("images", []):
+                thumbnails[entry["id"]] = payload[entry["offset"]:entry["offset"] + entry["length"]]
+        except Exception:
+            continue
+    return thumbnails
+
+# Report form categories (also offered as search filters)
+CATEGORIES = [
+    "Electronics", "Books & Stationery", "Clothing & Accessories",
+    "Documents & Cards", "Sports Equipment", "Personal Items", "Other"
+]
+
+# Date filter options -> number of days (None = no limit)
+REPORTED_WITHIN = {"Any time": None, "Last 7 days": 7, "Last 30 days": 30}
+
 # Check API connectivity
 @st.cache_data(ttl=30)
 def check_api_health():
@@ -107,36 +154,89 @@ def search_page():
     """, unsafe_allow_html=True)
     
     # Search form
-    col1, col2 = st.columns([3, 1])
+    col1, col2, col3 = st.columns([3, 1, 1])
     with col1:
         search_query = st.text_input(
             "Search for items", 
             placeholder="e.g., 'blue wallet', 'iPhone', 'textbook', 'keys'...",
-            label_visibility="collapsed"
+            label_visibility="collapsed",
+            key="search_query"
         )
     with col2:
         status_filter = st.selectbox("Filter", ["All Items", "Lost", "Found"])
+    with col3:
+        category_filter = st.selectbox("Category", ["All"] + CATEGORIES)
+    with st.expander("More filters"):
+        fcol1, fcol2 = st.columns(2)
+        with fcol1:
+            location_filter = st.text_input("Location", placeholder="e.g., 'Library'", key="location_filter")
+        with fcol2:
+            period = st.selectbox("Reported", list(REPORTED_WITHIN))
+    days = REPORTED_WITHIN[period]
+    filtering = category_filter != "All" or bool(location_filter) or days is not None
     
-    # Search button
-    if st.button("Search", type="primary", use_container_width=True) or search_query:
-        if search_query:
-            search_results(search_query, status_filter)
-        else:
-            st.warning("Please enter a search term")
-    
-    # Display all items if no search
-    if not search_query:
+    # Enter in the search box, the button and a picked suggestion all run the search;
+    # suggestions for the entered text are shown above its results
+    searched = st.button("Search", type="primary", use_container_width=True)
+    if search_query:
+        show_suggestions(search_query)
+        search_results(search_query, status_filter, category_filter)
+    elif filtering:
+        filter_results(status_filter, category_filter, location_filter, days)
+    elif searched:
+        st.warning("Please enter a search term")
+    else:
+        # Display all items if no search
         st.subheader("Recent Items")
         display_all_items()
 
-def search_results(query, status_filter):
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_suggestions(prefix):
+    try:
+        response = requests.get(f"{API_URL}/suggest", params={"prefix": prefix, "limit": 5}, timeout=2)
+        if response.status_code == 200:
+            return response.json().get("suggestions", [])
+    except Exception:
+        pass
+    return []
+
+def pick_suggestion(suggestion):
+    """Button callback: search for the suggestion (locations become the location filter)"""
+    if suggestion["type"] == "location":
+        st.session_state["location_filter"] = suggestion["text"]
+        st.session_state["search_query"] = ""
+    else:
+        st.session_state["search_query"] = suggestion["text"]
+
+def show_suggestions(prefix):
+    """Completions for the text typed so far, as buttons"""
+    suggestions = [s for s in fetch_suggestions(prefix) if s["text"].lower() != prefix.strip().lower()]
+    if not suggestions:
+        return
+    st.caption("Suggestions")
+    cols = st.columns(len(suggestions))
+    for col, suggestion in zip(cols, suggestions):
+        with col:
+            label = f"📍 {suggestion['text']}" if suggestion["type"] == "location" else suggestion["text"]
+            st.button(label, key=f"suggestion_{suggestion['type']}_{suggestion['text']}",
+                      on_click=pick_suggestion, args=(suggestion,), use_container_width=True)
+
+def search_results(query, status_filter, category_filter="All"):
     """Display search results"""
     try:
         params = {"q": query}  # Changed from "query" to "q" to match backend
         if status_filter != "All Items":
             params["status"] = status_filter
+        if category_filter != "All":
+            # Matched server-side through the canonical category taxonomy
+            params["category"] = category_filter
         
         response = requests.get(f"{API_URL}/search/", params=params, timeout=10)
+        fuzzy = False
+        if response.status_code == 200 and query and not response.json().get('items'):
+            # Nothing contains the exact text; retry tolerating typos ("walet", "iphne")
+            response = requests.get(f"{API_URL}/search/", params={**params, "mode": "fuzzy"}, timeout=10)
+            fuzzy = True
         
         if response.status_code == 200:
             data = response.json()
@@ -146,16 +246,53 @@ def search_results(query, status_filter):
                 st.info("No items found matching your search. Try different keywords.")
                 return
             
-            st.success(f"Found {len(items)} matching items")
+            if fuzzy:
+                st.success(f"No exact matches - showing {len(items)} close matches")
+            else:
+                st.success(f"Found {len(items)} matching items")
             
+            thumbnails = fetch_thumbnails(items)
             for item in items:
-                display_item_card(item)
+                display_item_card(item, thumbnails)
         else:
             st.error("Search service temporarily unavailable. Please try again.")
     
     except Exception as e:
         st.error("Unable to connect to search service. Please check your connection.")
 
+def filter_results(status_filter, category_filter, location_filter, days):
+    """Display items matching the filters (no search text) from the structured query endpoint"""
+    try:
+        params = {}
+        if status_filter != "All Items":
+            params["status"] = status_filter
+        if category_filter != "All":
+            params["category"] = category_filter
+        if location_filter:
+            params["location"] = location_filter
+        if days:
+            params["days"] = days
+
+        response = requests.get(f"{API_URL}/items/query", params=params, timeout=10)
+
+        if response.status_code == 200:
+            items = response.json().get('items', [])
+
+            if not items:
+                st.info("No items match these filters.")
+                return
+
+            st.success(f"Found {len(items)} matching items")
+
+            thumbnails = fetch_thumbnails(items)
+            for item in items:
+                display_item_card(item, thumbnails)
+        else:
+            st.error("Search service temporarily unavailable. Please try again.")
+
+    except Exception as e:
+        st.error("Unable to connect to search service. Please check your connection.")
+
 def display_all_items():
     """Display all items in a clean format"""
     try:
@@ -171,8 +308,9 @@ def display_all_items():
             # Show recent items (limit to 10 for performance)
             recent_items = items[:10] if len(items) > 10 else items
             
+            thumbnails = fetch_thumbnails(recent_items)
             for item in recent_items:
-                display_item_card(item)
+                display_item_card(item, thumbnails)
             
             if len(items) > 10:
                 st.info(f"Showing 10 most recent items. Total items: {len(items)}")
@@ -182,7 +320,7 @@ def display_all_items():
     except Exception as e:
         st.error("Service temporarily unavailable")
 
-def display_item_card(item):
+def display_item_card(item, thumbnails=None):
     """Display individual item in a professional card format"""
     if len(item) >= 9:
         item_id, title, description, category, location, status, name, contact, image_url, timestamp = item[:10]
@@ -194,8 +332,9 @@ def display_item_card(item):
         with col1:
             if image_url:
                 try:
-                    image_id = image_url.split('/')[-1] if '/images/' in image_url else image_url
-                    st.image(f"{API_URL}/images/{image_id}", width=120)
+                    image_id = image_id_from_url(image_url)
+                    thumbnail = (thumbnails or {}).get(image_id)
+                    st.image(thumbnail or f"{API_URL}/images/{image_id}", width=120)
                 except:
                     st.write("📷")
             else:
@@ -237,10 +376,7 @@ def report_page():
         col1, col2 = st.columns(2)
         with col1:
             title = st.text_input("Item Name *", placeholder="e.g., Blue Wallet, iPhone 13, Physics Textbook")
-            category = st.selectbox("Category", [
-                "Electronics", "Books & Stationery", "Clothing & Accessories", 
-                "Documents & Cards", "Sports Equipment", "Personal Items", "Other"
-            ])
+            category = st.selectbox("Category", CATEGORIES)
         
         with col2:
             status = st.selectbox("Status *", ["Lost", "Found"])
@@ -303,13 +439,28 @@ def report_page():
                     if image_file:
                         files["file"] = (image_file.name, image_file.getvalue(), image_file.type)
                     
-                    response = requests.post(f"{API_URL}/report/", data=form_data, files=files, timeout=30)
+                    # One key per report: resubmitting after a timeout returns the first
+                    # submission's result instead of creating a duplicate
+                    if "report_idempotency_key" not in st.session_state:
+                        st.session_state["report_idempotency_key"] = str(uuid.uuid4())
+                    headers = {"Idempotency-Key": st.session_state["report_idempotency_key"]}
+                    
+                    response = requests.post(f"{API_URL}/report/", data=form_data, files=files, headers=headers, timeout=30)
                     
                     if response.status_code == 200:
+                        st.session_state.pop("report_idempotency_key", None)
                         st.success("✅ Report submitted successfully!")
+                    elif response.status_code == 409:
+                        st.info("Your report is still being processed. Please submit again in a few seconds.")
+                    elif response.status_code == 422 and "Idempotency-Key" in response.text:
+                        # The earlier submission went through with different details
+                        st.session_state.pop("report_idempotency_key", None)
+                        st.warning("Your previous report was already received. Submit again to file this as a new report.")
                     else:
                         st.error("Failed to submit report. Please try again.")
                         
+            except requests.exceptions.Timeout:
+                st.error("The server is taking longer than usual. Please submit again; your report won't be duplicated.")
             except Exception as e:
                 st.error("Unable to submit report. Please check your connection and try again.")
 